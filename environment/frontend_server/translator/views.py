@@ -183,6 +183,42 @@ def replay(request, sim_code, step):
   return render(request, template, context)
 
 
+def replay_save_journal(memory, scratch, spatial, associative): 
+  """
+  The backend appends most saves of a persona to journal.jsonl in its 
+  bootstrap_memory folder rather than rewriting the memory files (see 
+  save_journal.py in the backend). This applies those saves to the memory 
+  files we read, so that we show the persona's latest state. 
+
+  ARGS:
+    memory: The bootstrap_memory folder. 
+    scratch: The dictionary of scratch.json. 
+    spatial: The dictionary of spatial_memory.json. 
+    associative: The dictionary of associative_memory/nodes.json. 
+  RETURNS: 
+    The (scratch, spatial, associative) tuple with the journal applied. 
+  """
+  f_journal = memory + "/journal.jsonl"
+  if not os.path.exists(f_journal): 
+    return scratch, spatial, associative
+
+  with open(f_journal) as f: 
+    for line in f: 
+      try: 
+        record = json.loads(line)
+      except ValueError: 
+        # A save that is being written (or was interrupted). 
+        break
+      scratch.update(record["scratch"])
+      if record.get("spatial_memory") is not None: 
+        spatial = record["spatial_memory"]
+      for node_details in record["nodes"]: 
+        associative[f"node_{node_details['node_count']}"] = node_details
+      for node_id, last_accessed in record["last_accessed"].items(): 
+        associative[node_id]["last_accessed"] = last_accessed
+  return scratch, spatial, associative
+
+
 def replay_persona_state(request, sim_code, step, persona_name): 
   sim_code = sim_code
   step = int(step)
@@ -202,6 +238,9 @@ def replay_persona_state(request, sim_code, step, persona_name):
   with open(memory + "/associative_memory/nodes.json") as json_file:  
     associative = json.load(json_file)
 
+  scratch, spatial, associative = replay_save_journal(memory, scratch, 
+                                                     spatial, associative)
+
   a_mem_event = []
   a_mem_chat = []
   a_mem_thought = []
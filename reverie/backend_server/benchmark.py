@@ -0,0 +1,312 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: benchmark.py
+Description: Measures the throughput of the simulation step loop.
+
+The benchmark forks a stored simulation (base_the_ville_n25 by default), runs
+it headless on the offline LLM backend (see llm_backend.py), and reports the
+steps per second, the time of each cognitive phase (see step_profiler.py),
+the peak resident set size, and the allocation counts. The results are
+written as JSON so that the runs of two commits can be compared; with
+--baseline, the run fails if it is slower than the baseline by more than
+--max-slowdown.
+
+The offline backend answers every prompt deterministically, so two runs of
+the same commit take the same steps. The movement digest in the results
+checks this: if it differs from the baseline's, the change altered what the
+personas do rather than just how fast they do it. Python randomizes the hash
+of strings per process, which changes the order of some sets, so the
+benchmark runs itself with PYTHONHASHSEED=0 unless it is set.
+
+e.g., python benchmark.py --steps 200 --output bench.json
+      python benchmark.py --steps 200 --baseline bench.json
+"""
+import argparse
+import contextlib
+import datetime
+import gc
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+from utils import *
+from reverie import *
+
+
+def peak_rss_kb():
+  """
+  Returns the peak resident set size of this process in kilobytes, or None
+  where the resource module is not available (e.g., on Windows).
+  """
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == "darwin":
+    # macOS reports bytes rather than kilobytes.
+    peak //= 1024
+  return peak
+
+
+def git_commit():
+  # The commit of the working tree, or None if we are not in a git checkout.
+  try:
+    return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                   stderr=subprocess.DEVNULL,
+                                   text=True).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def movement_digest(sim_folder, first_step, last_step):
+  """
+  Returns a hash of the movements of the personas in a range of steps.
+
+  INPUT
+    sim_folder: The simulation folder.
+    first_step: The first step of the range.
+    last_step: The step after the last step of the range.
+  OUTPUT
+    A sha1 hex digest.
+  """
+  digest = hashlib.sha1()
+  for step in range(first_step, last_step):
+    with open(f"{sim_folder}/movement/{step}.json") as f:
+      movements = json.load(f)["persona"]
+    digest.update(json.dumps(movements, sort_keys=True).encode("utf-8"))
+  return digest.hexdigest()
+
+
+def percentile(values, fraction):
+  # The value below which <fraction> of the sorted <values> fall.
+  if not values:
+    return None
+  values = sorted(values)
+  return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_benchmark(fork_sim_code, steps, persona_workers=1, seed=0,
+                  trace_allocations=False, keep=False, verbose=False):
+  """
+  Forks <fork_sim_code>, runs it headless for <steps> steps on the offline
+  LLM backend, and measures the run.
+
+  INPUT
+    fork_sim_code: The stored simulation to fork.
+    steps: The number of steps to run.
+    persona_workers: The number of threads that step the personas.
+    seed: The seed of the random number generator.
+    trace_allocations: If True, the peak of the memory that Python
+                       allocates is traced as well. This slows the run down
+                       considerably, so the timings are not comparable.
+    keep: If True, the forked simulation is kept rather than removed.
+    verbose: If True, the debug output of the simulation is printed.
+  OUTPUT
+    A dictionary of the results.
+  """
+  sim_code = (f"benchmark-{fork_sim_code}-"
+              + datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f"))
+  sim_folder = f"{fs_storage}/{sim_code}"
+  output = contextlib.nullcontext()
+  if not verbose:
+    output = contextlib.redirect_stdout(open(os.devnull, "w"))
+
+  profiling = step_profiler.enabled
+  step_profiler.enabled = True
+  gc.collect()
+  gc_before = [i["collections"] for i in gc.get_stats()]
+  blocks_before = sys.getallocatedblocks()
+  if trace_allocations:
+    tracemalloc.start()
+
+  try:
+    with output:
+      start = time.perf_counter()
+      # The fork is pinned to the offline backend before the server is 
+      # built, so that it never sets up the live backend of the base 
+      # simulation (which needs openai and an API key).
+      set_llm_backend("offline")
+      rs = ReverieServer(fork_sim_code, sim_code, llm_backend="offline")
+      for persona in rs.personas.values():
+        persona.load_memory()
+      init_seconds = time.perf_counter() - start
+
+      rs.persona_workers = persona_workers
+      random.seed(seed)
+      first_step = rs.step
+
+      # The time the profiler spends writing its rows is left out of the 
+      # run time, and reported on its own.
+      write_seconds = step_profiler.write_seconds
+      start = time.perf_counter()
+      rs.run_headless(steps)
+      run_seconds = time.perf_counter() - start
+      profiler_seconds = step_profiler.write_seconds - write_seconds
+      run_seconds -= profiler_seconds
+
+    # The peak memory is taken before we read the profile back, so that it
+    # is the peak of the simulation alone.
+    peak_rss = peak_rss_kb()
+    traced_peak = None
+    if trace_allocations:
+      traced_peak = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+    blocks_after = sys.getallocatedblocks()
+    gc_after = [i["collections"] for i in gc.get_stats()]
+
+    phases, step_seconds = total_profile(
+      iter_profile(f"{sim_folder}/reverie/profile.jsonl", sim_code))
+    digest = movement_digest(sim_folder, first_step, first_step + steps)
+  finally:
+    step_profiler.enabled = profiling
+    if not keep:
+      shutil.rmtree(sim_folder, ignore_errors=True)
+
+  return {
+    "commit": git_commit(),
+    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "python_hash_seed": os.environ.get("PYTHONHASHSEED"),
+    "fork_sim_code": fork_sim_code,
+    "sim_code": sim_code if keep else None,
+    "steps": steps,
+    "personas": len(rs.personas),
+    "persona_workers": persona_workers,
+    "seed": seed,
+    "init_seconds": init_seconds,
+    "run_seconds": run_seconds,
+    "profiler_seconds": profiler_seconds,
+    "steps_per_sec": steps / run_seconds if run_seconds else None,
+    "step_seconds": {"mean": sum(step_seconds) / max(1, len(step_seconds)),
+                     "p50": percentile(step_seconds, 0.5),
+                     "p95": percentile(step_seconds, 0.95),
+                     "max": max(step_seconds, default=None)},
+    "phases": phases,
+    "peak_rss_kb": peak_rss,
+    "allocated_blocks": blocks_after - blocks_before,
+    "gc_collections": [after - before for before, after
+                       in zip(gc_before, gc_after)],
+    "traced_peak_bytes": traced_peak,
+    "movement_digest": digest,
+  }
+
+
+def compare_results(result, baseline, max_slowdown):
+  """
+  Compares a run to a baseline run.
+
+  INPUT
+    result: The results of run_benchmark.
+    baseline: The results of an earlier run_benchmark.
+    max_slowdown: The largest drop in steps per second that is allowed, as a
+                  fraction of the baseline (e.g., 0.1 for 10%).
+  OUTPUT
+    A (passed, report) pair, where <passed> is False if the run is too slow,
+    and <report> is a str.
+  """
+  report = ""
+  for key in ["fork_sim_code", "steps", "persona_workers", "seed"]:
+    if result[key] != baseline[key]:
+      report += (f"Note: {key} differs from the baseline "
+                 + f"({result[key]} vs {baseline[key]}).\n")
+  ratio = result["steps_per_sec"] / baseline["steps_per_sec"]
+  report += (f"steps/sec: {result['steps_per_sec']:.2f} vs "
+             + f"{baseline['steps_per_sec']:.2f} ({ratio - 1:+.1%})\n")
+  for phase, totals in result["phases"].items():
+    before = baseline["phases"].get(phase, dict()).get("wall_seconds")
+    if before:
+      change = totals["wall_seconds"] / before - 1
+      report += (f"  {phase:<10}{totals['wall_seconds']:>10.3f} s vs "
+                 + f"{before:>10.3f} s ({change:+.1%})\n")
+  if result["movement_digest"] != baseline["movement_digest"]:
+    report += "Note: the personas moved differently than in the baseline.\n"
+  passed = ratio >= 1 - max_slowdown
+  if not passed:
+    report += (f"FAILED: steps/sec dropped by more than "
+               + f"{max_slowdown:.0%}.\n")
+  return passed, report.rstrip("\n")
+
+
+def print_result(result):
+  print (f"{result['fork_sim_code']}: {result['steps']} steps, "
+         + f"{result['personas']} personas, "
+         + f"{result['persona_workers']} worker(s)")
+  print (f"init: {result['init_seconds']:.3f} s, "
+         + f"run: {result['run_seconds']:.3f} s "
+         + f"(+{result['profiler_seconds']:.3f} s writing the profile), "
+         + f"steps/sec: {result['steps_per_sec']:.2f}")
+  step_seconds = result["step_seconds"]
+  print (f"step: mean {step_seconds['mean'] * 1000:.2f} ms, "
+         + f"p50 {step_seconds['p50'] * 1000:.2f} ms, "
+         + f"p95 {step_seconds['p95'] * 1000:.2f} ms, "
+         + f"max {step_seconds['max'] * 1000:.2f} ms")
+  for phase, totals in result["phases"].items():
+    print (f"  {phase:<10}{totals['wall_seconds']:>10.3f} s"
+           + f"{totals['llm_calls']:>8} llm"
+           + f"{totals['embedding_calls']:>8} embed"
+           + f"{totals['path_searches']:>8} path")
+  print (f"peak rss: {result['peak_rss_kb']} KB, "
+         + f"allocated blocks: {result['allocated_blocks']:+d}, "
+         + f"gc collections: {result['gc_collections']}")
+  if result["traced_peak_bytes"] is not None:
+    print (f"traced peak: {result['traced_peak_bytes']} bytes")
+  print (f"movement digest: {result['movement_digest']}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Benchmarks the simulation step loop on the offline LLM "
+                + "backend.")
+  parser.add_argument("--fork", default="base_the_ville_n25",
+                      help="the stored simulation to fork")
+  parser.add_argument("--steps", type=int, default=100,
+                      help="the number of steps to run")
+  parser.add_argument("--workers", type=int, default=1,
+                      help="the number of threads that step the personas")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--trace-allocations", action="store_true",
+                      help="trace the peak of the memory Python allocates "
+                           + "(slow)")
+  parser.add_argument("--keep", action="store_true",
+                      help="keep the forked simulation")
+  parser.add_argument("--verbose", action="store_true",
+                      help="print the debug output of the simulation")
+  parser.add_argument("--output", help="the JSON file to write the results to")
+  parser.add_argument("--baseline",
+                      help="the JSON results of an earlier run to compare to")
+  parser.add_argument("--max-slowdown", type=float, default=0.1,
+                      help="the largest drop in steps/sec allowed against "
+                           + "the baseline (default: 0.1)")
+  args = parser.parse_args()
+
+  if "PYTHONHASHSEED" not in os.environ:
+    os.environ["PYTHONHASHSEED"] = "0"
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+  result = run_benchmark(args.fork, args.steps, args.workers, args.seed,
+                         args.trace_allocations, args.keep, args.verbose)
+  print_result(result)
+  if args.output:
+    with open(args.output, "w") as outfile:
+      outfile.write(json.dumps(result, indent=2))
+
+  if args.baseline:
+    with open(args.baseline) as json_file:
+      baseline = json.load(json_file)
+    passed, report = compare_results(result, baseline, args.max_slowdown)
+    print (report)
+    if not passed:
+      sys.exit(1)
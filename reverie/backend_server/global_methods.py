@@ -15,6 +15,7 @@ import sys
 import numpy
 import math
 import shutil, errno
+import threading
 
 from os import listdir
 
@@ -225,6 +226,40 @@ def copyanything(src, dst):
     else: raise
 
 
+# <_thread_rng> holds a per-thread random number generator. It is only set 
+# while ReverieServer steps the personas concurrently, so that the random 
+# draws of one persona do not depend on how the threads were scheduled.
+_thread_rng = threading.local()
+
+
+def set_thread_rng(rng): 
+  """
+  Sets (or with None, clears) the random number generator of the current 
+  thread. 
+  ARGS:
+    rng: A random.Random instance, or None. 
+  RETURNS: 
+    None
+  """
+  _thread_rng.rng = rng
+
+
+def get_rng(): 
+  """
+  Returns the random number generator of the current thread, falling back 
+  to the shared one of the random module. 
+  ARGS:
+    None
+  RETURNS: 
+    A random.Random instance or the random module. Both have the same 
+    choice/randint/sample interface. 
+  """
+  rng = getattr(_thread_rng, "rng", None)
+  if rng is None: 
+    return random
+  return rng
+
+
 if __name__ == '__main__':
   pass
 
@@ -5,15 +5,81 @@ File: maze.py
 Description: Defines the Maze class, which represents the map of the simulated
 world in a 2-dimensional matrix. 
 """
+import hashlib
 import json
 import numpy
+import os
 import datetime
 import pickle
 import time
 import math
 
+from collections import OrderedDict, deque
+
 from global_methods import *
 from utils import *
+from path_finder import *
+
+# <distance_field_cache_size> is the number of distance fields (see 
+# Maze.get_distance_field) that a maze keeps. This can be overridden in 
+# utils.py. 
+try: 
+  from utils import distance_field_cache_size
+except ImportError: 
+  distance_field_cache_size = 512
+
+# <use_compiled_maze> turns the compiled maze file (see Maze.load_compiled) 
+# on or off. This can be overridden in utils.py. 
+try: 
+  from utils import use_compiled_maze
+except ImportError: 
+  use_compiled_maze = True
+
+# The compiled maze is saved as <compiled_maze_file> in the matrix folder. It 
+# holds the Maze attributes in <compiled_maze_attributes>, and is only used if
+# its <compiled_maze_version> matches; bump the version whenever compile 
+# changes what it sets up. 
+compiled_maze_file = "compiled_maze.pkl"
+compiled_maze_version = 2
+compiled_maze_attributes = ["world", "tile_names", "tile_labels", 
+                            "collision_maze", "collision", "tile_events", 
+                            "event_tiles", "address_tiles"]
+
+# <event_cell_size> is the width and height in tiles of the grid cells that 
+# Maze.event_tiles is bucketed by. 
+event_cell_size = 8
+
+# The files in the matrix folder that a maze is compiled from. 
+maze_files = ["maze_meta_info.json", 
+              "special_blocks/world_blocks.csv", 
+              "special_blocks/sector_blocks.csv", 
+              "special_blocks/arena_blocks.csv", 
+              "special_blocks/game_object_blocks.csv", 
+              "special_blocks/spawning_location_blocks.csv", 
+              "maze/collision_maze.csv", 
+              "maze/sector_maze.csv", 
+              "maze/arena_maze.csv", 
+              "maze/game_object_maze.csv", 
+              "maze/spawning_location_maze.csv"]
+
+
+def hash_maze_files(matrix_folder): 
+  """
+  Returns the hashes of the files that a maze is compiled from. The compiled
+  maze is out of date as soon as one of them changes. 
+
+  INPUT
+    matrix_folder: The matrix folder of the maze (e.g., env_matrix). 
+  OUTPUT
+    A dictionary that takes a file in <maze_files> and returns the sha1 hash
+    of its contents. 
+  """
+  hashes = dict()
+  for maze_file in maze_files: 
+    with open(f"{matrix_folder}/{maze_file}", "rb") as f: 
+      hashes[maze_file] = hashlib.sha1(f.read()).hexdigest()
+  return hashes
+
 
 class Maze: 
   def __init__(self, maze_name): 
@@ -33,6 +99,36 @@ class Maze:
     # e.g., "planning to stay at home all day and never go out of her home"
     self.special_constraint = meta_info["special_constraint"]
 
+    # READING IN THE MAZE
+    # Parsing the maze files is most of the work of setting up a maze, so 
+    # what comes out of it is saved to a compiled maze file in the matrix
+    # folder. We load that file instead for as long as the maze files it was
+    # compiled from are unchanged. 
+    if not self.load_compiled(env_matrix): 
+      self.compile(env_matrix)
+      self.save_compiled(env_matrix)
+
+    # <distance_fields> takes a string address and returns its distance 
+    # field (see get_distance_field). It only keeps the 
+    # <distance_field_cache_size> most recently used fields. 
+    self.distance_fields = OrderedDict()
+
+    # <nearby_addresses> takes the bounds of a square of tiles (see 
+    # get_nearby_bounds) and returns the addresses in it (see 
+    # get_nearby_addresses). There are at most as many squares as tiles. 
+    self.nearby_addresses = dict()
+
+
+  def compile(self, matrix_folder): 
+    """
+    Reads in the maze files of a matrix folder and sets up the tile grid and
+    the address index (the attributes in compiled_maze_attributes). 
+
+    INPUT
+      matrix_folder: The matrix folder of the maze (e.g., env_matrix). 
+    OUTPUT
+      None
+    """
     # READING IN SPECIAL BLOCKS
     # Special blocks are those that are colored in the Tiled map. 
 
@@ -45,7 +141,7 @@ class Maze:
     # Tiled export. Then we basically have the block path: 
     # World, Sector, Arena, Game Object -- again, these paths need to be 
     # unique within an instance of Reverie. 
-    blocks_folder = f"{env_matrix}/special_blocks"
+    blocks_folder = f"{matrix_folder}/special_blocks"
 
     _wb = blocks_folder + "/world_blocks.csv"
     wb_rows = read_file_to_list(_wb, header=False)
@@ -74,7 +170,7 @@ class Maze:
     # [SECTION 3] Reading in the matrices 
     # This is your typical two dimensional matrices. It's made up of 0s and 
     # the number that represents the color block from the blocks folder. 
-    maze_folder = f"{env_matrix}/maze"
+    maze_folder = f"{matrix_folder}/maze"
 
     _cm = maze_folder + "/collision_maze.csv"
     collision_maze_raw = read_file_to_list(_cm, header=False)[0]
@@ -101,77 +197,75 @@ class Maze:
     arena_maze = []
     game_object_maze = []
     spawning_location_maze = []
-    for i in range(0, len(collision_maze_raw), meta_info["maze_width"]): 
-      tw = meta_info["maze_width"]
+    for i in range(0, len(collision_maze_raw), self.maze_width): 
+      tw = self.maze_width
       self.collision_maze += [collision_maze_raw[i:i+tw]]
       sector_maze += [sector_maze_raw[i:i+tw]]
       arena_maze += [arena_maze_raw[i:i+tw]]
       game_object_maze += [game_object_maze_raw[i:i+tw]]
       spawning_location_maze += [spawning_location_maze_raw[i:i+tw]]
 
-    # Once we are done loading in the maze, we now set up self.tiles. This is
-    # a matrix accessed by row:col where each access point is a dictionary
-    # that contains all the things that are taking place in that tile. 
-    # More specifically, it contains information about its "world," "sector,"
-    # "arena," "game_object," "spawning_location," as well as whether it is a
-    # collision block, and a set of all events taking place in it. 
-    # e.g., self.tiles[32][59] = {'world': 'double studio', 
-    #            'sector': '', 'arena': '', 'game_object': '', 
-    #            'spawning_location': '', 'collision': False, 'events': set()}
-    # e.g., self.tiles[9][58] = {'world': 'double studio', 
-    #         'sector': 'double studio', 'arena': 'bedroom 2', 
-    #         'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
-    #         'collision': False,
-    #         'events': {('double studio:double studio:bedroom 2:bed',
-    #                    None, None)}} 
-    self.tiles = []
-    for i in range(self.maze_height): 
-      row = []
-      for j in range(self.maze_width):
-        tile_details = dict()
-        tile_details["world"] = wb
-        
-        tile_details["sector"] = ""
-        if sector_maze[i][j] in sb_dict: 
-          tile_details["sector"] = sb_dict[sector_maze[i][j]]
-        
-        tile_details["arena"] = ""
-        if arena_maze[i][j] in ab_dict: 
-          tile_details["arena"] = ab_dict[arena_maze[i][j]]
-        
-        tile_details["game_object"] = ""
-        if game_object_maze[i][j] in gob_dict: 
-          tile_details["game_object"] = gob_dict[game_object_maze[i][j]]
-        
-        tile_details["spawning_location"] = ""
-        if spawning_location_maze[i][j] in slb_dict: 
-          tile_details["spawning_location"] = slb_dict[spawning_location_maze[i][j]]
-        
-        tile_details["collision"] = False
-        if self.collision_maze[i][j] != "0": 
-          tile_details["collision"] = True
-
-        tile_details["events"] = set()
-        
-        row += [tile_details]
-      self.tiles += [row]
-    # Each game object occupies an event in the tile. We are setting up the 
-    # default event value here. 
-    for i in range(self.maze_height):
-      for j in range(self.maze_width): 
-        if self.tiles[i][j]["game_object"]:
-          object_name = ":".join([self.tiles[i][j]["world"], 
-                                  self.tiles[i][j]["sector"], 
-                                  self.tiles[i][j]["arena"], 
-                                  self.tiles[i][j]["game_object"]])
-          go_event = (object_name, None, None, None)
-          self.tiles[i][j]["events"].add(go_event)
+    # Once we are done loading in the maze, we now set up the tile grid. 
+    # Rather than a dictionary per tile, we keep a small integer label per 
+    # tile for each level ("sector," "arena," "game_object," and 
+    # "spawning_location"). A label indexes the level's name table in 
+    # <tile_names>, where 0 stands for no name. The whole map is in a single 
+    # "world," and <collision> tells whether each tile is a collision block. 
+    # Use access_tile to get the details of a tile in the dictionary form. 
+    # e.g., self.tile_labels["arena"][9, 58] == 3
+    #       self.tile_names["arena"][3] == "bedroom 2"
+    self.world = wb
+    self.tile_names = dict()
+    self.tile_labels = dict()
+    for level, level_maze, level_dict in [
+        ("sector", sector_maze, sb_dict), 
+        ("arena", arena_maze, ab_dict), 
+        ("game_object", game_object_maze, gob_dict), 
+        ("spawning_location", spawning_location_maze, slb_dict)]: 
+      names = [""]
+      name_ids = {"": 0}
+      labels = []
+      for i in range(self.maze_height): 
+        row = []
+        for j in range(self.maze_width): 
+          name = level_dict.get(level_maze[i][j], "")
+          if name not in name_ids: 
+            name_ids[name] = len(names)
+            names += [name]
+          row += [name_ids[name]]
+        labels += [row]
+      self.tile_names[level] = names
+      self.tile_labels[level] = numpy.array(labels, dtype=numpy.uint16)
+    self.collision = numpy.array(self.collision_maze) != "0"
+
+    # <tile_events> takes an (x, y) tile coordinate and returns the set of 
+    # all events taking place in it. Only the tiles that have events are in
+    # it. Each game object occupies an event in its tiles. We are setting up
+    # the default event value here. 
+    # e.g., self.tile_events[(58, 9)] == 
+    #         {('double studio:double studio:bedroom 2:bed', 
+    #           None, None, None)}
+    self.tile_events = dict()
+    # <event_tiles> takes an arena's string address and an 
+    # (x // event_cell_size, y // event_cell_size) cell of the grid, and 
+    # returns the tiles of the arena in that cell that are in <tile_events>. 
+    # It is kept up to date by the event methods below, and lets us find the
+    # events around a tile without going over every nearby tile (see 
+    # get_nearby_event_tiles). 
+    # e.g., self.event_tiles[('double studio:double studio:bedroom 2', (7, 1))] 
+    #         == {(58, 9), (59, 9), ...}
+    self.event_tiles = dict()
+    for i, j in zip(*numpy.nonzero(self.tile_labels["game_object"])): 
+      object_name = self.get_tile_path((j, i), "game_object")
+      self.add_event_from_tile((object_name, None, None, None), 
+                               (int(j), int(i)))
 
     # Reverse tile access. 
     # <self.address_tiles> -- given a string address, we return a set of all 
     # tile coordinates belonging to that address (this is opposite of  
-    # self.tiles that give you the string address given a coordinate). This is
-    # an optimization component for finding paths for the personas' movement. 
+    # access_tile that gives you the string address given a coordinate). This
+    # is an optimization component for finding paths for the personas' 
+    # movement. 
     # self.address_tiles['<spawn_loc>bedroom-2-a'] == {(58, 9)}
     # self.address_tiles['double studio:recreation:pool table'] 
     #   == {(29, 14), (31, 11), (30, 14), (32, 11), ...}, 
@@ -179,24 +273,16 @@ class Maze:
     for i in range(self.maze_height):
       for j in range(self.maze_width): 
         addresses = []
-        if self.tiles[i][j]["sector"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}'
-          addresses += [add]
-        if self.tiles[i][j]["arena"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}:'
-          add += f'{self.tiles[i][j]["arena"]}'
-          addresses += [add]
-        if self.tiles[i][j]["game_object"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}:'
-          add += f'{self.tiles[i][j]["arena"]}:'
-          add += f'{self.tiles[i][j]["game_object"]}'
-          addresses += [add]
-        if self.tiles[i][j]["spawning_location"]: 
-          add = f'<spawn_loc>{self.tiles[i][j]["spawning_location"]}'
-          addresses += [add]
+        if self.tile_labels["sector"][i, j]: 
+          addresses += [self.get_tile_path((j, i), "sector")]
+        if self.tile_labels["arena"][i, j]: 
+          addresses += [self.get_tile_path((j, i), "arena")]
+        if self.tile_labels["game_object"][i, j]: 
+          addresses += [self.get_tile_path((j, i), "game_object")]
+        if self.tile_labels["spawning_location"][i, j]: 
+          spawning_location = (self.tile_names["spawning_location"]
+                               [self.tile_labels["spawning_location"][i, j]])
+          addresses += [f'<spawn_loc>{spawning_location}']
 
         for add in addresses: 
           if add in self.address_tiles: 
@@ -205,6 +291,165 @@ class Maze:
             self.address_tiles[add] = set([(j, i)])
 
 
+  def load_compiled(self, matrix_folder): 
+    """
+    Loads the compiled maze of a matrix folder if there is one and it was 
+    compiled from the maze files that are there now. 
+
+    INPUT
+      matrix_folder: The matrix folder of the maze (e.g., env_matrix). 
+    OUTPUT
+      True if the compiled maze was loaded, and False if the maze needs to be
+      compiled. 
+    """
+    if not use_compiled_maze: 
+      return False
+    try: 
+      with open(f"{matrix_folder}/{compiled_maze_file}", "rb") as f: 
+        compiled = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError): 
+      return False
+    if (compiled.get("version") != compiled_maze_version 
+        or compiled.get("sources") != hash_maze_files(matrix_folder)): 
+      return False
+    for attribute in compiled_maze_attributes: 
+      setattr(self, attribute, compiled[attribute])
+    return True
+
+
+  def save_compiled(self, matrix_folder): 
+    """
+    Saves the compiled maze to the matrix folder. This is skipped if the 
+    folder cannot be written to. 
+
+    INPUT
+      matrix_folder: The matrix folder of the maze (e.g., env_matrix). 
+    OUTPUT
+      None
+    """
+    if not use_compiled_maze: 
+      return
+    compiled = {"version": compiled_maze_version, 
+                "sources": hash_maze_files(matrix_folder)}
+    for attribute in compiled_maze_attributes: 
+      compiled[attribute] = getattr(self, attribute)
+    # We write to a temporary file first so that a maze that is starting up
+    # at the same time never reads a half written file. 
+    f_compiled = f"{matrix_folder}/{compiled_maze_file}"
+    try: 
+      with open(f"{f_compiled}.{os.getpid()}", "wb") as f: 
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(f"{f_compiled}.{os.getpid()}", f_compiled)
+    except OSError: 
+      pass
+
+
+  def get_distance_field(self, address): 
+    """
+    Returns the distance field of an address: for every tile, the number of
+    steps to the closest walkable tile of the address. It is computed with 
+    a breadth-first search that starts from all tiles of the address at 
+    once, the first time it is needed. 
+
+    INPUT
+      address: The string address of our interest; a key of 
+               self.address_tiles. 
+    OUTPUT
+      A flat int16 array (row by row) of the distances, which are -1 for the
+      tiles that cannot reach the address. 
+    """
+    if address in self.distance_fields: 
+      self.distance_fields.move_to_end(address)
+      return self.distance_fields[address]
+
+    blocked, width = collision_grid(self.collision_maze, collision_block_id)
+    field = [-1] * len(blocked)
+    frontier = deque()
+    for x, y in sorted(self.address_tiles.get(address, [])): 
+      idx = y * width + x
+      if not blocked[idx]: 
+        field[idx] = 0
+        frontier += [idx]
+    while frontier: 
+      idx = frontier.popleft()
+      row, col = divmod(idx, width)
+      neighbors = []
+      if row > 0: 
+        neighbors += [idx - width]
+      if col > 0: 
+        neighbors += [idx - 1]
+      if row < self.maze_height - 1: 
+        neighbors += [idx + width]
+      if col < width - 1: 
+        neighbors += [idx + 1]
+      for n_idx in neighbors: 
+        if not blocked[n_idx] and field[n_idx] == -1: 
+          field[n_idx] = field[idx] + 1
+          frontier += [n_idx]
+
+    field = numpy.array(field, dtype=numpy.int16)
+    self.distance_fields[address] = field
+    if len(self.distance_fields) > distance_field_cache_size: 
+      self.distance_fields.popitem(last=False)
+    return field
+
+
+  def path_to_address(self, curr_tile, address): 
+    """
+    Returns the shortest path from a tile to the closest walkable tile of an
+    address by walking down the address's distance field. 
+
+    INPUT
+      curr_tile: The tile coordinate to start from in (x, y) form. 
+      address: The string address of our interest; a key of 
+               self.address_tiles. 
+    OUTPUT
+      The list of (x, y) tiles from <curr_tile> to the tile of the address,
+      both included. None if the address cannot be reached within 
+      max_path_dist steps (see path_finder.py). 
+    EXAMPLE OUTPUT
+      Given (58, 9) and 'double studio:double studio:bedroom 2:bed', 
+      [(58, 9), (58, 10), (59, 10)]
+    """
+    with step_profiler.path_search(): 
+      field = self.get_distance_field(address)
+    width = self.maze_width
+    x, y = curr_tile
+
+    # Each step goes to the first of the up, left, down, and right neighbors
+    # that is one step closer, as in path_finder. 
+    def neighbors(x, y): 
+      if y > 0: 
+        yield x, y - 1
+      if x > 0: 
+        yield x - 1, y
+      if y < self.maze_height - 1: 
+        yield x, y + 1
+      if x < width - 1: 
+        yield x + 1, y
+
+    dist = int(field[y * width + x])
+    if dist == -1: 
+      # We may be standing on a blocked tile, which the field skips. 
+      n_dists = [int(field[n_y * width + n_x]) 
+                 for n_x, n_y in neighbors(x, y)]
+      n_dists = [n_dist for n_dist in n_dists if n_dist != -1]
+      if n_dists: 
+        dist = min(n_dists) + 1
+    if dist == -1 or dist > max_path_dist: 
+      return None
+
+    path = [(x, y)]
+    while dist > 0: 
+      for n_x, n_y in neighbors(x, y): 
+        if field[n_y * width + n_x] == dist - 1: 
+          x, y = n_x, n_y
+          break
+      path += [(x, y)]
+      dist -= 1
+    return path
+
+
   def turn_coordinate_to_tile(self, px_coordinate): 
     """
     Turns a pixel coordinate to a tile coordinate. 
@@ -225,8 +470,9 @@ class Maze:
 
   def access_tile(self, tile): 
     """
-    Returns the tiles details dictionary that is stored in self.tiles of the 
-    designated x, y location. 
+    Returns the tile details dictionary of the designated x, y location. 
+    Note that the "events" set is only kept by the maze if the tile has 
+    events; use add_event_from_tile and the like to change the events. 
 
     INPUT
       tile: The tile coordinate of our interest in (x, y) form.
@@ -234,16 +480,23 @@ class Maze:
       The tile detail dictionary for the designated tile. 
     EXAMPLE OUTPUT
       Given (58, 9), 
-      self.tiles[9][58] = {'world': 'double studio', 
-            'sector': 'double studio', 'arena': 'bedroom 2', 
-            'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
-            'collision': False,
-            'events': {('double studio:double studio:bedroom 2:bed',
-                       None, None)}} 
+      {'world': 'double studio', 
+       'sector': 'double studio', 'arena': 'bedroom 2', 
+       'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
+       'collision': False,
+       'events': {('double studio:double studio:bedroom 2:bed',
+                  None, None)}} 
     """
     x = tile[0]
     y = tile[1]
-    return self.tiles[y][x]
+    tile_details = dict()
+    tile_details["world"] = self.world
+    for level in ["sector", "arena", "game_object", "spawning_location"]: 
+      tile_details[level] = (self.tile_names[level]
+                             [self.tile_labels[level].item(y, x)])
+    tile_details["collision"] = self.collision.item(y, x)
+    tile_details["events"] = self.tile_events.get((x, y), set())
+    return tile_details
 
 
   def get_tile_path(self, tile, level): 
@@ -262,44 +515,41 @@ class Maze:
     """
     x = tile[0]
     y = tile[1]
-    tile = self.tiles[y][x]
 
-    path = f"{tile['world']}"
+    path = f"{self.world}"
     if level == "world": 
       return path
     else: 
-      path += f":{tile['sector']}"
+      path += (":" + self.tile_names['sector']
+               [self.tile_labels['sector'].item(y, x)])
     
     if level == "sector": 
       return path
     else: 
-      path += f":{tile['arena']}"
+      path += (":" + self.tile_names['arena']
+               [self.tile_labels['arena'].item(y, x)])
 
     if level == "arena": 
       return path
     else: 
-      path += f":{tile['game_object']}"
+      path += (":" + self.tile_names['game_object']
+               [self.tile_labels['game_object'].item(y, x)])
 
     return path
 
 
-  def get_nearby_tiles(self, tile, vision_r): 
+  def get_nearby_bounds(self, tile, vision_r): 
     """
-    Given the current tile and vision_r, return a list of tiles that are 
-    within the radius. Note that this implementation looks at a square 
-    boundary when determining what is within the radius. 
-    i.e., for vision_r, returns x's. 
-    x x x x x 
-    x x x x x
-    x x P x x 
-    x x x x x
-    x x x x x
+    Given the current tile and vision_r, return the bounds of the square of
+    tiles that are within the radius (see get_nearby_tiles). 
 
     INPUT: 
       tile: The tile coordinate of our interest in (x, y) form.
       vision_r: The radius of the persona's vision. 
     OUTPUT: 
-      nearby_tiles: a list of tiles that are within the radius. 
+      (left_end, right_end, top_end, bottom_end): The x range 
+      [left_end, right_end) and the y range [top_end, bottom_end) of the 
+      square. 
     """
     left_end = 0
     if tile[0] - vision_r > left_end: 
@@ -317,6 +567,30 @@ class Maze:
     if tile[1] - vision_r > top_end: 
       top_end = tile[1] - vision_r 
 
+    return left_end, right_end, top_end, bottom_end
+
+
+  def get_nearby_tiles(self, tile, vision_r): 
+    """
+    Given the current tile and vision_r, return a list of tiles that are 
+    within the radius. Note that this implementation looks at a square 
+    boundary when determining what is within the radius. 
+    i.e., for vision_r, returns x's. 
+    x x x x x 
+    x x x x x
+    x x P x x 
+    x x x x x
+    x x x x x
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+    OUTPUT: 
+      nearby_tiles: a list of tiles that are within the radius. 
+    """
+    left_end, right_end, top_end, bottom_end = self.get_nearby_bounds(
+                                                 tile, vision_r)
+
     nearby_tiles = []
     for i in range(left_end, right_end): 
       for j in range(top_end, bottom_end): 
@@ -324,6 +598,89 @@ class Maze:
     return nearby_tiles
 
 
+  def get_nearby_addresses(self, tile, vision_r): 
+    """
+    Given the current tile and vision_r, return the distinct (sector, arena, 
+    game_object) names of the tiles within the radius, in the order their 
+    first tile comes in get_nearby_tiles. This reads the label arrays of the
+    square at once rather than calling access_tile on every tile, and the 
+    result is kept for the next persona that looks at the same square. 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+    OUTPUT: 
+      A list of (sector, arena, game_object) string tuples; the levels that
+      a tile does not have are empty strings. 
+      e.g., [("double studio", "bedroom 2", "bed"), ...]
+    """
+    bounds = self.get_nearby_bounds(tile, vision_r)
+    if bounds in self.nearby_addresses: 
+      return self.nearby_addresses[bounds]
+    left_end, right_end, top_end, bottom_end = bounds
+
+    # We combine the three labels of each tile into a single number, and 
+    # transpose the square so that it is in the x-major order of 
+    # get_nearby_tiles. 
+    labels = [self.tile_labels[level][top_end:bottom_end, left_end:right_end]
+              .T.ravel().astype(numpy.int64) 
+              for level in ["sector", "arena", "game_object"]]
+    n_arenas = len(self.tile_names["arena"])
+    n_game_objects = len(self.tile_names["game_object"])
+    keys = (labels[0] * n_arenas + labels[1]) * n_game_objects + labels[2]
+    _, first = numpy.unique(keys, return_index=True)
+
+    addresses = []
+    for i in sorted(first.tolist()): 
+      addresses += [(self.tile_names["sector"][labels[0][i]], 
+                     self.tile_names["arena"][labels[1][i]], 
+                     self.tile_names["game_object"][labels[2][i]])]
+    self.nearby_addresses[bounds] = addresses
+    return addresses
+
+
+  def get_nearby_event_tiles(self, tile, vision_r, arena_path): 
+    """
+    Given the current tile and vision_r, return the tiles within the radius
+    that are in the designated arena and have events. This looks up the 
+    grid cells around the tile in <event_tiles> rather than going over 
+    every tile that get_nearby_tiles returns. 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+      arena_path: The string address of the arena. 
+        e.g., "double studio:double studio:bedroom 2"
+    OUTPUT: 
+      event_tiles: a list of tiles in the same order as get_nearby_tiles. 
+    """
+    left_end, right_end, top_end, bottom_end = self.get_nearby_bounds(
+                                                 tile, vision_r)
+
+    event_tiles = []
+    for cell_x in range(left_end // event_cell_size, 
+                        right_end // event_cell_size + 1): 
+      for cell_y in range(top_end // event_cell_size, 
+                          bottom_end // event_cell_size + 1): 
+        for x, y in self.event_tiles.get((arena_path, (cell_x, cell_y)), []): 
+          if left_end <= x < right_end and top_end <= y < bottom_end: 
+            event_tiles += [(x, y)]
+    return sorted(event_tiles)
+
+
+  def get_event_tiles_key(self, tile): 
+    """
+    Returns the key of <event_tiles> that a tile belongs to. 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+    OUTPUT: 
+      The (arena string address, grid cell) key. 
+    """
+    return (self.get_tile_path(tile, "arena"), 
+            (tile[0] // event_cell_size, tile[1] // event_cell_size))
+
+
   def add_event_from_tile(self, curr_event, tile): 
     """
     Add an event triple to a tile.  
@@ -336,7 +693,11 @@ class Maze:
     OUPUT: 
       None
     """
-    self.tiles[tile[1]][tile[0]]["events"].add(curr_event)
+    if (tile[0], tile[1]) not in self.tile_events: 
+      self.tile_events[(tile[0], tile[1])] = set()
+      (self.event_tiles.setdefault(self.get_event_tiles_key(tile), set())
+                       .add((tile[0], tile[1])))
+    self.tile_events[(tile[0], tile[1])].add(curr_event)
 
 
   def remove_event_from_tile(self, curr_event, tile):
@@ -351,19 +712,17 @@ class Maze:
     OUPUT: 
       None
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
+    events = self.tile_events.get((tile[0], tile[1]), set())
+    events.discard(curr_event)
+    if not events: 
+      self.remove_tile_from_events(tile)
 
 
   def turn_event_from_tile_idle(self, curr_event, tile):
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
-        new_event = (event[0], None, None, None)
-        self.tiles[tile[1]][tile[0]]["events"].add(new_event)
+    events = self.tile_events.get((tile[0], tile[1]), set())
+    if curr_event in events: 
+      events.remove(curr_event)
+      events.add((curr_event[0], None, None, None))
 
 
   def remove_subject_events_from_tile(self, subject, tile):
@@ -376,41 +735,36 @@ class Maze:
     OUPUT: 
       None
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event[0] == subject:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    events = self.tile_events.get((tile[0], tile[1]), set())
+    for event in [event for event in events if event[0] == subject]: 
+      events.remove(event)
+    if not events: 
+      self.remove_tile_from_events(tile)
 
 
+  def remove_tile_from_events(self, tile): 
+    """
+    Removes a tile that has no events left from <tile_events> and 
+    <event_tiles>. 
 
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+    OUPUT: 
+      None
+    """
+    if self.tile_events.pop((tile[0], tile[1]), None) is not None: 
+      key = self.get_event_tiles_key(tile)
+      self.event_tiles[key].discard((tile[0], tile[1]))
+      if not self.event_tiles[key]: 
+        del self.event_tiles[key]
+
+
+if __name__ == '__main__':
+  # Compiles the maze of env_matrix ahead of time. 
+  # e.g., python maze.py
+  maze = Maze("the_ville")
+  if not maze.load_compiled(env_matrix): 
+    print ("the compiled maze is turned off or could not be saved to", 
+           env_matrix)
+  else: 
+    print ("compiled maze saved to", f"{env_matrix}/{compiled_maze_file}")
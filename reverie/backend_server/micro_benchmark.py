@@ -0,0 +1,336 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: micro_benchmark.py
+Description: Times retrieval, perception, and pathfinding in isolation.
+
+Where benchmark.py measures whole steps, this measures the functions that a
+step spends most of its non-LLM time in, at sizes a long simulation grows
+into:
+  1) new_retrieve, over an associative memory that is filled up with
+     synthetic events and thoughts to 1k, 10k, and 100k nodes;
+  2) perceive, on a maze where a given fraction of the walkable tiles of
+     every arena hold an event;
+  3) path_finder (A* search) and Maze.path_to_address (distance fields),
+     between random tiles on the collision grid, grouped by the distance
+     between the two.
+Each function is timed with timeit: the number of calls per round is picked
+so that a round takes at least 0.2 seconds, and the median of several
+rounds is reported.
+
+The personas and the maze are loaded from a stored simulation, and the LLM
+requests go to the offline backend (see llm_backend.py), so no API key or
+network access is needed. Nothing is written back to the simulation.
+
+e.g., python micro_benchmark.py --sizes 1000,10000 --output micro.json
+"""
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import timeit
+
+import numpy as np
+
+from utils import *
+from maze import *
+from path_finder import *
+from persona.persona import *
+from persona.prompt_template.gpt_structure import *
+
+# Words that the synthetic memories are made up of.
+synthetic_subjects = ["Isabella Rodriguez", "Maria Lopez", "Klaus Mueller",
+                      "the cafe", "the park", "the library", "the store",
+                      "the college", "the pharmacy", "the supply store"]
+synthetic_predicates = ["is", "was", "will be", "likes", "wants"]
+synthetic_objects = ["reading a book", "brewing coffee", "talking to a friend",
+                     "writing a paper", "planning a party", "taking a walk",
+                     "painting a picture", "cleaning the kitchen",
+                     "studying chemistry", "listening to music",
+                     "fixing a shelf", "watering the plants"]
+
+
+def measure(func, repeat=5):
+  """
+  Times a function that takes no arguments.
+
+  INPUT
+    func: The function.
+    repeat: The number of rounds.
+  OUTPUT
+    A dictionary of the number of calls per round, and the best, median,
+    and standard deviation of the seconds per call over the rounds.
+  """
+  timer = timeit.Timer(func)
+  number, _ = timer.autorange()
+  times = [i / number for i in timer.repeat(repeat, number)]
+  return {"calls": number,
+          "repeat": repeat,
+          "best": min(times),
+          "median": statistics.median(times),
+          "stdev": statistics.stdev(times) if len(times) > 1 else 0.0}
+
+
+def load_persona(sim_code, persona_name):
+  # Loads a persona of a stored simulation without forking it.
+  return Persona(persona_name, f"{fs_storage}/{sim_code}/personas/"
+                               + f"{persona_name}", lazy=False)
+
+
+def fill_memory(persona, n_nodes, rng):
+  """
+  Adds synthetic events and thoughts (4 to 1) to a persona's associative
+  memory until it holds <n_nodes> nodes. They are spread over the 30 days
+  before the persona's current time, and their embeddings are random unit
+  vectors.
+
+  INPUT
+    persona: The <Persona>.
+    n_nodes: The number of nodes the memory should hold.
+    rng: The numpy random Generator to draw from.
+  OUTPUT
+    None
+  """
+  a_mem = persona.a_mem
+  dim = 1536
+  if a_mem.embeddings.dim:
+    dim = a_mem.embeddings.dim
+  start = persona.scratch.curr_time - datetime.timedelta(days=30)
+  n_new = n_nodes - len(a_mem.id_to_node)
+  offsets = np.sort(rng.uniform(0, 30 * 24 * 3600, max(0, n_new)))
+  for count in range(n_new):
+    s = synthetic_subjects[rng.integers(len(synthetic_subjects))]
+    p = synthetic_predicates[rng.integers(len(synthetic_predicates))]
+    o = synthetic_objects[rng.integers(len(synthetic_objects))]
+    description = f"{s} {p} {o} ({count})"
+    created = start + datetime.timedelta(seconds=float(offsets[count]))
+    embedding = rng.standard_normal(dim).astype(np.float32)
+    embedding /= np.linalg.norm(embedding)
+    keywords = set([s, o.split()[0]])
+    poignancy = int(rng.integers(1, 11))
+    if count % 5 == 4:
+      a_mem.add_thought(created, None, s, p, o, description, keywords,
+                        poignancy, (description, embedding), [])
+    else:
+      a_mem.add_event(created, None, s, p, o, description, keywords,
+                      poignancy, (description, embedding), None)
+
+
+def bench_retrieve(sim_code, persona_name, sizes, repeat, seed):
+  """
+  Times new_retrieve on memories of each of the given sizes.
+
+  INPUT
+    sim_code: The stored simulation to load the persona from.
+    persona_name: The persona whose memory is filled up.
+    sizes: A list of the numbers of nodes.
+    repeat: The number of timing rounds.
+    seed: The seed of the random number generator.
+  OUTPUT
+    A list of result dictionaries, one per size.
+  """
+  results = []
+  focal_points = ["What is Isabella Rodriguez planning for the party?",
+                  "Maria Lopez is studying chemistry at the library",
+                  "Klaus Mueller is writing a research paper"]
+  for n_nodes in sizes:
+    rng = np.random.default_rng(seed)
+    persona = load_persona(sim_code, persona_name)
+    if not persona.scratch.curr_time:
+      persona.scratch.curr_time = datetime.datetime(2023, 2, 13, 12)
+    fill_memory(persona, n_nodes, rng)
+    # The first search reads the embeddings into the index.
+    new_retrieve(persona, focal_points)
+    for n_focal in [1, len(focal_points)]:
+      timing = measure(lambda: new_retrieve(persona, focal_points[:n_focal]),
+                       repeat)
+      results += [dict(timing, function="new_retrieve",
+                       nodes=len(persona.a_mem.id_to_node),
+                       focal_points=n_focal)]
+  return results
+
+
+def walkable_arena_tiles(maze):
+  # The walkable tiles that are in an arena, in (x, y) form.
+  walkable = ~maze.collision & (maze.tile_labels["arena"] > 0)
+  return [(int(x), int(y)) for y, x in zip(*np.nonzero(walkable))]
+
+
+def bench_perceive(sim_code, persona_name, densities, n_positions, repeat,
+                   seed):
+  """
+  Times perceive on mazes with different numbers of events.
+
+  The persona's retention is raised above the number of events, so that
+  after the warm-up every event counts as already perceived. The timings
+  then measure the perception itself rather than the LLM requests and the
+  memory writes of new events.
+
+  INPUT
+    sim_code: The stored simulation to load the persona and maze from.
+    persona_name: The persona that perceives.
+    densities: A list of the fractions of walkable tiles with an event.
+    n_positions: The number of random tiles the persona perceives from.
+    repeat: The number of timing rounds.
+    seed: The seed of the random number generator.
+  OUTPUT
+    A list of result dictionaries, one per density.
+  """
+  results = []
+  for density in densities:
+    rng = random.Random(seed)
+    maze = Maze("the_ville")
+    tiles = walkable_arena_tiles(maze)
+    event_tiles = rng.sample(tiles, int(density * len(tiles)))
+    for count, tile in enumerate(event_tiles):
+      address = maze.get_tile_path(tile, "game_object")
+      maze.add_event_from_tile((f"{address}:synthetic {count}", "is",
+                                "busy", "busy"), tile)
+
+    persona = load_persona(sim_code, persona_name)
+    if not persona.scratch.curr_time:
+      persona.scratch.curr_time = datetime.datetime(2023, 2, 13, 12)
+    persona.scratch.retention = len(event_tiles) + 1
+    positions = rng.sample(tiles, n_positions)
+    for tile in positions:
+      persona.scratch.curr_tile = tile
+      perceive(persona, maze)
+
+    position_cycle = itertools.cycle(positions)
+    def perceive_next():
+      persona.scratch.curr_tile = next(position_cycle)
+      perceive(persona, maze)
+    timing = measure(perceive_next, repeat)
+    results += [dict(timing, function="perceive", density=density,
+                     events=len(event_tiles),
+                     vision_r=persona.scratch.vision_r,
+                     att_bandwidth=persona.scratch.att_bandwidth)]
+  return results
+
+
+def bench_path(n_pairs, repeat, seed):
+  """
+  Times path_finder and Maze.path_to_address between random tiles of the
+  ville, grouped by the Manhattan distance between the two tiles.
+
+  INPUT
+    n_pairs: The number of random pairs in each distance group.
+    repeat: The number of timing rounds.
+    seed: The seed of the random number generator.
+  OUTPUT
+    A list of result dictionaries, one per function and distance group.
+  """
+  rng = random.Random(seed)
+  maze = Maze("the_ville")
+  walkable = ~maze.collision
+  tiles = [(int(x), int(y)) for y, x in zip(*np.nonzero(walkable))]
+  groups = [(0, 20), (20, 60), (60, 150)]
+  # The addresses of the game objects, with one of their tiles as the goal
+  # that the distance is measured to.
+  addresses = [(address, next(iter(address_tiles)))
+               for address, address_tiles in maze.address_tiles.items()
+               if address.count(":") == 3 and address_tiles]
+
+  results = []
+  for low, high in groups:
+    pairs = []
+    targets = []
+    while len(pairs) < n_pairs or len(targets) < n_pairs:
+      start = rng.choice(tiles)
+      end = rng.choice(tiles)
+      if (len(pairs) < n_pairs
+          and low <= abs(start[0] - end[0]) + abs(start[1] - end[1]) < high):
+        pairs += [(start, end)]
+      address, goal = rng.choice(addresses)
+      if (len(targets) < n_pairs
+          and low <= abs(start[0] - goal[0]) + abs(start[1] - goal[1]) < high):
+        targets += [(start, address)]
+
+    pair_cycle = itertools.cycle(pairs)
+    def find_next_path():
+      start, end = next(pair_cycle)
+      path_finder(maze.collision_maze, start, end, collision_block_id)
+    timing = measure(find_next_path, repeat)
+    results += [dict(timing, function="path_finder", distance=[low, high],
+                     pairs=n_pairs)]
+
+    # The distance fields are cached, so we time the walk down a field that
+    # is already computed, as well as computing the field.
+    for start, address in targets:
+      maze.path_to_address(start, address)
+    target_cycle = itertools.cycle(targets)
+    def path_to_next_address():
+      start, address = next(target_cycle)
+      maze.path_to_address(start, address)
+    timing = measure(path_to_next_address, repeat)
+    results += [dict(timing, function="path_to_address", distance=[low, high],
+                     pairs=n_pairs)]
+
+  address_cycle = itertools.cycle(addresses)
+  def compute_next_field():
+    maze.distance_fields.clear()
+    maze.get_distance_field(next(address_cycle)[0])
+  timing = measure(compute_next_field, repeat)
+  results += [dict(timing, function="get_distance_field",
+                   addresses=len(addresses))]
+  return results
+
+
+def print_results(results):
+  for result in results:
+    params = ", ".join(f"{key}={val}" for key, val in result.items()
+                       if key not in ["function", "calls", "repeat", "best",
+                                      "median", "stdev"])
+    print (f"{result['function']:<20}{result['median'] * 1000:>10.3f} ms "
+           + f"(best {result['best'] * 1000:.3f}, "
+           + f"stdev {result['stdev'] * 1000:.3f})  {params}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Times retrieval, perception, and pathfinding in isolation.")
+  parser.add_argument("--sim", default="base_the_ville_isabella_maria_klaus",
+                      help="the stored simulation to load from")
+  parser.add_argument("--persona", default="Isabella Rodriguez")
+  parser.add_argument("--only", default="retrieve,perceive,path",
+                      help="the benchmarks to run (comma-separated)")
+  parser.add_argument("--sizes", default="1000,10000,100000",
+                      help="the memory sizes for retrieve (comma-separated)")
+  parser.add_argument("--densities", default="0.01,0.05,0.2",
+                      help="the event densities for perceive "
+                           + "(comma-separated)")
+  parser.add_argument("--positions", type=int, default=50,
+                      help="the number of tiles to perceive from")
+  parser.add_argument("--pairs", type=int, default=200,
+                      help="the number of random pairs per distance group")
+  parser.add_argument("--repeat", type=int, default=5,
+                      help="the number of timing rounds")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--output", help="the JSON file to write the results to")
+  args = parser.parse_args()
+
+  set_llm_backend("offline")
+  only = args.only.split(",")
+  results = []
+  # The cognitive modules print a lot of debug output, which we drop.
+  with contextlib.redirect_stdout(open(os.devnull, "w")):
+    if "retrieve" in only:
+      sizes = [int(i) for i in args.sizes.split(",")]
+      results += bench_retrieve(args.sim, args.persona, sizes, args.repeat,
+                                args.seed)
+    if "perceive" in only:
+      densities = [float(i) for i in args.densities.split(",")]
+      results += bench_perceive(args.sim, args.persona, densities,
+                                args.positions, args.repeat, args.seed)
+    if "path" in only:
+      results += bench_path(args.pairs, args.repeat, args.seed)
+  print_results(results)
+
+  if args.output:
+    with open(args.output, "w") as outfile:
+      outfile.write(json.dumps(results, indent=2))
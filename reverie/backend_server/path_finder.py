@@ -5,8 +5,12 @@ File: path_finder.py
 Description: Implements various path finding functions for generative agents.
 Some of the functions are defunct. 
 """
+import heapq
+
 import numpy as np
 
+from step_profiler import *
+
 def print_maze(maze):
   for row in maze:
     for item in row:
@@ -93,81 +97,138 @@ def path_finder_v1(maze, start, end, collision_block_char, verbose=False):
   return path
 
 
-def path_finder_v2(a, start, end, collision_block_char, verbose=False):
-  def make_step(m, k):
-    for i in range(len(m)):
-      for j in range(len(m[i])):
-        if m[i][j] == k:
-          if i>0 and m[i-1][j] == 0 and a[i-1][j] == 0:
-            m[i-1][j] = k + 1
-          if j>0 and m[i][j-1] == 0 and a[i][j-1] == 0:
-            m[i][j-1] = k + 1
-          if i<len(m)-1 and m[i+1][j] == 0 and a[i+1][j] == 0:
-            m[i+1][j] = k + 1
-          if j<len(m[i])-1 and m[i][j+1] == 0 and a[i][j+1] == 0:
-             m[i][j+1] = k + 1
-
-  new_maze = []
-  for row in a: 
-    new_row = []
-    for j in row:
-      if j == collision_block_char: 
-        new_row += [1]
-      else: 
-        new_row += [0]
-    new_maze += [new_row]
-  a = new_maze
-
-  m = []
-  for i in range(len(a)):
-      m.append([])
-      for j in range(len(a[i])):
-          m[-1].append(0)
-  i,j = start
-  m[i][j] = 1 
-
-  k = 0
-  except_handle = 150
-  while m[end[0]][end[1]] == 0:
-      k += 1
-      make_step(m, k)
-
-      if except_handle == 0: 
-        break
-      except_handle -= 1 
-
+# <max_path_dist> is the longest path (in steps) that path_finder_v2 looks 
+# for. If the end is farther than this (or cannot be reached), the returned 
+# path is just [end]. This matches the 150 step cap of the original flood 
+# fill search. 
+max_path_dist = 151
+
+# <_grid_cache> takes (id(maze), collision_block_char) and returns the maze 
+# along with its precomputed grid, so that we do not rebuild the grid on 
+# every call. The collision maze does not change during a simulation. 
+_grid_cache = dict()
+
+
+def collision_grid(maze, collision_block_char): 
+  """
+  Returns the collision grid of a maze: a flat list of bools (row by row) 
+  that is True for the tiles that are blocked. 
+
+  INPUT
+    maze: A 2D list of tiles; e.g., maze.collision_maze.
+    collision_block_char: The value of the blocked tiles. 
+  OUTPUT
+    blocked: The flat list of bools.
+    width: The int number of columns of the maze. 
+  """
+  key = (id(maze), collision_block_char)
+  if key not in _grid_cache or _grid_cache[key][0] is not maze: 
+    blocked = [tile == collision_block_char for row in maze for tile in row]
+    _grid_cache[key] = (maze, blocked, len(maze[0]))
+  return _grid_cache[key][1], _grid_cache[key][2]
+
+
+def path_finder_astar(blocked, width, start, end, max_dist=max_path_dist):
+  """
+  Finds the shortest path between two tiles with A* search (with the 
+  Manhattan distance as its heuristic). 
+
+  Among the shortest paths, it returns the one the original flood fill 
+  search did: walking back from the end, each step goes to the first of the 
+  up, left, down, and right neighbors that is one step closer to the start. 
+  To do that, the search keeps going until every tile that could be on a 
+  shortest path has its exact distance from the start. 
+
+  INPUT
+    blocked: The flat collision grid (see collision_grid). 
+    width: The int number of columns of the grid. 
+    start: The (row, col) tuple to start from. 
+    end: The (row, col) tuple to go to. 
+    max_dist: The longest path to look for. 
+  OUTPUT
+    The list of (row, col) tuples from <start> to <end>, both included. If 
+    <end> cannot be reached within <max_dist> steps, [end]. 
+  """
+  height = len(blocked) // width
+  start_idx = start[0] * width + start[1]
+  end_idx = end[0] * width + end[1]
+  end_row, end_col = end
+  if start_idx != end_idx and blocked[end_idx]: 
+    return [tuple(end)]
+
+  # <dist> takes a tile index and returns its (tentative) distance from the 
+  # start. The start tile is always walkable, as in the flood fill. 
+  dist = {start_idx: 0}
+  closed = set()
+  open_set = [(abs(start[0] - end_row) + abs(start[1] - end_col), 
+               0, start_idx)]
+  end_dist = None
+  while open_set: 
+    f, g, idx = heapq.heappop(open_set)
+    if f > max_dist or (end_dist is not None and f > end_dist): 
+      break
+    if idx in closed: 
+      continue
+    closed.add(idx)
+    if idx == end_idx: 
+      end_dist = g
+      continue
+
+    row, col = divmod(idx, width)
+    neighbors = []
+    if row > 0: 
+      neighbors += [idx - width]
+    if col > 0: 
+      neighbors += [idx - 1]
+    if row < height - 1: 
+      neighbors += [idx + width]
+    if col < width - 1: 
+      neighbors += [idx + 1]
+    for n_idx in neighbors: 
+      if not blocked[n_idx] and g + 1 < dist.get(n_idx, g + 2): 
+        dist[n_idx] = g + 1
+        n_row, n_col = divmod(n_idx, width)
+        heapq.heappush(open_set, 
+                       (g + 1 + abs(n_row - end_row) + abs(n_col - end_col),
+                        g + 1, n_idx))
+
+  if end_dist is None: 
+    return [tuple(end)]
+
+  # Walking back from the end. A neighbor whose distance is k-1 is always on 
+  # a shortest path, and those are all closed with their exact distance. 
   i, j = end
-  k = m[i][j]
-  the_path = [(i,j)]
-  while k > 1:
-    if i > 0 and m[i - 1][j] == k-1:
-      i, j = i-1, j
-      the_path.append((i, j))
-      k-=1
-    elif j > 0 and m[i][j - 1] == k-1:
-      i, j = i, j-1
-      the_path.append((i, j))
-      k-=1
-    elif i < len(m) - 1 and m[i + 1][j] == k-1:
-      i, j = i+1, j
-      the_path.append((i, j))
-      k-=1
-    elif j < len(m[i]) - 1 and m[i][j + 1] == k-1:
-      i, j = i, j+1
-      the_path.append((i, j))
-      k -= 1
-        
+  k = end_dist
+  the_path = [(i, j)]
+  while k > 0: 
+    if i > 0 and dist.get((i - 1) * width + j) == k - 1: 
+      i, j = i - 1, j
+    elif j > 0 and dist.get(i * width + j - 1) == k - 1: 
+      i, j = i, j - 1
+    elif i < height - 1 and dist.get((i + 1) * width + j) == k - 1: 
+      i, j = i + 1, j
+    else: 
+      i, j = i, j + 1
+    the_path.append((i, j))
+    k -= 1
+
   the_path.reverse()
   return the_path
 
 
+def path_finder_v2(a, start, end, collision_block_char, verbose=False):
+  blocked, width = collision_grid(a, collision_block_char)
+  return path_finder_astar(blocked, width, tuple(start), tuple(end))
+
+
 def path_finder(maze, start, end, collision_block_char, verbose=False):
   # EMERGENCY PATCH
   start = (start[1], start[0])
   end = (end[1], end[0])
   # END EMERGENCY PATCH
 
-  path = path_finder_v2(maze, start, end, collision_block_char, verbose)
+  with step_profiler.path_search(): 
+    path = path_finder_v2(maze, start, end, collision_block_char, verbose)
 
   new_path = []
   for i in path: 
@@ -115,7 +115,7 @@ def generate_one_utterance(maze, init_persona, target_persona, retrieved, curr_c
               f"{target_persona.scratch.name}.")
 
   print ("July 23 5")
-  x = run_gpt_generate_iterative_chat_utt(maze, init_persona, target_persona, retrieved, curr_context, curr_chat)[0]
+  x = run_gpt_prompt_generate_iterative_chat_utt(maze, init_persona, target_persona, retrieved, curr_context, curr_chat)[0]
 
   print ("July 23 6")
 
@@ -237,18 +237,26 @@ def generate_poig_score(persona, event_type, description):
 
 
 def load_history_via_whisper(personas, whispers):
+  # We first turn every whisper into a thought, so that all of the thoughts
+  # can be embedded in one request. 
+  thoughts = []
   for count, row in enumerate(whispers): 
     persona = personas[row[0]]
     whisper = row[1]
+    thoughts += [generate_inner_thought(persona, whisper)]
+  thought_embeddings = get_embeddings(thoughts)
 
-    thought = generate_inner_thought(persona, whisper)
+  for count, row in enumerate(whispers): 
+    persona = personas[row[0]]
+    whisper = row[1]
+    thought = thoughts[count]
 
     created = persona.scratch.curr_time
     expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
     s, p, o = generate_action_event_triple(thought, persona)
     keywords = set([s, p, o])
     thought_poignancy = generate_poig_score(persona, "event", whisper)
-    thought_embedding_pair = (thought, get_embedding(thought))
+    thought_embedding_pair = (thought, thought_embeddings[count])
     persona.a_mem.add_thought(created, expiration, s, p, o, 
                               thought, keywords, thought_poignancy, 
                               thought_embedding_pair, None)
@@ -41,6 +41,9 @@ def execute(persona, maze, personas, plan):
     # <target_tiles> is a list of tile coordinates where the persona may go 
     # to execute the current action. The goal is to pick one of them.
     target_tiles = None
+    # <path> is set right away when the maze's distance field for the 
+    # action's address gives us the path (see below). 
+    path = None
 
     print ('aldhfoaf/????')
     print (plan)
@@ -92,53 +95,63 @@ def execute(persona, maze, personas, plan):
         maze.address_tiles["Johnson Park:park:park garden"] #ERRORRRRRRR
       else: 
         target_tiles = maze.address_tiles[plan]
-
-    # There are sometimes more than one tile returned from this (e.g., a tabe
-    # may stretch many coordinates). So, we sample a few here. And from that 
-    # random sample, we will take the closest ones. 
-    if len(target_tiles) < 4: 
-      target_tiles = random.sample(list(target_tiles), len(target_tiles))
-    else:
-      target_tiles = random.sample(list(target_tiles), 4)
-    # If possible, we want personas to occupy different tiles when they are 
-    # headed to the same location on the maze. It is ok if they end up on the 
-    # same time, but we try to lower that probability. 
-    # We take care of that overlap here.  
-    persona_name_set = set(personas.keys())
-    new_target_tiles = []
-    for i in target_tiles: 
-      curr_event_set = maze.access_tile(i)["events"]
-      pass_curr_tile = False
-      for j in curr_event_set: 
-        if j[0] in persona_name_set: 
-          pass_curr_tile = True
-      if not pass_curr_tile: 
-        new_target_tiles += [i]
-    if len(new_target_tiles) == 0: 
-      new_target_tiles = target_tiles
-    target_tiles = new_target_tiles
-
-    # Now that we've identified the target tile, we find the shortest path to
-    # one of the target tiles. 
-    curr_tile = persona.scratch.curr_tile
-    collision_maze = maze.collision_maze
-    closest_target_tile = None
-    path = None
-    for i in target_tiles: 
-      # path_finder takes a collision_mze and the curr_tile coordinate as 
-      # an input, and returns a list of coordinate tuples that becomes the
-      # path. 
-      # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
-      curr_path = path_finder(maze.collision_maze, 
-                              curr_tile, 
-                              i, 
-                              collision_block_id)
-      if not closest_target_tile: 
-        closest_target_tile = i
-        path = curr_path
-      elif len(curr_path) < len(path): 
-        closest_target_tile = i
-        path = curr_path
+        # The distance field of the address leads us straight to its 
+        # closest tile. We take that path unless another persona is already
+        # on that tile, in which case we fall back to the search below. 
+        path = maze.path_to_address(persona.scratch.curr_tile, plan)
+        if path: 
+          for event in maze.access_tile(path[-1])["events"]: 
+            if event[0] in personas and event[0] != persona.name: 
+              path = None
+              break
+
+    if not path: 
+      # There are sometimes more than one tile returned from this (e.g., a tabe
+      # may stretch many coordinates). So, we sample a few here. And from that 
+      # random sample, we will take the closest ones. 
+      if len(target_tiles) < 4: 
+        target_tiles = random.sample(list(target_tiles), len(target_tiles))
+      else:
+        target_tiles = random.sample(list(target_tiles), 4)
+      # If possible, we want personas to occupy different tiles when they are 
+      # headed to the same location on the maze. It is ok if they end up on the 
+      # same time, but we try to lower that probability. 
+      # We take care of that overlap here.  
+      persona_name_set = set(personas.keys())
+      new_target_tiles = []
+      for i in target_tiles: 
+        curr_event_set = maze.access_tile(i)["events"]
+        pass_curr_tile = False
+        for j in curr_event_set: 
+          if j[0] in persona_name_set: 
+            pass_curr_tile = True
+        if not pass_curr_tile: 
+          new_target_tiles += [i]
+      if len(new_target_tiles) == 0: 
+        new_target_tiles = target_tiles
+      target_tiles = new_target_tiles
+
+      # Now that we've identified the target tile, we find the shortest path to
+      # one of the target tiles. 
+      curr_tile = persona.scratch.curr_tile
+      collision_maze = maze.collision_maze
+      closest_target_tile = None
+      path = None
+      for i in target_tiles: 
+        # path_finder takes a collision_mze and the curr_tile coordinate as 
+        # an input, and returns a list of coordinate tuples that becomes the
+        # path. 
+        # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
+        curr_path = path_finder(maze.collision_maze, 
+                                curr_tile, 
+                                i, 
+                                collision_block_id)
+        if not closest_target_tile: 
+          closest_target_tile = i
+          path = curr_path
+        elif len(curr_path) < len(path): 
+          closest_target_tile = i
+          path = curr_path
 
     # Actually setting the <planned_path> and <act_path_set>. We cut the 
     # first element in the planned_path because it includes the curr_tile. 
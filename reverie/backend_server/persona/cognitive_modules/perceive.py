@@ -41,31 +41,16 @@ def perceive(persona, maze):
     ret_events: a list of <ConceptNode> that are perceived and new. 
   """
   # PERCEIVE SPACE
-  # We get the nearby tiles given our current tile and the persona's vision
-  # radius. 
-  nearby_tiles = maze.get_nearby_tiles(persona.scratch.curr_tile, 
-                                       persona.scratch.vision_r)
+  # We get the addresses of the nearby tiles given our current tile and the 
+  # persona's vision radius. The maze reads them from its label arrays, so 
+  # we do not go over the tiles one by one. 
+  nearby_addresses = maze.get_nearby_addresses(persona.scratch.curr_tile, 
+                                               persona.scratch.vision_r)
 
   # We then store the perceived space. Note that the s_mem of the persona is
   # in the form of a tree constructed using dictionaries. 
-  for i in nearby_tiles: 
-    i = maze.access_tile(i)
-    if i["world"]: 
-      if (i["world"] not in persona.s_mem.tree): 
-        persona.s_mem.tree[i["world"]] = {}
-    if i["sector"]: 
-      if (i["sector"] not in persona.s_mem.tree[i["world"]]): 
-        persona.s_mem.tree[i["world"]][i["sector"]] = {}
-    if i["arena"]: 
-      if (i["arena"] not in persona.s_mem.tree[i["world"]]
-                                              [i["sector"]]): 
-        persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]] = []
-    if i["game_object"]: 
-      if (i["game_object"] not in persona.s_mem.tree[i["world"]]
-                                                    [i["sector"]]
-                                                    [i["arena"]]): 
-        persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]] += [
-                                                             i["game_object"]]
+  for sector, arena, game_object in nearby_addresses: 
+    persona.s_mem.add_tile(maze.world, sector, arena, game_object)
 
   # PERCEIVE EVENTS. 
   # We will perceive events that take place in the same arena as the
@@ -77,22 +62,23 @@ def perceive(persona, maze):
   # We will order our percept based on the distance, with the closest ones
   # getting priorities. 
   percept_events_list = []
-  # First, we put all events that are occuring in the nearby tiles into the
-  # percept_events_list
-  for tile in nearby_tiles: 
-    tile_details = maze.access_tile(tile)
-    if tile_details["events"]: 
-      if maze.get_tile_path(tile, "arena") == curr_arena_path:  
-        # This calculates the distance between the persona's current tile, 
-        # and the target tile.
-        dist = math.dist([tile[0], tile[1]], 
-                         [persona.scratch.curr_tile[0], 
-                          persona.scratch.curr_tile[1]])
-        # Add any relevant events to our temp set/list with the distant info. 
-        for event in tile_details["events"]: 
-          if event not in percept_events_set: 
-            percept_events_list += [[dist, event]]
-            percept_events_set.add(event)
+  # First, we put all events that are occuring in the nearby tiles of the 
+  # current arena into the percept_events_list. The maze keeps the tiles 
+  # with events indexed by arena, so we only visit those. 
+  event_tiles = maze.get_nearby_event_tiles(persona.scratch.curr_tile, 
+                                            persona.scratch.vision_r, 
+                                            curr_arena_path)
+  for tile in event_tiles: 
+    # This calculates the distance between the persona's current tile, 
+    # and the target tile.
+    dist = math.dist([tile[0], tile[1]], 
+                     [persona.scratch.curr_tile[0], 
+                      persona.scratch.curr_tile[1]])
+    # Add any relevant events to our temp set/list with the distant info. 
+    for event in maze.tile_events[tile]: 
+      if event not in percept_events_set: 
+        percept_events_list += [[dist, event]]
+        percept_events_set.add(event)
 
   # We sort, and perceive only persona.scratch.att_bandwidth of the closest
   # events. If the bandwidth is larger, then it means the persona can perceive
@@ -102,6 +88,25 @@ def perceive(persona, maze):
   for dist, event in percept_events_list[:persona.scratch.att_bandwidth]: 
     perceived_events += [event]
 
+  # Embedding the new events. 
+  # We embed the descriptions of all events that are new to the persona and 
+  # that it has no embedding of yet in a single request up front, rather 
+  # than one request per event in the loop below. 
+  new_descs = []
+  for s, p, o, desc in perceived_events: 
+    if not p: 
+      p, o, desc = "is", "idle", "idle"
+    if not persona.a_mem.is_latest_event((s, p, o), 
+                                         persona.scratch.retention): 
+      desc_embedding_in = f"{s.split(':')[-1]} is {desc}"
+      if "(" in desc_embedding_in: 
+        desc_embedding_in = (desc_embedding_in.split("(")[1]
+                                              .split(")")[0]
+                                              .strip())
+      if desc_embedding_in not in persona.a_mem.embeddings: 
+        new_descs += [desc_embedding_in]
+  new_embeddings = dict(zip(new_descs, get_embeddings(new_descs)))
+
   # Storing events. 
   # <ret_events> is a list of <ConceptNode> instances from the persona's 
   # associative memory. 
@@ -116,12 +121,10 @@ def perceive(persona, maze):
     desc = f"{s.split(':')[-1]} is {desc}"
     p_event = (s, p, o)
 
-    # We retrieve the latest persona.scratch.retention events. If there is  
-    # something new that is happening (that is, p_event not in latest_events),
-    # then we add that event to the a_mem and return it. 
-    latest_events = persona.a_mem.get_summarized_latest_events(
-                                    persona.scratch.retention)
-    if p_event not in latest_events:
+    # We check p_event against the latest persona.scratch.retention events.
+    # If there is something new that is happening (that is, p_event is not 
+    # one of them), then we add that event to the a_mem and return it. 
+    if not persona.a_mem.is_latest_event(p_event, persona.scratch.retention):
       # We start by managing keywords. 
       keywords = set()
       sub = p_event[0]
@@ -140,6 +143,8 @@ def perceive(persona, maze):
                                               .strip())
       if desc_embedding_in in persona.a_mem.embeddings: 
         event_embedding = persona.a_mem.embeddings[desc_embedding_in]
+      elif desc_embedding_in in new_embeddings: 
+        event_embedding = new_embeddings[desc_embedding_in]
       else: 
         event_embedding = get_embedding(desc_embedding_in)
       event_embedding_pair = (desc_embedding_in, event_embedding)
@@ -950,6 +950,23 @@ def plan(persona, maze, personas, new_day, retrieved):
   OUTPUT 
     The target action address of the persona (persona.scratch.act_address).
   """ 
+  plan_schedule(persona, maze, new_day)
+  return plan_reaction(persona, maze, personas, retrieved)
+
+
+def plan_schedule(persona, maze, new_day): 
+  """
+  The first half of plan: the long term planning and, if the current action
+  has expired, the next action. This only reads and writes the state of 
+  <persona> itself (and reads the maze), so the personas can run it 
+  concurrently. 
+
+  INPUT: 
+    maze: Current <Maze> instance of the world. 
+    new_day: False, "First day", or "New day" (see plan). 
+  OUTPUT 
+    None
+  """
   # PART 1: Generate the hourly schedule. 
   if new_day: 
     _long_term_planning(persona, new_day)
@@ -958,6 +975,21 @@ def plan(persona, maze, personas, new_day, retrieved):
   if persona.scratch.act_check_finished(): 
     _determine_action(persona, maze)
 
+
+def plan_reaction(persona, maze, personas, retrieved): 
+  """
+  The second half of plan: reacting to the perceived events. Reacting reads
+  the state of the other personas and may change it (e.g., when starting a 
+  conversation), so the personas have to run this one after another. 
+
+  INPUT: 
+    maze: Current <Maze> instance of the world. 
+    personas: A dictionary that contains all persona names as keys, and the 
+              Persona instance as values. 
+    retrieved: dictionary of dictionary (see plan). 
+  OUTPUT 
+    The target action address of the persona (persona.scratch.act_address).
+  """
   # PART 3: If you perceived an event that needs to be responded to (saw 
   # another persona), and retrieved relevant information. 
   # Step 1: Retrieved may have multiple events represented in it. The first 
@@ -21,12 +21,10 @@ from persona.cognitive_modules.retrieve import *
 def generate_focal_points(persona, n=3): 
   if debug: print ("GNS FUNCTION: <generate_focal_points>")
   
-  nodes = [[i.last_accessed, i]
-            for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
-            if "idle" not in i.embedding_key]
-
-  nodes = sorted(nodes, key=lambda x: x[0])
-  nodes = [i for created, i in nodes]
+  # The non-idle events and thoughts, from the least to the most recently 
+  # accessed. 
+  index = persona.a_mem.index
+  nodes = [index.nodes[row] for row in index.recency_order()]
 
   statements = ""
   for node in nodes[-1*persona.scratch.importance_ele_n:]: 
@@ -119,13 +117,15 @@ def run_reflect(persona):
     for xxx in xx: print (xxx)
 
     thoughts = generate_insights_and_evidence(persona, nodes, 5)
-    for thought, evidence in thoughts.items(): 
+    # We embed all of the new thoughts in one request. 
+    thought_embeddings = get_embeddings(list(thoughts.keys()))
+    for count, (thought, evidence) in enumerate(thoughts.items()): 
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(thought, persona)
       keywords = set([s, p, o])
       thought_poignancy = generate_poig_score(persona, "thought", thought)
-      thought_embedding_pair = (thought, get_embedding(thought))
+      thought_embedding_pair = (thought, thought_embeddings[count])
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
                                 thought, keywords, thought_poignancy, 
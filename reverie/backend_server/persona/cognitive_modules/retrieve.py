@@ -9,6 +9,7 @@ sys.path.append('../../')
 
 from global_methods import *
 from persona.prompt_template.gpt_structure import *
+from persona.memory_structures.memory_index import *
 
 from numpy import dot
 from numpy.linalg import norm
@@ -30,6 +31,9 @@ def retrieve(persona, perceived):
                and "thoughts" that are relevant.
   """
   # We rerieve events and thoughts separately. 
+  # The keyword lookups return sets, whose iteration order depends on where 
+  # the nodes happen to live in memory. We list the nodes from the newest to
+  # the oldest instead so that the prompts built from them are reproducible.
   retrieved = dict()
   for event in perceived: 
     retrieved[event.description] = dict()
@@ -37,11 +41,13 @@ def retrieve(persona, perceived):
     
     relevant_events = persona.a_mem.retrieve_relevant_events(
                         event.subject, event.predicate, event.object)
-    retrieved[event.description]["events"] = list(relevant_events)
+    retrieved[event.description]["events"] = sorted(
+      relevant_events, key=lambda node: node.node_count, reverse=True)
 
     relevant_thoughts = persona.a_mem.retrieve_relevant_thoughts(
                           event.subject, event.predicate, event.object)
-    retrieved[event.description]["thoughts"] = list(relevant_thoughts)
+    retrieved[event.description]["thoughts"] = sorted(
+      relevant_thoughts, key=lambda node: node.node_count, reverse=True)
     
   return retrieved
 
@@ -217,54 +223,40 @@ def new_retrieve(persona, focal_points, n_count=30):
   """
   # <retrieved> is the main dictionary that we are returning
   retrieved = dict() 
-  for focal_pt in focal_points: 
-    # Getting all nodes from the agent's memory (both thoughts and events) and
-    # sorting them by the datetime of creation.
-    # You could also imagine getting the raw conversation, but for now. 
-    nodes = [[i.last_accessed, i]
-              for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
-              if "idle" not in i.embedding_key]
-    nodes = sorted(nodes, key=lambda x: x[0])
-    nodes = [i for created, i in nodes]
-
-    # Calculating the component dictionaries and normalizing them.
-    recency_out = extract_recency(persona, nodes)
-    recency_out = normalize_dict_floats(recency_out, 0, 1)
-    importance_out = extract_importance(persona, nodes)
-    importance_out = normalize_dict_floats(importance_out, 0, 1)  
-    relevance_out = extract_relevance(persona, nodes, focal_pt)
-    relevance_out = normalize_dict_floats(relevance_out, 0, 1)
-
-    # Computing the final scores that combines the component values. 
-    # Note to self: test out different weights. [1, 1, 1] tends to work
-    # decently, but in the future, these weights should likely be learned, 
-    # perhaps through an RL-like process.
-    # gw = [1, 1, 1]
-    # gw = [1, 2, 1]
-    gw = [0.5, 3, 2]
-    master_out = dict()
-    for key in recency_out.keys(): 
-      master_out[key] = (persona.scratch.recency_w*recency_out[key]*gw[0] 
-                     + persona.scratch.relevance_w*relevance_out[key]*gw[1] 
-                     + persona.scratch.importance_w*importance_out[key]*gw[2])
-
-    master_out = top_highest_x_values(master_out, len(master_out.keys()))
-    for key, val in master_out.items(): 
-      print (persona.a_mem.id_to_node[key].embedding_key, val)
-      print (persona.scratch.recency_w*recency_out[key]*1, 
-             persona.scratch.relevance_w*relevance_out[key]*1, 
-             persona.scratch.importance_w*importance_out[key]*1)
+  if not focal_points: 
+    return retrieved
+  index = persona.a_mem.index
+  # Note to self: test out different weights. [1, 1, 1] tends to work
+  # decently, but in the future, these weights should likely be learned, 
+  # perhaps through an RL-like process.
+  # gw = [1, 1, 1]
+  # gw = [1, 2, 1]
+  gw = [0.5, 3, 2]
+  weights = [persona.scratch.recency_w*gw[0], 
+             persona.scratch.relevance_w*gw[1], 
+             persona.scratch.importance_w*gw[2]]
+  # The memory index holds all nodes from the agent's memory (both thoughts 
+  # and events) in arrays. We embed all focal points in one request and 
+  # compare them against every memory in one matrix product. The recency and
+  # importance scores are shared by all focal points. 
+  # You could also imagine getting the raw conversation, but for now. 
+  focal_sims = index.key_similarities(get_embeddings(focal_points))
+  recency, importance = index.shared_components(persona.scratch.recency_decay)
+  for count, focal_pt in enumerate(focal_points): 
+    # The nodes are sorted by the time they were last accessed. This can 
+    # change between focal points, since retrieving a node accesses it. 
+    rows, scores = index.score(focal_sims[count], recency, importance, 
+                               weights)
 
     # Extracting the highest x values.
-    # <master_out> has the key of node.id and value of float. Once we get the 
-    # highest x values, we want to translate the node.id into nodes and return
-    # the list of nodes.
-    master_out = top_highest_x_values(master_out, n_count)
-    master_nodes = [persona.a_mem.id_to_node[key] 
-                    for key in list(master_out.keys())]
-
-    for n in master_nodes: 
-      n.last_accessed = persona.scratch.curr_time
+    top_rows = top_k_rows(rows, scores, n_count)
+    if debug: 
+      row_scores = dict(zip(rows.tolist(), scores.tolist()))
+      for row in top_rows: 
+        print (index.nodes[row].embedding_key, row_scores[row])
+
+    master_nodes = [index.nodes[row] for row in top_rows]
+    index.touch(top_rows, persona.scratch.curr_time)
       
     retrieved[focal_pt] = master_nodes
 
@@ -13,10 +13,64 @@ sys.path.append('../../')
 import json
 import datetime
 
+from collections import deque
+
 from global_methods import *
+from persona.memory_structures.memory_index import *
+from persona.memory_structures.embedding_matrix import *
+from persona.memory_structures.node_sequence import *
+
+
+def intern_str(value): 
+  # Interning makes the nodes share a single copy of the subjects, 
+  # predicates, objects, and keywords that repeat across the memory stream. 
+  if isinstance(value, str): 
+    return sys.intern(value)
+  return value
+
+
+def time_to_seconds(time): 
+  if time is None: 
+    return None
+  return (time - MemoryIndex.epoch).total_seconds()
+
+
+def seconds_to_time(seconds): 
+  if seconds is None: 
+    return None
+  return MemoryIndex.epoch + datetime.timedelta(seconds=float(seconds))
+
+
+def parse_saved_time(saved_time): 
+  """
+  Parses a time the way node_to_dict saves it (e.g., "2023-02-13 10:00:00").
+  This is the bulk of the work of loading a memory stream, so we try the 
+  much faster fromisoformat before strptime. 
+
+  INPUT
+    saved_time: The '%Y-%m-%d %H:%M:%S' string.
+  OUTPUT
+    The datetime.
+  """
+  try: 
+    return datetime.datetime.fromisoformat(saved_time)
+  except ValueError: 
+    return datetime.datetime.strptime(saved_time, '%Y-%m-%d %H:%M:%S')
 
 
 class ConceptNode: 
+  # The nodes are kept in slots rather than in a __dict__ per node, and 
+  # their times are kept as seconds since MemoryIndex.epoch. The created, 
+  # expiration, and last_accessed properties turn them back to datetimes. 
+  # Once a node is in a <MemoryIndex> (<_index> at <_row>), its last 
+  # accessed time is only kept in the index's last_accessed array. 
+  __slots__ = ["node_id", "node_count", "type_count", "type", "depth", 
+               "_created", "_expiration", "_last_accessed", 
+               "_index", "_row", 
+               "subject", "predicate", "object", 
+               "description", "embedding_key", "poignancy", "keywords", 
+               "filling"]
+
   def __init__(self,
                node_id, node_count, type_count, node_type, depth,
                created, expiration, 
@@ -28,21 +82,59 @@ class ConceptNode:
     self.type = node_type # thought / event / chat
     self.depth = depth
 
+    self._index = None
+    self._row = None
     self.created = created
     self.expiration = expiration
     self.last_accessed = self.created
 
-    self.subject = s
-    self.predicate = p
-    self.object = o
+    self.subject = intern_str(s)
+    self.predicate = intern_str(p)
+    self.object = intern_str(o)
 
     self.description = description
-    self.embedding_key = embedding_key
+    self.embedding_key = intern_str(embedding_key)
     self.poignancy = poignancy
-    self.keywords = keywords
+    self.keywords = set(intern_str(kw) for kw in keywords)
     self.filling = filling
 
 
+  @property
+  def created(self): 
+    return seconds_to_time(self._created)
+
+
+  @created.setter
+  def created(self, created): 
+    self._created = time_to_seconds(created)
+
+
+  @property
+  def expiration(self): 
+    return seconds_to_time(self._expiration)
+
+
+  @expiration.setter
+  def expiration(self, expiration): 
+    self._expiration = time_to_seconds(expiration)
+
+
+  @property
+  def last_accessed(self): 
+    if self._index is not None: 
+      return seconds_to_time(self._index.last_accessed[self._row])
+    return seconds_to_time(self._last_accessed)
+
+
+  @last_accessed.setter
+  def last_accessed(self, last_accessed): 
+    if self._index is not None: 
+      self._index.last_accessed[self._row] = time_to_seconds(last_accessed)
+      self._index.touched.add(self._row)
+    else: 
+      self._last_accessed = time_to_seconds(last_accessed)
+
+
   def spo_summary(self): 
     return (self.subject, self.predicate, self.object)
 
@@ -51,9 +143,11 @@ class AssociativeMemory:
   def __init__(self, f_saved): 
     self.id_to_node = dict()
 
-    self.seq_event = []
-    self.seq_thought = []
-    self.seq_chat = []
+    # The sequences list the nodes from the newest to the oldest. They are 
+    # <NodeSequence>s, so adding a node does not shift the older ones. 
+    self.seq_event = NodeSequence()
+    self.seq_thought = NodeSequence()
+    self.seq_chat = NodeSequence()
 
     self.kw_to_event = dict()
     self.kw_to_thought = dict()
@@ -62,45 +156,34 @@ class AssociativeMemory:
     self.kw_strength_event = dict()
     self.kw_strength_thought = dict()
 
-    self.embeddings = json.load(open(f_saved + "/embeddings.json"))
+    # <latest_events> holds the spo summaries of the latest 
+    # <latest_retention> events (newest first), and <latest_event_counts> 
+    # takes a summary and returns how many times it is in <latest_events>. 
+    # They are kept up to date by add_event (see is_latest_event). 
+    self.latest_retention = 0
+    self.latest_events = deque()
+    self.latest_event_counts = dict()
+
+    # <embeddings> takes an embedding key and returns its vector. It is 
+    # backed by a memory-mapped float32 matrix (see EmbeddingMatrix). 
+    self.embeddings = EmbeddingMatrix(f_saved)
+
+    # <index> mirrors the events and thoughts in NumPy arrays for retrieval.
+    # The nodes we load below are indexed without their embeddings, which 
+    # the index reads from <embeddings> the first time it is searched. 
+    self.index = MemoryIndex(self.embeddings)
+
+    # <accessed_nodes> holds the ids of the nodes whose last accessed time 
+    # was set with set_last_accessed, and <changed_kw_event> and 
+    # <changed_kw_thought> the keywords whose strength changed, since the 
+    # last call to clear_changes. (Retrieval touches nodes through the 
+    # index, which keeps their rows.) A save only writes those. 
+    self.clear_changes()
 
     nodes_load = json.load(open(f_saved + "/nodes.json"))
     for count in range(len(nodes_load.keys())): 
       node_id = f"node_{str(count+1)}"
-      node_details = nodes_load[node_id]
-
-      node_count = node_details["node_count"]
-      type_count = node_details["type_count"]
-      node_type = node_details["type"]
-      depth = node_details["depth"]
-
-      created = datetime.datetime.strptime(node_details["created"], 
-                                           '%Y-%m-%d %H:%M:%S')
-      expiration = None
-      if node_details["expiration"]: 
-        expiration = datetime.datetime.strptime(node_details["expiration"],
-                                                '%Y-%m-%d %H:%M:%S')
-
-      s = node_details["subject"]
-      p = node_details["predicate"]
-      o = node_details["object"]
-
-      description = node_details["description"]
-      embedding_pair = (node_details["embedding_key"], 
-                        self.embeddings[node_details["embedding_key"]])
-      poignancy =node_details["poignancy"]
-      keywords = set(node_details["keywords"])
-      filling = node_details["filling"]
-      
-      if node_type == "event": 
-        self.add_event(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "chat": 
-        self.add_chat(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "thought": 
-        self.add_thought(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
+      self.load_node(nodes_load[node_id])
 
     kw_strength_load = json.load(open(f_saved + "/kw_strength.json"))
     if kw_strength_load["kw_strength_event"]: 
@@ -108,34 +191,124 @@ class AssociativeMemory:
     if kw_strength_load["kw_strength_thought"]: 
       self.kw_strength_thought = kw_strength_load["kw_strength_thought"]
 
+    # What we just loaded is what is saved. 
+    self.clear_changes()
+
+    
+  def load_node(self, node_details): 
+    """
+    Adds a node that was saved with node_to_dict back to the memory. Its 
+    embedding has to be in <embeddings> already; it is not read until it is
+    needed. 
+
+    INPUT
+      node_details: The dictionary form of the node.
+    OUTPUT
+      The <ConceptNode>.
+    """
+    node_type = node_details["type"]
+
+    created = parse_saved_time(node_details["created"])
+    expiration = None
+    if node_details["expiration"]: 
+      expiration = parse_saved_time(node_details["expiration"])
+
+    s = node_details["subject"]
+    p = node_details["predicate"]
+    o = node_details["object"]
+
+    description = node_details["description"]
+    embedding_pair = (node_details["embedding_key"], None)
+    poignancy = node_details["poignancy"]
+    keywords = set(node_details["keywords"])
+    filling = node_details["filling"]
     
+    node = None
+    if node_type == "event": 
+      node = self.add_event(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "chat": 
+      node = self.add_chat(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "thought": 
+      node = self.add_thought(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+
+    # Memory saved before the last accessed times were kept starts out as 
+    # last accessed when it was created. 
+    if node and node_details.get("last_accessed"): 
+      self.set_last_accessed(node, 
+                             parse_saved_time(node_details["last_accessed"]))
+    return node
+
+
+  def node_to_dict(self, node): 
+    """
+    Returns the dictionary form of a node, as it is saved in nodes.json.
+
+    INPUT
+      node: The <ConceptNode>.
+    OUTPUT
+      The dictionary form of the node.
+    """
+    r = dict()
+    r["node_count"] = node.node_count
+    r["type_count"] = node.type_count
+    r["type"] = node.type
+    r["depth"] = node.depth
+
+    r["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
+    r["expiration"] = None
+    if node.expiration: 
+      r["expiration"] = node.expiration.strftime('%Y-%m-%d %H:%M:%S')
+    r["last_accessed"] = node.last_accessed.strftime('%Y-%m-%d %H:%M:%S')
+
+    r["subject"] = node.subject
+    r["predicate"] = node.predicate
+    r["object"] = node.object
+
+    r["description"] = node.description
+    r["embedding_key"] = node.embedding_key
+    r["poignancy"] = node.poignancy
+    r["keywords"] = list(node.keywords)
+    r["filling"] = node.filling
+    return r
+
+
+  def set_last_accessed(self, node, last_accessed): 
+    # The node writes the time through to the index if it is indexed. 
+    node.last_accessed = last_accessed
+    self.accessed_nodes.add(node.node_id)
+
+
+  def get_accessed_nodes(self): 
+    """
+    Returns the ids of the nodes whose last accessed time was set since the
+    last call to clear_changes. 
+
+    INPUT
+      None
+    OUTPUT
+      A set of node ids. 
+    """
+    node_ids = set(self.accessed_nodes)
+    for row in self.index.touched: 
+      node_ids.add(self.index.nodes[row].node_id)
+    return node_ids
+
+
+  def clear_changes(self): 
+    self.accessed_nodes = set()
+    self.index.touched = set()
+    self.changed_kw_event = set()
+    self.changed_kw_thought = set()
+
+
   def save(self, out_json): 
     r = dict()
     for count in range(len(self.id_to_node.keys()), 0, -1): 
       node_id = f"node_{str(count)}"
-      node = self.id_to_node[node_id]
-
-      r[node_id] = dict()
-      r[node_id]["node_count"] = node.node_count
-      r[node_id]["type_count"] = node.type_count
-      r[node_id]["type"] = node.type
-      r[node_id]["depth"] = node.depth
-
-      r[node_id]["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
-      r[node_id]["expiration"] = None
-      if node.expiration: 
-        r[node_id]["expiration"] = (node.expiration
-                                        .strftime('%Y-%m-%d %H:%M:%S'))
-
-      r[node_id]["subject"] = node.subject
-      r[node_id]["predicate"] = node.predicate
-      r[node_id]["object"] = node.object
-
-      r[node_id]["description"] = node.description
-      r[node_id]["embedding_key"] = node.embedding_key
-      r[node_id]["poignancy"] = node.poignancy
-      r[node_id]["keywords"] = list(node.keywords)
-      r[node_id]["filling"] = node.filling
+      r[node_id] = self.node_to_dict(self.id_to_node[node_id])
 
     with open(out_json+"/nodes.json", "w") as outfile:
       json.dump(r, outfile)
@@ -146,8 +319,7 @@ class AssociativeMemory:
     with open(out_json+"/kw_strength.json", "w") as outfile:
       json.dump(r, outfile)
 
-    with open(out_json+"/embeddings.json", "w") as outfile:
-      json.dump(self.embeddings, outfile)
+    self.embeddings.save(out_json)
 
 
   def add_event(self, created, expiration, s, p, o, 
@@ -174,13 +346,13 @@ class AssociativeMemory:
                        poignancy, keywords, filling)
 
     # Creating various dictionary cache for fast access. 
-    self.seq_event[0:0] = [node]
+    self.seq_event.add(node)
+    self.add_latest_event(node.spo_summary())
     keywords = [i.lower() for i in keywords]
     for kw in keywords: 
-      if kw in self.kw_to_event: 
-        self.kw_to_event[kw][0:0] = [node]
-      else: 
-        self.kw_to_event[kw] = [node]
+      if kw not in self.kw_to_event: 
+        self.kw_to_event[kw] = NodeSequence()
+      self.kw_to_event[kw].add(node)
     self.id_to_node[node_id] = node 
 
     # Adding in the kw_strength
@@ -190,8 +362,11 @@ class AssociativeMemory:
           self.kw_strength_event[kw] += 1
         else: 
           self.kw_strength_event[kw] = 1
+        self.changed_kw_event.add(kw)
 
-    self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    if embedding_pair[1] is not None: 
+      self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    self.index.add(node, embedding_pair[1])
 
     return node
 
@@ -218,13 +393,12 @@ class AssociativeMemory:
                        description, embedding_pair[0], poignancy, keywords, filling)
 
     # Creating various dictionary cache for fast access. 
-    self.seq_thought[0:0] = [node]
+    self.seq_thought.add(node)
     keywords = [i.lower() for i in keywords]
     for kw in keywords: 
-      if kw in self.kw_to_thought: 
-        self.kw_to_thought[kw][0:0] = [node]
-      else: 
-        self.kw_to_thought[kw] = [node]
+      if kw not in self.kw_to_thought: 
+        self.kw_to_thought[kw] = NodeSequence()
+      self.kw_to_thought[kw].add(node)
     self.id_to_node[node_id] = node 
 
     # Adding in the kw_strength
@@ -234,8 +408,11 @@ class AssociativeMemory:
           self.kw_strength_thought[kw] += 1
         else: 
           self.kw_strength_thought[kw] = 1
+        self.changed_kw_thought.add(kw)
 
-    self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    if embedding_pair[1] is not None: 
+      self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    self.index.add(node, embedding_pair[1])
 
     return node
 
@@ -257,16 +434,19 @@ class AssociativeMemory:
                        description, embedding_pair[0], poignancy, keywords, filling)
 
     # Creating various dictionary cache for fast access. 
-    self.seq_chat[0:0] = [node]
+    self.seq_chat.add(node)
     keywords = [i.lower() for i in keywords]
     for kw in keywords: 
-      if kw in self.kw_to_chat: 
-        self.kw_to_chat[kw][0:0] = [node]
-      else: 
-        self.kw_to_chat[kw] = [node]
+      if kw not in self.kw_to_chat: 
+        self.kw_to_chat[kw] = NodeSequence()
+      self.kw_to_chat[kw].add(node)
     self.id_to_node[node_id] = node 
 
+    if embedding_pair[1] is None: 
+      return node
     self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    if embedding_pair[0] in self.index.key_ids: 
+      self.index.set_embedding(embedding_pair[0], embedding_pair[1])
         
     return node
 
@@ -278,6 +458,46 @@ class AssociativeMemory:
     return ret_set
 
 
+  def is_latest_event(self, spo, retention): 
+    """
+    Returns whether an spo summary is one of the summaries of the latest 
+    <retention> events. This is the same as checking it against 
+    get_summarized_latest_events(retention), but takes constant time. 
+
+    INPUT
+      spo: The (subject, predicate, object) summary of an event.
+      retention: The number of latest events to look at. 
+    OUTPUT
+      A bool.
+    """
+    if retention != self.latest_retention: 
+      self.latest_retention = retention
+      self.latest_events = deque()
+      self.latest_event_counts = dict()
+      for e_node in reversed(self.seq_event[:retention]): 
+        self.add_latest_event(e_node.spo_summary())
+    return spo in self.latest_event_counts
+
+
+  def add_latest_event(self, spo): 
+    """
+    Adds the spo summary of a new event to <latest_events>, and drops the 
+    oldest one if there are more than <latest_retention>. 
+
+    INPUT
+      spo: The (subject, predicate, object) summary of the event.
+    OUTPUT
+      None
+    """
+    self.latest_events.appendleft(spo)
+    self.latest_event_counts[spo] = self.latest_event_counts.get(spo, 0) + 1
+    if len(self.latest_events) > self.latest_retention: 
+      oldest = self.latest_events.pop()
+      self.latest_event_counts[oldest] -= 1
+      if not self.latest_event_counts[oldest]: 
+        del self.latest_event_counts[oldest]
+
+
   def get_str_seq_events(self): 
     ret_str = ""
     for count, event in enumerate(self.seq_event): 
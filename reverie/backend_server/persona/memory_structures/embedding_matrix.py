@@ -0,0 +1,234 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: embedding_matrix.py
+Description: Defines the on-disk and in-memory store of a persona's
+embeddings.
+
+The embeddings of a persona's associative memory are saved as a raw float32
+matrix (embeddings.f32) with one row per embedding key, next to a JSON lines
+file (embedding_keys.jsonl) whose first line holds the dimension and whose
+remaining lines hold the keys in row order. The matrix is memory-mapped on
+load, and a save only appends the rows that were added since.
+
+Older simulations saved their embeddings as a single embeddings.json file.
+These are still loaded, and are converted on their next save (or with the
+converter at the bottom of this file).
+"""
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+
+class EmbeddingMatrix:
+  matrix_file = "embeddings.f32"
+  keys_file = "embedding_keys.jsonl"
+  legacy_file = "embeddings.json"
+
+  def __init__(self, folder=None):
+    # <keys> is the list of embedding keys in row order, and <key_rows>
+    # takes a key and returns its row.
+    self.keys = []
+    self.key_rows = dict()
+    self.dim = None
+
+    # <folder> is where the rows up to <n_saved> are stored, and <matrix> is
+    # the read-only memory map of those rows.
+    self.folder = None
+    self.matrix = None
+    self.n_saved = 0
+
+    # <new_rows> are the vectors of rows n_saved and up, which have not been
+    # saved yet. <updated> takes a saved row whose vector was replaced and
+    # returns its new vector.
+    self.new_rows = []
+    self.updated = dict()
+
+    if folder:
+      self.load(folder)
+
+
+  def load(self, folder):
+    """
+    Loads the embeddings saved in <folder>.
+
+    INPUT
+      folder: The associative memory folder of a persona.
+    OUTPUT
+      None
+    """
+    if os.path.exists(f"{folder}/{self.keys_file}"):
+      with open(f"{folder}/{self.keys_file}") as f:
+        self.dim = json.loads(f.readline())["dim"]
+        keys = [json.loads(line) for line in f if line.strip()]
+      # A save that was interrupted can leave the matrix with rows that have
+      # no key (or with part of a row), or keys without their rows. Only the
+      # rows that have both are kept, and the files are cut back to them so
+      # that the next save appends right after them.
+      n_bytes = os.path.getsize(f"{folder}/{self.matrix_file}")
+      n_rows = 0
+      if self.dim:
+        n_rows = min(len(keys), n_bytes // (4 * self.dim))
+      if n_bytes != n_rows * 4 * (self.dim or 0):
+        with open(f"{folder}/{self.matrix_file}", "r+b") as f:
+          f.truncate(n_rows * 4 * (self.dim or 0))
+      if len(keys) != n_rows:
+        with open(f"{folder}/{self.keys_file}", "w") as f:
+          f.write(json.dumps({"dim": self.dim}) + "\n")
+          for key in keys[:n_rows]:
+            f.write(json.dumps(key) + "\n")
+      self.keys = keys[:n_rows]
+      self.key_rows = {key: row for row, key in enumerate(self.keys)}
+      self.folder = folder
+      self.n_saved = len(self.keys)
+      self._map()
+
+    elif os.path.exists(f"{folder}/{self.legacy_file}"):
+      for key, vector in json.load(open(f"{folder}/{self.legacy_file}")).items():
+        self[key] = vector
+
+
+  def _map(self):
+    if self.n_saved:
+      self.matrix = np.memmap(f"{self.folder}/{self.matrix_file}",
+                              dtype=np.float32, mode="r",
+                              shape=(self.n_saved, self.dim))
+    else:
+      self.matrix = None
+
+
+  def save(self, folder):
+    """
+    Saves the embeddings to <folder>. If the embeddings were loaded from (or
+    last saved to) the same folder, only the new rows are appended.
+
+    INPUT
+      folder: The associative memory folder of a persona.
+    OUTPUT
+      None
+    """
+    if self.n_saved == 0:
+      # Nothing is saved yet, so we start the files over.
+      open(f"{folder}/{self.matrix_file}", "wb").close()
+      with open(f"{folder}/{self.keys_file}", "w") as f:
+        f.write(json.dumps({"dim": self.dim or 0}) + "\n")
+    elif os.path.abspath(self.folder) != os.path.abspath(folder):
+      # We are saving somewhere else; we start from a copy of what is saved.
+      shutil.copyfile(f"{self.folder}/{self.matrix_file}",
+                      f"{folder}/{self.matrix_file}")
+      shutil.copyfile(f"{self.folder}/{self.keys_file}",
+                      f"{folder}/{self.keys_file}")
+
+    if self.updated:
+      with open(f"{folder}/{self.matrix_file}", "r+b") as f:
+        for row, vector in self.updated.items():
+          f.seek(row * self.dim * 4)
+          f.write(vector.tobytes())
+
+    if self.new_rows:
+      # The matrix is written before the keys, so that an interrupted save
+      # never leaves a key without its row.
+      with open(f"{folder}/{self.matrix_file}", "ab") as f:
+        f.write(np.stack(self.new_rows).tobytes())
+      with open(f"{folder}/{self.keys_file}", "a") as f:
+        for key in self.keys[self.n_saved:]:
+          f.write(json.dumps(key) + "\n")
+
+    self.folder = folder
+    self.n_saved = len(self.keys)
+    self.new_rows = []
+    self.updated = dict()
+    self._map()
+
+    # The binary files supersede the old JSON layout.
+    if os.path.exists(f"{folder}/{self.legacy_file}"):
+      os.remove(f"{folder}/{self.legacy_file}")
+
+
+  def __contains__(self, key):
+    return key in self.key_rows
+
+
+  def __len__(self):
+    return len(self.keys)
+
+
+  def __iter__(self):
+    return iter(self.keys)
+
+
+  def __getitem__(self, key):
+    row = self.key_rows[key]
+    if row >= self.n_saved:
+      return self.new_rows[row - self.n_saved]
+    if row in self.updated:
+      return self.updated[row]
+    return self.matrix[row]
+
+
+  def __setitem__(self, key, vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    if not self.dim:
+      self.dim = vector.shape[0]
+    if key not in self.key_rows:
+      self.key_rows[key] = len(self.keys)
+      self.keys += [key]
+      self.new_rows += [vector]
+      return
+
+    # Most of the time, an existing key is set to the vector it already has
+    # (e.g., when a persona perceives an event it has seen before).
+    row = self.key_rows[key]
+    if np.array_equal(self[key], vector):
+      return
+    if row >= self.n_saved:
+      self.new_rows[row - self.n_saved] = vector
+    else:
+      self.updated[row] = vector
+
+
+  def get(self, key, default=None):
+    if key in self.key_rows:
+      return self[key]
+    return default
+
+
+  def items(self):
+    for key in self.keys:
+      yield key, self[key]
+
+
+def convert_embeddings_json(folder):
+  """
+  Converts the embeddings.json of an associative memory folder to the binary
+  layout.
+
+  INPUT
+    folder: The associative memory folder of a persona.
+  OUTPUT
+    True if the folder was converted, and False if there was nothing to
+    convert.
+  """
+  if not os.path.exists(f"{folder}/{EmbeddingMatrix.legacy_file}"):
+    return False
+  if os.path.exists(f"{folder}/{EmbeddingMatrix.keys_file}"):
+    # The binary files are already there; the JSON file is stale.
+    os.remove(f"{folder}/{EmbeddingMatrix.legacy_file}")
+    return True
+  embeddings = EmbeddingMatrix()
+  embeddings.load(folder)
+  embeddings.save(folder)
+  return True
+
+
+if __name__ == '__main__':
+  # Converts every associative memory under the given storage folder.
+  # e.g., python embedding_matrix.py ../../../environment/frontend_server/storage
+  storage = sys.argv[1]
+  for root, dirs, files in os.walk(storage):
+    if EmbeddingMatrix.legacy_file in files:
+      if convert_embeddings_json(root):
+        print (f"converted {root}")
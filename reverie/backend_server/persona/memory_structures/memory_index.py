@@ -0,0 +1,326 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: memory_index.py
+Description: Defines the array-backed index over the associative memory that
+the retrieval module scores against.
+
+The index mirrors the event and thought nodes of a persona's memory stream in
+contiguous NumPy arrays (unit-normalized embeddings, poignancy, and last
+accessed time) so that the recency, importance, and relevance scores of the
+whole stream can be computed as array operations rather than one node at a
+time.
+"""
+import datetime
+
+import numpy as np
+
+
+class MemoryIndex:
+  # The naive datetime that last accessed times are measured from.
+  epoch = datetime.datetime(1970, 1, 1)
+
+  def __init__(self, embeddings=None):
+    # <nodes> is the list of indexed <ConceptNode>s; a node's position in
+    # this list is its row in the arrays below.
+    self.nodes = []
+    self.size = 0
+    # <rows> takes a node_id and returns its row.
+    self.rows = dict()
+    self.capacity = 0
+
+    # Per row values.
+    # <row_key> is the row of the node's embedding in <key_vectors>.
+    # <order_key> breaks the ties between nodes with the same last accessed
+    # time the way the seq_event + seq_thought list of the associative
+    # memory does -- events before thoughts, and newer nodes first.
+    # <eligible> is False for the idle nodes that retrieval skips.
+    self.row_key = np.zeros(0, dtype=np.int32)
+    self.poignancy = np.zeros(0, dtype=np.float32)
+    self.last_accessed = np.zeros(0, dtype=np.float64)
+    self.order_key = np.zeros(0, dtype=np.int64)
+    self.eligible = np.zeros(0, dtype=bool)
+
+    # The embeddings are stored once per embedding key, since many nodes
+    # share the same key (e.g., "bed is idle").
+    self.key_ids = dict()
+    self.n_keys = 0
+    self.key_vectors = None
+
+    # Keys can be added without their vector (e.g., while a memory stream is
+    # being loaded). <pending> takes such a key and returns its row, and the
+    # vectors are read from <embeddings> (an <EmbeddingMatrix>) all at once
+    # the first time they are needed (see load_pending).
+    self.embeddings = embeddings
+    self.pending = dict()
+
+    # <touched> holds the rows whose last accessed time was set since the
+    # associative memory last cleared it (see AssociativeMemory.clear_changes).
+    self.touched = set()
+
+
+  def _grow(self):
+    self.capacity = max(64, self.capacity * 2)
+    for name in ["row_key", "poignancy", "last_accessed", "order_key",
+                 "eligible"]:
+      old = getattr(self, name)
+      new = np.zeros(self.capacity, dtype=old.dtype)
+      new[:self.size] = old[:self.size]
+      setattr(self, name, new)
+
+
+  def to_seconds(self, time):
+    return (time - self.epoch).total_seconds()
+
+
+  def set_embedding(self, key, embedding):
+    """
+    Adds or replaces the embedding of an embedding key. The vector is stored
+    unit-normalized, so that the dot product with a unit-normalized focal
+    point is the cosine similarity.
+
+    INPUT
+      key: The str embedding key.
+      embedding: The list of floats, or None to read the vector of a new key
+                 from <embeddings> later on.
+    OUTPUT
+      The row of <key> in <key_vectors>.
+    """
+    if key not in self.key_ids:
+      self.key_ids[key] = self.n_keys
+      self.n_keys += 1
+      if embedding is None:
+        self.pending[key] = self.key_ids[key]
+    if embedding is None:
+      return self.key_ids[key]
+
+    vector = unit_vector(embedding)
+    self.pending.pop(key, None)
+    self._reserve_keys(vector.shape[0])
+    self.key_vectors[self.key_ids[key]] = vector
+    return self.key_ids[key]
+
+
+  def _reserve_keys(self, dim):
+    if self.key_vectors is None:
+      self.key_vectors = np.zeros((max(64, self.n_keys), dim),
+                                  dtype=np.float32)
+    elif self.key_vectors.shape[0] < self.n_keys:
+      new = np.zeros((max(self.n_keys, self.key_vectors.shape[0] * 2), dim),
+                     dtype=np.float32)
+      new[:self.key_vectors.shape[0]] = self.key_vectors
+      self.key_vectors = new
+
+
+  def load_pending(self):
+    """
+    Reads the vectors of the keys that were added without one from
+    <embeddings>.
+
+    INPUT
+      None
+    OUTPUT
+      None
+    """
+    if not self.pending:
+      return
+    for key, key_id in self.pending.items():
+      vector = unit_vector(self.embeddings[key])
+      self._reserve_keys(vector.shape[0])
+      self.key_vectors[key_id] = vector
+    self.pending = dict()
+
+
+  def add(self, node, embedding):
+    """
+    Indexes an event or thought node.
+
+    INPUT
+      node: The <ConceptNode>.
+      embedding: The list of floats for node.embedding_key, or None (see
+                 set_embedding).
+    OUTPUT
+      The row of the node.
+    """
+    if self.size == self.capacity:
+      self._grow()
+    row = self.size
+    self.row_key[row] = self.set_embedding(node.embedding_key, embedding)
+    self.poignancy[row] = node.poignancy
+    self.last_accessed[row] = self.to_seconds(node.last_accessed)
+    if node.type == "event":
+      self.order_key[row] = -node.type_count
+    else:
+      self.order_key[row] = (1 << 32) - node.type_count
+    self.eligible[row] = "idle" not in node.embedding_key
+    self.nodes += [node]
+    self.rows[node.node_id] = row
+    # From here on, the node reads and writes its last accessed time in
+    # <last_accessed>.
+    node._index = self
+    node._row = row
+    node._last_accessed = None
+    self.size += 1
+    return row
+
+
+  def touch(self, rows, curr_time):
+    """
+    Sets the last accessed time of the nodes in <rows> to <curr_time>. The
+    nodes read it from <last_accessed>, so they do not need to be updated.
+
+    INPUT
+      rows: A list (or array) of rows.
+      curr_time: The datetime to set.
+    OUTPUT
+      None
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    self.last_accessed[rows] = self.to_seconds(curr_time)
+    self.touched.update(rows.tolist())
+
+
+  def recency_order(self):
+    """
+    Returns the rows of the non-idle nodes, sorted by their last accessed
+    time from the least to the most recent. Ties keep the order of
+    seq_event + seq_thought.
+
+    INPUT
+      None
+    OUTPUT
+      An int array of rows.
+    """
+    rows = np.flatnonzero(self.eligible[:self.size])
+    return rows[np.lexsort((self.order_key[rows], self.last_accessed[rows]))]
+
+
+  def key_similarities(self, focal_embeddings):
+    """
+    Computes the cosine similarity between each focal point and each
+    embedding key as a single (focal points x keys) matrix product.
+
+    INPUT
+      focal_embeddings: A list of embedding vectors, one per focal point.
+    OUTPUT
+      A float32 array of shape (len(focal_embeddings), n_keys).
+    """
+    self.load_pending()
+    focal = np.asarray(focal_embeddings, dtype=np.float32)
+    if self.n_keys == 0:
+      return np.zeros((focal.shape[0], 0), dtype=np.float32)
+    focal_norms = np.linalg.norm(focal, axis=1, keepdims=True)
+    focal_norms[focal_norms == 0] = 1
+    return (focal / focal_norms) @ self.key_vectors[:self.n_keys].T
+
+
+  def shared_components(self, recency_decay):
+    """
+    Returns the normalized recency and importance scores, which are the same
+    for every focal point of a retrieval. Recency only depends on a node's
+    position in the recency order (see recency_order), and importance on
+    its poignancy.
+
+    INPUT
+      recency_decay: The float decay factor of the recency score.
+    OUTPUT
+      recency: A float array; the i-th value is the recency score of the
+               i-th node in the recency order.
+      importance: A float array over all rows; the importance score of each
+                  non-idle row.
+    """
+    eligible = np.flatnonzero(self.eligible[:self.size])
+    importance = np.zeros(self.size)
+    if eligible.size == 0:
+      return np.zeros(0), importance
+    recency = recency_decay ** np.arange(1, eligible.size + 1,
+                                         dtype=np.float64)
+    importance[eligible] = normalize_floats(
+      self.poignancy[eligible].astype(np.float64))
+    return normalize_floats(recency), importance
+
+
+  def score(self, key_sims, recency, importance, weights):
+    """
+    Scores all non-idle nodes against a focal point. Each of the recency,
+    importance, and relevance components is min-max normalized to [0, 1]
+    (or set to 0.5 if all values are the same) before the weighted sum.
+
+    INPUT
+      key_sims: The float array of the focal point's similarity to each
+                embedding key (a row of key_similarities).
+      recency, importance: The output of shared_components.
+      weights: A list of three floats [recency, relevance, importance].
+    OUTPUT
+      rows: The int array of rows in recency order (see recency_order).
+      scores: The float array of the scores of <rows>.
+    """
+    rows = self.recency_order()
+    if rows.size == 0:
+      return rows, np.zeros(0)
+    relevance = key_sims[self.row_key[rows]].astype(np.float64)
+
+    scores = (weights[0] * recency
+              + weights[1] * normalize_floats(relevance)
+              + weights[2] * importance[rows])
+    return rows, scores
+
+
+def unit_vector(embedding):
+  """
+  Returns an embedding as a unit-normalized float32 vector. A zero vector is
+  returned as is.
+
+  INPUT
+    embedding: The list (or array) of floats.
+  OUTPUT
+    The float32 array.
+  """
+  vector = np.asarray(embedding, dtype=np.float32)
+  vector_norm = np.linalg.norm(vector)
+  if vector_norm > 0:
+    vector = vector / vector_norm
+  return vector
+
+
+def normalize_floats(vals):
+  """
+  Min-max normalizes an array of floats to [0, 1]. If all values are the
+  same, they are all set to 0.5.
+
+  INPUT
+    vals: A float array.
+  OUTPUT
+    The normalized float array.
+  """
+  min_val = vals.min()
+  range_val = vals.max() - min_val
+  if range_val == 0:
+    return np.full(vals.shape, 0.5)
+  return (vals - min_val) / range_val
+
+
+def top_k_rows(rows, scores, k):
+  """
+  Returns the <k> highest scoring rows, from the highest score down. Rows
+  with the same score keep the order they have in <rows>.
+
+  INPUT
+    rows: An int array of rows.
+    scores: The float array of the scores of <rows>.
+    k: The int number of rows to return.
+  OUTPUT
+    An int array of at most <k> rows.
+  """
+  if rows.size > k:
+    # <threshold> is the k-th highest score. We keep everything above it,
+    # and fill the remaining slots with the earliest rows that are equal to
+    # it, so that ties resolve exactly as a stable sort would.
+    threshold = -np.partition(-scores, k - 1)[k - 1]
+    above = np.flatnonzero(scores > threshold)
+    equal = np.flatnonzero(scores == threshold)[:k - above.size]
+    picked = np.concatenate([above, equal])
+  else:
+    picked = np.arange(rows.size)
+  picked = picked[np.lexsort((picked, -scores[picked]))]
+  return rows[picked]
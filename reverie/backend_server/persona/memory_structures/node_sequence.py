@@ -0,0 +1,86 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: node_sequence.py
+Description: Defines the newest-first sequences of the associative memory.
+
+The associative memory lists its nodes (seq_event, kw_to_event, etc.) from
+the newest to the oldest. Prepending every new node to a Python list takes
+time linear in the length of the list, which makes loading a memory stream
+quadratic in its size. A NodeSequence stores the nodes oldest first, so that
+adding a node is an append, and reads them back newest first.
+"""
+
+
+class NodeSequence:
+  def __init__(self, nodes=None):
+    # <nodes> holds the nodes from the oldest to the newest.
+    self.nodes = []
+    if nodes:
+      self.nodes = list(reversed(nodes))
+
+
+  def add(self, node):
+    """
+    Adds a node as the newest one.
+
+    INPUT
+      node: The <ConceptNode>.
+    OUTPUT
+      None
+    """
+    self.nodes += [node]
+
+
+  def __len__(self):
+    return len(self.nodes)
+
+
+  def __iter__(self):
+    return reversed(self.nodes)
+
+
+  def __reversed__(self):
+    return iter(self.nodes)
+
+
+  def __contains__(self, node):
+    return node in self.nodes
+
+
+  def __getitem__(self, key):
+    # Position 0 is the newest node, as in a list that was prepended to.
+    n = len(self.nodes)
+    if isinstance(key, slice):
+      start, stop, step = key.indices(n)
+      if step != 1:
+        return list(self)[key]
+      if stop <= start:
+        return []
+      return self.nodes[n - stop:n - start][::-1]
+    if key < 0:
+      key += n
+    if not 0 <= key < n:
+      raise IndexError("NodeSequence index out of range")
+    return self.nodes[n - 1 - key]
+
+
+  def __add__(self, other):
+    return list(self) + list(other)
+
+
+  def __radd__(self, other):
+    return list(other) + list(self)
+
+
+  def __eq__(self, other):
+    if isinstance(other, (NodeSequence, list)):
+      return list(self) == list(other)
+    return NotImplemented
+
+
+  __hash__ = None
+
+
+  def __repr__(self):
+    return f"NodeSequence({list(self)!r})"
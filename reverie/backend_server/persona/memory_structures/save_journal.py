@@ -0,0 +1,264 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: save_journal.py
+Description: Defines the append-only save journal of a persona.
+
+Rather than rewriting all of a persona's memory files on every save, a save
+appends a single JSON line to journal.jsonl in the persona's bootstrap_memory
+folder that only holds what changed since the previous save: the new nodes
+of the associative memory, the nodes whose last accessed time changed, the
+keyword strengths that changed, the scratch values that changed, and the
+spatial memory tree if it changed. (New embeddings are appended to the
+embedding matrix; see embedding_matrix.py.) The memories keep track of what
+changed (see AssociativeMemory.clear_changes and MemoryTree.changed), so a
+save does not go over the whole memory. When a persona is loaded, the journal
+is replayed on top of the memory files (the frontend does the same to show
+the persona's state; see replay_save_journal in translator/views.py).
+
+Once the journal holds <journal_compact_every> saves, the next save compacts
+it: the memory files are rewritten in full and the journal is emptied. The
+current state is appended to the journal before the files are rewritten, so
+a compaction that is interrupted still loads it.
+"""
+import copy
+import json
+import os
+import sys
+sys.path.append('../../')
+
+from persona.memory_structures.associative_memory import *
+
+# <journal_compact_every> is the number of saves that go to the journal
+# before the memory files are rewritten. This can be overridden in utils.py.
+try:
+  from utils import journal_compact_every
+except ImportError:
+  journal_compact_every = 50
+
+
+class SaveJournal:
+  file_name = "journal.jsonl"
+
+  def __init__(self, folder):
+    # <folder> is the bootstrap_memory folder that the persona was last
+    # loaded from or saved to, and <n_records> is the number of saves in its
+    # journal.
+    self.folder = folder
+    self.n_records = 0
+
+    # <n_nodes> is the number of nodes in the associative memory at that
+    # point, and <scratch> a copy of the scratch values.
+    self.n_nodes = 0
+    self.scratch = dict()
+
+    # <records> holds the saves that replay_scratch read and replay_memory
+    # has not applied yet.
+    self.records = []
+
+
+  def replay(self, persona):
+    """
+    Applies the saves in the journal of <folder> to a persona that was just
+    loaded from the memory files of the same folder.
+
+    INPUT
+      persona: The <Persona>.
+    OUTPUT
+      None
+    """
+    self.replay_scratch(persona)
+    self.replay_memory(persona)
+
+
+  def replay_scratch(self, persona):
+    """
+    Reads the journal of <folder> and applies the scratch values it holds to
+    a persona whose scratch was just loaded. The rest of the journal is kept
+    for replay_memory.
+
+    INPUT
+      persona: The <Persona>.
+    OUTPUT
+      None
+    """
+    f_journal = f"{self.folder}/{self.file_name}"
+    self.records = []
+    if os.path.exists(f_journal):
+      with open(f_journal, "rb") as f:
+        lines = f.readlines()
+      offset = 0
+      for line in lines:
+        try:
+          if not line.endswith(b"\n"):
+            raise ValueError
+          record = json.loads(line)
+        except ValueError:
+          # The last line of a save that was interrupted. We cut it off so
+          # that the next save does not append to it.
+          with open(f_journal, "r+b") as f:
+            f.truncate(offset)
+          break
+        offset += len(line)
+        self.records += [record]
+    self.n_records = len(self.records)
+
+    scratch = dict()
+    for record in self.records:
+      scratch.update(record["scratch"])
+    if scratch:
+      # The scratch of a new simulation is not complete (e.g., it has no
+      # curr_time yet), so we merge into the file rather than to_dict.
+      scratch_load = json.load(open(f"{self.folder}/scratch.json"))
+      persona.scratch.load(dict(scratch_load, **scratch))
+    if persona.scratch.curr_time:
+      self.scratch = copy.deepcopy(persona.scratch.to_dict())
+
+
+  def replay_memory(self, persona):
+    """
+    Applies the rest of the journal read by replay_scratch to the spatial
+    and associative memory of a persona that were just loaded.
+
+    INPUT
+      persona: The <Persona>.
+    OUTPUT
+      None
+    """
+    for record in self.records:
+      for node_details in record["nodes"]:
+        # A compaction that was interrupted can leave nodes in the journal
+        # that the rewritten memory files already hold.
+        if node_details["node_count"] > len(persona.a_mem.id_to_node):
+          persona.a_mem.load_node(node_details)
+      for node_id, last_accessed in record["last_accessed"].items():
+        persona.a_mem.set_last_accessed(
+          persona.a_mem.id_to_node[node_id],
+          parse_saved_time(last_accessed))
+      persona.a_mem.kw_strength_event.update(record["kw_strength_event"])
+      persona.a_mem.kw_strength_thought.update(
+        record["kw_strength_thought"])
+      if record.get("spatial_memory") is not None:
+        persona.s_mem.tree = record["spatial_memory"]
+    self.records = []
+    self.mark_saved(persona, self.folder, scratch=False)
+
+
+  def mark_saved(self, persona, folder, scratch=True):
+    """
+    Remembers the current state of the persona as what is saved in <folder>.
+
+    INPUT
+      persona: The <Persona>.
+      folder: The bootstrap_memory folder.
+      scratch: If False, the scratch is left as it was remembered.
+    OUTPUT
+      None
+    """
+    self.folder = folder
+    self.n_nodes = len(persona.a_mem.id_to_node)
+    persona.a_mem.clear_changes()
+    persona.s_mem.changed = False
+    if scratch and persona.scratch.curr_time:
+      self.scratch = copy.deepcopy(persona.scratch.to_dict())
+
+
+  def can_append(self, folder):
+    """
+    Returns True if the next save to <folder> can go to the journal, and
+    False if the memory files have to be rewritten.
+
+    INPUT
+      folder: The bootstrap_memory folder.
+    OUTPUT
+      A bool.
+    """
+    return (os.path.abspath(folder) == os.path.abspath(self.folder)
+            and self.n_records < journal_compact_every)
+
+
+  def append(self, persona):
+    """
+    Appends what changed since the last save to the journal.
+
+    INPUT
+      persona: The <Persona>.
+    OUTPUT
+      None
+    """
+    record = dict()
+    record["nodes"] = []
+    record["last_accessed"] = dict()
+    record["kw_strength_event"] = dict()
+    record["kw_strength_thought"] = dict()
+    record["spatial_memory"] = None
+    # The memory of a persona that was not loaded yet did not change.
+    if persona.memory_loaded:
+      a_mem = persona.a_mem
+      record["nodes"] = [
+        a_mem.node_to_dict(a_mem.id_to_node[f"node_{count}"])
+        for count in range(self.n_nodes + 1, len(a_mem.id_to_node) + 1)]
+      for node_id in a_mem.get_accessed_nodes():
+        node = a_mem.id_to_node[node_id]
+        # The new nodes are saved with their last accessed time.
+        if node.node_count <= self.n_nodes:
+          record["last_accessed"][node_id] = (node.last_accessed
+                                              .strftime('%Y-%m-%d %H:%M:%S'))
+      for kw in a_mem.changed_kw_event:
+        record["kw_strength_event"][kw] = a_mem.kw_strength_event[kw]
+      for kw in a_mem.changed_kw_thought:
+        record["kw_strength_thought"][kw] = a_mem.kw_strength_thought[kw]
+      if persona.s_mem.changed:
+        record["spatial_memory"] = persona.s_mem.tree
+    # The scratch has a fixed set of values, which we compare one by one.
+    record["scratch"] = {
+      key: val for key, val in persona.scratch.to_dict().items()
+      if key not in self.scratch or self.scratch[key] != val}
+
+    # The embeddings of the new nodes go first, so that every node in the
+    # journal has its embedding saved.
+    if persona.memory_loaded:
+      a_mem.embeddings.save(f"{self.folder}/associative_memory")
+    with open(f"{self.folder}/{self.file_name}", "a") as f:
+      f.write(json.dumps(record) + "\n")
+    self.n_records += 1
+
+    if persona.memory_loaded:
+      self.n_nodes = len(a_mem.id_to_node)
+      a_mem.clear_changes()
+      persona.s_mem.changed = False
+    for key, val in record["scratch"].items():
+      self.scratch[key] = copy.deepcopy(val)
+
+
+  def begin_compaction(self, persona, folder):
+    """
+    Appends the current state of a persona to the journal before the memory
+    files of <folder> are rewritten. Until reset empties the journal, it
+    brings whichever memory files were rewritten (old or new) to the same
+    state, so a compaction that is interrupted loads that state.
+
+    INPUT
+      persona: The <Persona>.
+      folder: The bootstrap_memory folder.
+    OUTPUT
+      None
+    """
+    if os.path.abspath(folder) == os.path.abspath(self.folder):
+      self.append(persona)
+
+
+  def reset(self, persona, folder):
+    """
+    Empties the journal after the memory files of <folder> were rewritten.
+
+    INPUT
+      persona: The <Persona>.
+      folder: The bootstrap_memory folder.
+    OUTPUT
+      None
+    """
+    if os.path.exists(f"{folder}/{self.file_name}"):
+      os.remove(f"{folder}/{self.file_name}")
+    self.n_records = 0
+    self.mark_saved(persona, folder)
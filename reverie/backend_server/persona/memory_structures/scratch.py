@@ -4,13 +4,121 @@ Author: Joon Sung Park (joonspk@stanford.edu)
 File: scratch.py
 Description: Defines the short-term memory module for generative agents.
 """
+import bisect
 import datetime
+import itertools
 import json
 import sys
 sys.path.append('../../')
 
 from global_methods import *
 
+class Schedule(list): 
+  """
+  A daily schedule: a list of [task, duration] rows, where the durations are
+  in minutes. It keeps the cumulative durations of its rows so that finding
+  the row that is going on at a given minute of the day is a binary search.
+  Any change to the list drops them, and they are recomputed on the next 
+  lookup. The rows themselves are not watched, so replace a row rather than
+  changing its duration in place. 
+  """
+  def __init__(self, rows=()): 
+    super().__init__(rows)
+    # <elapsed>[i] is the sum of the durations of rows 0 through i. 
+    self.elapsed = None
+    self.sorted_elapsed = True
+
+
+  def index_at(self, minute): 
+    """
+    Returns the index of the first row that ends after <minute>, or the 
+    length of the schedule if there is none. 
+
+    INPUT
+      minute: The number of minutes into the day.
+    OUTPUT
+      an integer index of the schedule.
+    """
+    if self.elapsed is None: 
+      self.elapsed = list(itertools.accumulate(row[1] for row in self))
+      self.sorted_elapsed = all(a <= b for a, b 
+                                in zip(self.elapsed, self.elapsed[1:]))
+    if self.sorted_elapsed: 
+      return bisect.bisect_right(self.elapsed, minute)
+    # A negative duration; we look for the first row the slow way. 
+    for curr_index, elapsed in enumerate(self.elapsed): 
+      if elapsed > minute: 
+        return curr_index
+    return len(self)
+
+
+  def changed(self): 
+    self.elapsed = None
+
+
+  def __setitem__(self, key, value): 
+    super().__setitem__(key, value)
+    self.changed()
+
+
+  def __delitem__(self, key): 
+    super().__delitem__(key)
+    self.changed()
+
+
+  def __iadd__(self, rows): 
+    super().__iadd__(rows)
+    self.changed()
+    return self
+
+
+  def __imul__(self, n): 
+    super().__imul__(n)
+    self.changed()
+    return self
+
+
+  def append(self, row): 
+    super().append(row)
+    self.changed()
+
+
+  def extend(self, rows): 
+    super().extend(rows)
+    self.changed()
+
+
+  def insert(self, index, row): 
+    super().insert(index, row)
+    self.changed()
+
+
+  def pop(self, *args): 
+    row = super().pop(*args)
+    self.changed()
+    return row
+
+
+  def remove(self, row): 
+    super().remove(row)
+    self.changed()
+
+
+  def clear(self): 
+    super().clear()
+    self.changed()
+
+
+  def sort(self, *args, **kwargs): 
+    super().sort(*args, **kwargs)
+    self.changed()
+
+
+  def reverse(self): 
+    super().reverse()
+    self.changed()
+
+
 class Scratch: 
   def __init__(self, f_saved): 
     # PERSONA HYPERPARAMETERS
@@ -160,78 +268,89 @@ class Scratch:
 
     if check_if_file_exists(f_saved): 
       # If we have a bootstrap file, load that here. 
-      scratch_load = json.load(open(f_saved))
-
-      self.vision_r = scratch_load["vision_r"]
-      self.att_bandwidth = scratch_load["att_bandwidth"]
-      self.retention = scratch_load["retention"]
-
-      if scratch_load["curr_time"]: 
-        self.curr_time = datetime.datetime.strptime(scratch_load["curr_time"],
-                                                  "%B %d, %Y, %H:%M:%S")
-      else: 
-        self.curr_time = None
-      self.curr_tile = scratch_load["curr_tile"]
-      self.daily_plan_req = scratch_load["daily_plan_req"]
-
-      self.name = scratch_load["name"]
-      self.first_name = scratch_load["first_name"]
-      self.last_name = scratch_load["last_name"]
-      self.age = scratch_load["age"]
-      self.innate = scratch_load["innate"]
-      self.learned = scratch_load["learned"]
-      self.currently = scratch_load["currently"]
-      self.lifestyle = scratch_load["lifestyle"]
-      self.living_area = scratch_load["living_area"]
-
-      self.concept_forget = scratch_load["concept_forget"]
-      self.daily_reflection_time = scratch_load["daily_reflection_time"]
-      self.daily_reflection_size = scratch_load["daily_reflection_size"]
-      self.overlap_reflect_th = scratch_load["overlap_reflect_th"]
-      self.kw_strg_event_reflect_th = scratch_load["kw_strg_event_reflect_th"]
-      self.kw_strg_thought_reflect_th = scratch_load["kw_strg_thought_reflect_th"]
-
-      self.recency_w = scratch_load["recency_w"]
-      self.relevance_w = scratch_load["relevance_w"]
-      self.importance_w = scratch_load["importance_w"]
-      self.recency_decay = scratch_load["recency_decay"]
-      self.importance_trigger_max = scratch_load["importance_trigger_max"]
-      self.importance_trigger_curr = scratch_load["importance_trigger_curr"]
-      self.importance_ele_n = scratch_load["importance_ele_n"]
-      self.thought_count = scratch_load["thought_count"]
-
-      self.daily_req = scratch_load["daily_req"]
-      self.f_daily_schedule = scratch_load["f_daily_schedule"]
-      self.f_daily_schedule_hourly_org = scratch_load["f_daily_schedule_hourly_org"]
-
-      self.act_address = scratch_load["act_address"]
-      if scratch_load["act_start_time"]: 
-        self.act_start_time = datetime.datetime.strptime(
-                                              scratch_load["act_start_time"],
-                                              "%B %d, %Y, %H:%M:%S")
-      else: 
-        self.curr_time = None
-      self.act_duration = scratch_load["act_duration"]
-      self.act_description = scratch_load["act_description"]
-      self.act_pronunciatio = scratch_load["act_pronunciatio"]
-      self.act_event = tuple(scratch_load["act_event"])
-
-      self.act_obj_description = scratch_load["act_obj_description"]
-      self.act_obj_pronunciatio = scratch_load["act_obj_pronunciatio"]
-      self.act_obj_event = tuple(scratch_load["act_obj_event"])
-
-      self.chatting_with = scratch_load["chatting_with"]
-      self.chat = scratch_load["chat"]
-      self.chatting_with_buffer = scratch_load["chatting_with_buffer"]
-      if scratch_load["chatting_end_time"]: 
-        self.chatting_end_time = datetime.datetime.strptime(
-                                            scratch_load["chatting_end_time"],
-                                            "%B %d, %Y, %H:%M:%S")
-      else:
-        self.chatting_end_time = None
+      self.load(json.load(open(f_saved)))
 
-      self.act_path_set = scratch_load["act_path_set"]
-      self.planned_path = scratch_load["planned_path"]
+
+  def load(self, scratch_load): 
+    """
+    Sets the scratch to the values of a dictionary in the form that to_dict
+    returns.
+
+    INPUT: 
+      scratch_load: The dictionary of the scratch values. 
+    OUTPUT: 
+      None
+    """
+    self.vision_r = scratch_load["vision_r"]
+    self.att_bandwidth = scratch_load["att_bandwidth"]
+    self.retention = scratch_load["retention"]
+
+    if scratch_load["curr_time"]: 
+      self.curr_time = datetime.datetime.strptime(scratch_load["curr_time"],
+                                                "%B %d, %Y, %H:%M:%S")
+    else: 
+      self.curr_time = None
+    self.curr_tile = scratch_load["curr_tile"]
+    self.daily_plan_req = scratch_load["daily_plan_req"]
+
+    self.name = scratch_load["name"]
+    self.first_name = scratch_load["first_name"]
+    self.last_name = scratch_load["last_name"]
+    self.age = scratch_load["age"]
+    self.innate = scratch_load["innate"]
+    self.learned = scratch_load["learned"]
+    self.currently = scratch_load["currently"]
+    self.lifestyle = scratch_load["lifestyle"]
+    self.living_area = scratch_load["living_area"]
+
+    self.concept_forget = scratch_load["concept_forget"]
+    self.daily_reflection_time = scratch_load["daily_reflection_time"]
+    self.daily_reflection_size = scratch_load["daily_reflection_size"]
+    self.overlap_reflect_th = scratch_load["overlap_reflect_th"]
+    self.kw_strg_event_reflect_th = scratch_load["kw_strg_event_reflect_th"]
+    self.kw_strg_thought_reflect_th = scratch_load["kw_strg_thought_reflect_th"]
+
+    self.recency_w = scratch_load["recency_w"]
+    self.relevance_w = scratch_load["relevance_w"]
+    self.importance_w = scratch_load["importance_w"]
+    self.recency_decay = scratch_load["recency_decay"]
+    self.importance_trigger_max = scratch_load["importance_trigger_max"]
+    self.importance_trigger_curr = scratch_load["importance_trigger_curr"]
+    self.importance_ele_n = scratch_load["importance_ele_n"]
+    self.thought_count = scratch_load["thought_count"]
+
+    self.daily_req = scratch_load["daily_req"]
+    self.f_daily_schedule = scratch_load["f_daily_schedule"]
+    self.f_daily_schedule_hourly_org = scratch_load["f_daily_schedule_hourly_org"]
+
+    self.act_address = scratch_load["act_address"]
+    if scratch_load["act_start_time"]: 
+      self.act_start_time = datetime.datetime.strptime(
+                                            scratch_load["act_start_time"],
+                                            "%B %d, %Y, %H:%M:%S")
+    else: 
+      self.curr_time = None
+    self.act_duration = scratch_load["act_duration"]
+    self.act_description = scratch_load["act_description"]
+    self.act_pronunciatio = scratch_load["act_pronunciatio"]
+    self.act_event = tuple(scratch_load["act_event"])
+
+    self.act_obj_description = scratch_load["act_obj_description"]
+    self.act_obj_pronunciatio = scratch_load["act_obj_pronunciatio"]
+    self.act_obj_event = tuple(scratch_load["act_obj_event"])
+
+    self.chatting_with = scratch_load["chatting_with"]
+    self.chat = scratch_load["chat"]
+    self.chatting_with_buffer = scratch_load["chatting_with_buffer"]
+    if scratch_load["chatting_end_time"]: 
+      self.chatting_end_time = datetime.datetime.strptime(
+                                          scratch_load["chatting_end_time"],
+                                          "%B %d, %Y, %H:%M:%S")
+    else:
+      self.chatting_end_time = None
+
+    self.act_path_set = scratch_load["act_path_set"]
+    self.planned_path = scratch_load["planned_path"]
 
 
   def save(self, out_json):
@@ -243,6 +362,19 @@ class Scratch:
     OUTPUT: 
       None
     """
+    with open(out_json, "w") as outfile:
+      json.dump(self.to_dict(), outfile, indent=2) 
+
+
+  def to_dict(self): 
+    """
+    Returns the scratch as a dictionary of JSON serializable values. 
+
+    INPUT: 
+      None
+    OUTPUT: 
+      The dictionary of the scratch values. 
+    """
     scratch = dict() 
     scratch["vision_r"] = self.vision_r
     scratch["att_bandwidth"] = self.att_bandwidth
@@ -305,9 +437,32 @@ class Scratch:
 
     scratch["act_path_set"] = self.act_path_set
     scratch["planned_path"] = self.planned_path
+    return scratch
 
-    with open(out_json, "w") as outfile:
-      json.dump(scratch, outfile, indent=2) 
+
+  @property
+  def f_daily_schedule(self): 
+    return self._f_daily_schedule
+
+
+  @f_daily_schedule.setter
+  def f_daily_schedule(self, schedule): 
+    # The schedules are kept as <Schedule>s; see get_f_daily_schedule_index.
+    if not isinstance(schedule, Schedule): 
+      schedule = Schedule(schedule)
+    self._f_daily_schedule = schedule
+
+
+  @property
+  def f_daily_schedule_hourly_org(self): 
+    return self._f_daily_schedule_hourly_org
+
+
+  @f_daily_schedule_hourly_org.setter
+  def f_daily_schedule_hourly_org(self, schedule): 
+    if not isinstance(schedule, Schedule): 
+      schedule = Schedule(schedule)
+    self._f_daily_schedule_hourly_org = schedule
 
 
   def get_f_daily_schedule_index(self, advance=0):
@@ -317,9 +472,10 @@ class Scratch:
     Recall that self.f_daily_schedule stores the decomposed action sequences 
     up until now, and the hourly sequences of the future action for the rest
     of today. Given that self.f_daily_schedule is a list of list where the 
-    inner list is composed of [task, duration], we continue to add up the 
-    duration until we reach "if elapsed > today_min_elapsed" condition. The
-    index where we stop is the index we will return. 
+    inner list is composed of [task, duration], we find the first index 
+    where the durations up to and including it add up to more than the 
+    minutes elapsed today. The schedule keeps these sums (see <Schedule>), 
+    so this is a binary search. 
 
     INPUT
       advance: Integer value of the number minutes we want to look into the 
@@ -333,23 +489,8 @@ class Scratch:
     today_min_elapsed += self.curr_time.minute
     today_min_elapsed += advance
 
-    x = 0
-    for task, duration in self.f_daily_schedule: 
-      x += duration
-    x = 0
-    for task, duration in self.f_daily_schedule_hourly_org: 
-      x += duration
-
     # We then calculate the current index based on that. 
-    curr_index = 0
-    elapsed = 0
-    for task, duration in self.f_daily_schedule: 
-      elapsed += duration
-      if elapsed > today_min_elapsed: 
-        return curr_index
-      curr_index += 1
-
-    return curr_index
+    return self.f_daily_schedule.index_at(today_min_elapsed)
 
 
   def get_f_daily_schedule_hourly_org_index(self, advance=0):
@@ -369,14 +510,7 @@ class Scratch:
     today_min_elapsed += self.curr_time.minute
     today_min_elapsed += advance
     # We then calculate the current index based on that. 
-    curr_index = 0
-    elapsed = 0
-    for task, duration in self.f_daily_schedule_hourly_org: 
-      elapsed += duration
-      if elapsed > today_min_elapsed: 
-        return curr_index
-      curr_index += 1
-    return curr_index
+    return self.f_daily_schedule_hourly_org.index_at(today_min_elapsed)
 
 
   def get_str_iss(self): 
@@ -17,6 +17,9 @@ class MemoryTree:
     self.tree = {}
     if check_if_file_exists(f_saved): 
       self.tree = json.load(open(f_saved))
+    # <changed> is True if add_tile added to the tree since the last save 
+    # (see SaveJournal). 
+    self.changed = False
 
 
   def print_tree(self): 
@@ -40,6 +43,35 @@ class MemoryTree:
       json.dump(self.tree, outfile) 
 
 
+  def add_tile(self, world, sector, arena, game_object): 
+    """
+    Adds the address of a tile the persona perceived to the tree, if it is 
+    not there yet. 
+
+    INPUT
+      world, sector, arena, game_object: The str labels of the tile; the 
+        ones the tile does not have are empty strings. 
+    OUTPUT
+      None
+    """
+    if world: 
+      if (world not in self.tree): 
+        self.tree[world] = {}
+        self.changed = True
+    if sector: 
+      if (sector not in self.tree[world]): 
+        self.tree[world][sector] = {}
+        self.changed = True
+    if arena: 
+      if (arena not in self.tree[world][sector]): 
+        self.tree[world][sector][arena] = []
+        self.changed = True
+    if game_object: 
+      if (game_object not in self.tree[world][sector][arena]): 
+        self.tree[world][sector][arena] += [game_object]
+        self.changed = True
+
+
 
   def get_str_accessible_sectors(self, curr_world): 
     """
@@ -12,13 +12,16 @@ import math
 import sys
 import datetime
 import random
+import threading
 sys.path.append('../')
 
 from global_methods import *
+from step_profiler import *
 
 from persona.memory_structures.spatial_memory import *
 from persona.memory_structures.associative_memory import *
 from persona.memory_structures.scratch import *
+from persona.memory_structures.save_journal import *
 
 from persona.cognitive_modules.perceive import *
 from persona.cognitive_modules.retrieve import *
@@ -27,8 +30,16 @@ from persona.cognitive_modules.reflect import *
 from persona.cognitive_modules.execute import *
 from persona.cognitive_modules.converse import *
 
+# <lazy_persona_loading> makes the personas load their spatial and 
+# associative memory the first time it is used, rather than when they are 
+# created (see Persona.load_memory). This can be overridden in utils.py. 
+try: 
+  from utils import lazy_persona_loading
+except ImportError: 
+  lazy_persona_loading = False
+
 class Persona: 
-  def __init__(self, name, folder_mem_saved=False):
+  def __init__(self, name, folder_mem_saved=False, lazy=None):
     # PERSONA BASE STATE 
     # <name> is the full name of the persona. This is a unique identifier for
     # the persona within Reverie. 
@@ -37,26 +48,90 @@ class Persona:
     # PERSONA MEMORY 
     # If there is already memory in folder_mem_saved, we load that. Otherwise,
     # we create new memory instances. 
-    # <s_mem> is the persona's spatial memory. 
-    f_s_mem_saved = f"{folder_mem_saved}/bootstrap_memory/spatial_memory.json"
-    self.s_mem = MemoryTree(f_s_mem_saved)
-    # <s_mem> is the persona's associative memory. 
-    f_a_mem_saved = f"{folder_mem_saved}/bootstrap_memory/associative_memory"
-    self.a_mem = AssociativeMemory(f_a_mem_saved)
     # <scratch> is the persona's scratch (short term memory) space. 
     scratch_saved = f"{folder_mem_saved}/bootstrap_memory/scratch.json"
     self.scratch = Scratch(scratch_saved)
+    # <journal> holds the saves made since the memory files were last
+    # written in full. We replay them on top of the files. 
+    self.journal = SaveJournal(f"{folder_mem_saved}/bootstrap_memory")
+    self.journal.replay_scratch(self)
+
+    # <s_mem> is the persona's spatial memory, and <a_mem> is the persona's
+    # associative memory. They are loaded by load_memory, which happens 
+    # right away unless <lazy> (by default, <lazy_persona_loading>) is True.
+    # In that case, they are loaded the first time they are used. 
+    self.folder_mem_saved = folder_mem_saved
+    self._s_mem = None
+    self._a_mem = None
+    self.memory_loaded = False
+    self.memory_lock = threading.RLock()
+    if lazy is None: 
+      lazy = lazy_persona_loading
+    if not lazy: 
+      self.load_memory()
+
+
+  @property
+  def s_mem(self): 
+    if not self.memory_loaded: 
+      self.load_memory()
+    return self._s_mem
+
+
+  @property
+  def a_mem(self): 
+    if not self.memory_loaded: 
+      self.load_memory()
+    return self._a_mem
+
+
+  def load_memory(self): 
+    """
+    Loads the persona's spatial and associative memory, and replays the rest
+    of its journal on top of them. This does nothing if they are loaded 
+    already. 
 
-
-  def save(self, save_folder): 
+    INPUT: 
+      None
+    OUTPUT: 
+      None
+    """
+    with self.memory_lock: 
+      # The journal replay below uses the memory while we are still loading
+      # it, so we are done as soon as it is there. 
+      if self._a_mem is not None: 
+        return
+      f_s_mem_saved = (f"{self.folder_mem_saved}"
+                       f"/bootstrap_memory/spatial_memory.json")
+      self._s_mem = MemoryTree(f_s_mem_saved)
+      f_a_mem_saved = (f"{self.folder_mem_saved}"
+                       f"/bootstrap_memory/associative_memory")
+      self._a_mem = AssociativeMemory(f_a_mem_saved)
+      self.journal.replay_memory(self)
+      self.memory_loaded = True
+
+
+  def save(self, save_folder, compact=False): 
     """
     Save persona's current state (i.e., memory). 
 
+    Most saves only append what changed since the last save to the persona's
+    journal (see SaveJournal). The memory files are rewritten in full when 
+    we save to a new folder, when the journal is due for compaction, or when
+    <compact> is True. 
+
     INPUT: 
       save_folder: The folder where we wil be saving our persona's state. 
+      compact: If True, the memory files are rewritten and the journal is 
+               emptied. 
     OUTPUT: 
       None
     """
+    if not compact and self.journal.can_append(save_folder): 
+      self.journal.append(self)
+      return
+    self.journal.begin_compaction(self, save_folder) 
+
     # Spatial memory contains a tree in a json format. 
     # e.g., {"double studio": 
     #         {"double studio": 
@@ -77,6 +152,8 @@ class Persona:
     f_scratch = f"{save_folder}/scratch.json"
     self.scratch.save(f_scratch)
 
+    self.journal.reset(self, save_folder)
+
 
   def perceive(self, maze):
     """
@@ -104,7 +181,8 @@ class Persona:
         See associative_memory.py -- but to get you a sense of what it 
         receives as its input: "s, p, o, desc, persona.scratch.curr_time"
     """
-    return perceive(self, maze)
+    with step_profiler.phase(self.name, "perceive"): 
+      return perceive(self, maze)
 
 
   def retrieve(self, perceived):
@@ -120,7 +198,8 @@ class Persona:
                  while the latter layer specifies the "curr_event", "events", 
                  and "thoughts" that are relevant.
     """
-    return retrieve(self, perceived)
+    with step_profiler.phase(self.name, "retrieve"): 
+      return retrieve(self, perceived)
 
 
   def plan(self, maze, personas, new_day, retrieved):
@@ -167,7 +246,8 @@ class Persona:
         writing her next novel (editing her novel) 
         @ double studio:double studio:common room:sofa
     """
-    return execute(self, maze, personas, plan)
+    with step_profiler.phase(self.name, "execute"): 
+      return execute(self, maze, personas, plan)
 
 
   def reflect(self):
@@ -179,7 +259,8 @@ class Persona:
     OUTPUT: 
       None
     """
-    reflect(self)
+    with step_profiler.phase(self.name, "reflect"): 
+      reflect(self)
 
 
   def move(self, maze, personas, curr_tile, curr_time):
@@ -201,6 +282,34 @@ class Persona:
         writing her next novel (editing her novel) 
         @ double studio:double studio:common room:sofa
     """
+    # Main cognitive sequence begins here. 
+    retrieved = self.prepare_move(maze, curr_tile, curr_time)
+    plan = self.react(maze, personas, retrieved)
+    self.reflect()
+
+    # <execution> is a triple set that contains the following components: 
+    # <next_tile> is a x,y coordinate. e.g., (58, 9)
+    # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
+    # <description> is a string description of the movement. e.g., 
+    #   writing her next novel (editing her novel) 
+    #   @ double studio:double studio:common room:sofa
+    return self.execute(maze, personas, plan)
+
+
+  def prepare_move(self, maze, curr_tile, curr_time): 
+    """
+    The part of move that only touches the persona's own state: perceiving,
+    retrieving, and planning the persona's own schedule. ReverieServer runs 
+    this for all personas concurrently when it steps them in parallel. 
+
+    INPUT: 
+      maze: The Maze class of the current world. 
+      curr_tile: A tuple that designates the persona's current tile location 
+                 in (row, col) form. e.g., (58, 39)
+      curr_time: datetime instance that indicates the game's current time. 
+    OUTPUT: 
+      retrieved: dictionary of dictionary (see retrieve). 
+    """
     # Updating persona's scratch memory with <curr_tile>. 
     self.scratch.curr_tile = curr_tile
 
@@ -216,19 +325,29 @@ class Persona:
       new_day = "New day"
     self.scratch.curr_time = curr_time
 
-    # Main cognitive sequence begins here. 
     perceived = self.perceive(maze)
     retrieved = self.retrieve(perceived)
-    plan = self.plan(maze, personas, new_day, retrieved)
-    self.reflect()
+    with step_profiler.phase(self.name, "plan"): 
+      plan_schedule(self, maze, new_day)
+    return retrieved
 
-    # <execution> is a triple set that contains the following components: 
-    # <next_tile> is a x,y coordinate. e.g., (58, 9)
-    # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
-    # <description> is a string description of the movement. e.g., 
-    #   writing her next novel (editing her novel) 
-    #   @ double studio:double studio:common room:sofa
-    return self.execute(maze, personas, plan)
+
+  def react(self, maze, personas, retrieved): 
+    """
+    The part of move that reacts to the perceived events (e.g., starting a 
+    conversation). This reads and may change the state of other personas, so 
+    the personas always run it one after another. 
+
+    INPUT: 
+      maze: The Maze class of the current world. 
+      personas: A dictionary that contains all persona names as keys, and the 
+                Persona instance as values. 
+      retrieved: dictionary of dictionary (see retrieve). 
+    OUTPUT: 
+      The target action address of the persona (persona.scratch.act_address).
+    """
+    with step_profiler.phase(self.name, "react"): 
+      return plan_reaction(self, maze, personas, retrieved)
 
 
   def open_convo_session(self, convo_mode): 
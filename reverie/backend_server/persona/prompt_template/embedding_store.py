@@ -0,0 +1,112 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: embedding_store.py
+Description: A persistent store of text embeddings that is shared by all
+personas and all simulations. An embedding only depends on the model and the
+text, and a great deal of the texts we embed recur across agents and runs
+(e.g., "bed is idle" or "Isabella Rodriguez is sleeping"), so each of them
+only needs to be sent to the backend once.
+"""
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+
+class EmbeddingStore:
+  def __init__(self, f_db):
+    # <f_db> is the path to the SQLite file that backs the store.
+    self.f_db = f_db
+
+    # Counters for the current process.
+    self.hits = 0
+    self.misses = 0
+
+    folder = os.path.dirname(f_db)
+    if folder and not os.path.exists(folder):
+      os.makedirs(folder)
+
+    # The connection is shared by all threads, so every access goes through
+    # <self.lock>.
+    self.lock = threading.Lock()
+    self.conn = sqlite3.connect(f_db, check_same_thread=False)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                           model TEXT NOT NULL,
+                           text TEXT NOT NULL,
+                           vector BLOB NOT NULL,
+                           PRIMARY KEY (model, text))""")
+    self.conn.commit()
+
+
+  def get_many(self, model, texts, count=True):
+    """
+    Looks up the embeddings of a list of texts.
+
+    INPUT
+      model: The string name of the embedding model.
+      texts: A list of str.
+      count: If False, the lookup is not counted in the hits and misses
+             (e.g., when we look again for texts that we just missed).
+    OUTPUT
+      A dictionary that takes the texts that were found as keys, and their
+      embedding vectors (lists of floats) as values.
+    """
+    ret = dict()
+    with self.lock:
+      # SQLite limits the number of parameters of a single statement.
+      for i in range(0, len(texts), 500):
+        chunk = texts[i:i+500]
+        placeholders = ", ".join(["?"] * len(chunk))
+        rows = self.conn.execute(
+          f"""SELECT text, vector FROM embeddings
+              WHERE model = ? AND text IN ({placeholders})""",
+          [model] + chunk).fetchall()
+        for text, vector in rows:
+          ret[text] = np.frombuffer(vector, dtype=np.float64).tolist()
+      if count:
+        self.hits += len(ret)
+        self.misses += len(set(texts)) - len(ret)
+    return ret
+
+
+  def put_many(self, model, embeddings):
+    """
+    Stores a batch of embeddings.
+
+    INPUT
+      model: The string name of the embedding model.
+      embeddings: A dictionary that takes texts as keys, and their embedding
+                  vectors as values.
+    OUTPUT
+      None
+    """
+    rows = [(model, text, np.asarray(vector, dtype=np.float64).tobytes())
+            for text, vector in embeddings.items()]
+    with self.lock:
+      self.conn.executemany(
+        """INSERT OR REPLACE INTO embeddings (model, text, vector)
+           VALUES (?, ?, ?)""", rows)
+      self.conn.commit()
+
+
+  def stats(self):
+    """
+    Returns a summary of the store.
+
+    INPUT
+      None
+    OUTPUT
+      A dictionary with the hit/miss counters of this process, and the
+      number of embeddings that are stored on disk.
+    """
+    with self.lock:
+      entries = self.conn.execute(
+        "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    ret = dict()
+    ret["hits"] = self.hits
+    ret["misses"] = self.misses
+    ret["entries"] = entries
+    return ret
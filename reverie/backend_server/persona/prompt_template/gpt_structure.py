@@ -5,25 +5,249 @@ File: gpt_structure.py
 Description: Wrapper functions for calling OpenAI APIs.
 """
 import json
+import os
 import random
-import openai
 import time 
 
 from utils import *
+from persona.prompt_template.llm_cache import *
+from persona.prompt_template.llm_backend import *
+from persona.prompt_template.embedding_store import *
+from persona.prompt_template.prompt_registry import *
+from step_profiler import *
+
+# <llm_backend_name> is the backend that the requests below are sent to 
+# unless the simulation picks another one in its reverie/meta.json. 
+# "openai" talks to the live service, and "offline" is a deterministic local
+# stand-in that does not need network access. 
+try: 
+  from utils import llm_backend_name
+except ImportError: 
+  llm_backend_name = "openai"
+
+# <use_llm_cache> turns the persistent LLM response cache on or off, 
+# <llm_cache_file> is the SQLite file that backs it, and 
+# <llm_cache_max_bytes> bounds its size. These can be overridden in utils.py.
+try: 
+  from utils import use_llm_cache
+except ImportError: 
+  use_llm_cache = True
+try: 
+  from utils import llm_cache_file
+except ImportError: 
+  llm_cache_file = f"{fs_temp_storage}/llm_cache.db"
+try: 
+  from utils import llm_cache_max_bytes
+except ImportError: 
+  llm_cache_max_bytes = 512 * 1024 * 1024
+
+llm_cache = None
+if use_llm_cache: 
+  llm_cache = LLMCache(llm_cache_file, llm_cache_max_bytes)
+
+# <use_embedding_store> turns the persistent embedding store (shared by all 
+# personas and simulations) on or off, <embedding_store_file> is the SQLite 
+# file that backs it, and <embedding_batch_size> is the largest number of 
+# texts we send in a single embedding request. These can be overridden in 
+# utils.py.
+try: 
+  from utils import use_embedding_store
+except ImportError: 
+  use_embedding_store = True
+try: 
+  from utils import embedding_store_file
+except ImportError: 
+  embedding_store_file = f"{fs_temp_storage}/embeddings.db"
+try: 
+  from utils import embedding_batch_size
+except ImportError: 
+  embedding_batch_size = 512
+
+embedding_store = None
+if use_embedding_store: 
+  embedding_store = EmbeddingStore(embedding_store_file)
+# <embedding_requests> holds the texts whose embeddings are currently being 
+# requested, so that concurrent requests for the same text are coalesced. 
+embedding_requests = InFlightRequests()
+
+# <coalesce_llm_requests> makes a request wait for an identical request 
+# (same model, prompt, and parameters) that another thread already sent, 
+# rather than sending it again; <llm_requests> holds the requests that are 
+# on their way. Only cached requests are coalesced (see _request). This can
+# be overridden in utils.py. 
+try: 
+  from utils import coalesce_llm_requests
+except ImportError: 
+  coalesce_llm_requests = True
+llm_requests = InFlightRequests()
+
+# <prompt_registry> holds the prompt template files, which are read and 
+# compiled once, when this module is imported. With 
+# <reload_prompt_templates>, a template file that changed is read again the
+# next time it is used, which is handy while editing the templates. This can
+# be overridden in utils.py. 
+try: 
+  from utils import reload_prompt_templates
+except ImportError: 
+  reload_prompt_templates = False
+prompt_registry = PromptRegistry(reload_prompt_templates)
+prompt_registry.preload(os.path.dirname(os.path.abspath(__file__)))
+
+# <llm_backend> is the LLMBackend instance that all requests go through. It
+# is created on the first request so that importing this module does not 
+# require the dependencies of a backend we end up not using. The live 
+# backend paces and retries its own requests (see llm_client.py), so we do 
+# not sleep before sending them. 
+llm_backend = None
 
-openai.api_key = openai_api_key
+# ============================================================================
+# ###################[SECTION 0: LLM BACKEND AND CACHE] ######################
+# ============================================================================
+
+def set_llm_backend(name): 
+  """
+  Selects the backend that the chat, completion, and embedding requests are
+  sent to. 
 
-def temp_sleep(seconds=0.1):
-  time.sleep(seconds)
+  INPUT: 
+    name: The name of a registered backend (e.g., "openai", "offline")
+  OUTPUT: 
+    None
+  """
+  global llm_backend
+  llm_backend = create_llm_backend(name)
 
-def ChatGPT_single_request(prompt): 
-  temp_sleep()
 
-  completion = openai.ChatCompletion.create(
-    model="gpt-3.5-turbo", 
-    messages=[{"role": "user", "content": prompt}]
-  )
-  return completion["choices"][0]["message"]["content"]
+def get_llm_backend(): 
+  if llm_backend is None: 
+    set_llm_backend(llm_backend_name)
+  return llm_backend
+
+
+def set_llm_cache_namespace(sim_code, parent_sim_codes=None): 
+  """
+  Points the LLM response cache to the current simulation. Responses are 
+  written under <sim_code>, and looked up in <sim_code> first and then in 
+  each of the simulations it was forked from. 
+
+  INPUT: 
+    sim_code: The current simulation code. 
+    parent_sim_codes: The fork ancestry of the simulation, closest first.
+  OUTPUT: 
+    None
+  """
+  if llm_cache: 
+    llm_cache.set_namespace(sim_code, parent_sim_codes)
+
+
+def get_llm_cache_stats(): 
+  """
+  Returns the hit/miss and size summary of the LLM response cache, or None 
+  if the cache is turned off. 
+  """
+  if llm_cache: 
+    return llm_cache.stats()
+  return None
+
+
+def _cache_lookup(model, prompt, gpt_parameter=None): 
+  # Returns the (key, cached response) pair for a request. The response is
+  # None on a miss, when the cache is turned off, or when the backend is not
+  # cacheable. 
+  if not llm_cache or not get_llm_backend().cacheable: 
+    return None, None
+  key = llm_cache.make_key(model, prompt, gpt_parameter)
+  response = llm_cache.get(key)
+  if response is not None: 
+    step_profiler.record_llm_cache_hit()
+  return key, response
+
+
+def _cache_store(key, response): 
+  if llm_cache and key: 
+    llm_cache.put(key, response)
+
+
+def _cache_discard(model, prompt, gpt_parameter=None): 
+  # Drops a cached response that did not pass validation. 
+  if llm_cache and get_llm_backend().cacheable: 
+    llm_cache.discard(llm_cache.make_key(model, prompt, gpt_parameter))
+
+
+def _backend_request(method, *args): 
+  # Sends a request to the backend through one of its methods (e.g., chat),
+  # and records its latency and token usage with the step profiler. 
+  start = time.perf_counter()
+  try: 
+    return method(*args)
+  finally: 
+    step_profiler.record_llm_call(time.perf_counter() - start, 
+                                  get_llm_backend().take_usage())
+
+
+def _request(model, prompt, gpt_parameter, method, *args): 
+  """
+  Returns the response to a request. The response comes from the cache if 
+  it has one; otherwise, if an identical request is already on its way to 
+  the backend (e.g., several personas rating the poignancy of the same 
+  event in the same step), from that request; and otherwise from a new 
+  request to the backend, which is then cached. 
+
+  Only requests whose response is cached are coalesced, since those would 
+  get the same response from the cache a moment later anyway. When the 
+  cache is off (or the backend is not cacheable), every request is sent, so
+  that each caller gets its own sample. 
+
+  INPUT: 
+    model: The string name of the model. 
+    prompt: The str prompt. 
+    gpt_parameter: The dictionary of sampling parameters, or None. 
+    method: The backend method that sends the request (e.g., chat). 
+    args: The arguments of <method>. 
+  OUTPUT: 
+    The str response. The exception of the backend is raised (to everyone 
+    who waited for the request) if the request failed. 
+  """
+  cache_key, cached = _cache_lookup(model, prompt, gpt_parameter)
+  if cached is not None: 
+    return cached
+  if not coalesce_llm_requests or cache_key is None: 
+    response = _backend_request(method, *args)
+    _cache_store(cache_key, response)
+    return response
+
+  owner, pending = llm_requests.claim(cache_key)
+  if not owner: 
+    step_profiler.record_llm_coalesced()
+    return pending.wait()
+  try: 
+    # The thread that sent this request before us may have cached its 
+    # response and let go of it between our lookup and our claim. 
+    response = llm_cache.get(cache_key, count=False)
+    if response is not None: 
+      step_profiler.record_llm_cache_hit()
+    else: 
+      response = _backend_request(method, *args)
+      _cache_store(cache_key, response)
+  except Exception as e: 
+    llm_requests.resolve(cache_key, error=e)
+    raise
+  llm_requests.resolve(cache_key, result=response)
+  return response
+
+
+def get_llm_coalescing_stats(): 
+  """
+  Returns the number of LLM and embedding requests that waited for an 
+  identical request instead of being sent, in the current process. 
+  """
+  return {"llm requests": llm_requests.coalesced, 
+          "embedding requests": embedding_requests.coalesced}
+
+
+def ChatGPT_single_request(prompt): 
+  return _request("gpt-3.5-turbo", prompt, None, 
+                  get_llm_backend().chat, prompt, "gpt-3.5-turbo")
 
 
 # ============================================================================
@@ -42,14 +266,9 @@ def GPT4_request(prompt):
   RETURNS: 
     a str of GPT-3's response. 
   """
-  temp_sleep()
-
   try: 
-    completion = openai.ChatCompletion.create(
-    model="gpt-4", 
-    messages=[{"role": "user", "content": prompt}]
-    )
-    return completion["choices"][0]["message"]["content"]
+    return _request("gpt-4", prompt, None, 
+                    get_llm_backend().chat, prompt, "gpt-4")
   
   except: 
     print ("ChatGPT ERROR")
@@ -68,13 +287,9 @@ def ChatGPT_request(prompt):
   RETURNS: 
     a str of GPT-3's response. 
   """
-  # temp_sleep()
   try: 
-    completion = openai.ChatCompletion.create(
-    model="gpt-3.5-turbo", 
-    messages=[{"role": "user", "content": prompt}]
-    )
-    return completion["choices"][0]["message"]["content"]
+    return _request("gpt-3.5-turbo", prompt, None, 
+                    get_llm_backend().chat, prompt, "gpt-3.5-turbo")
   
   except: 
     print ("ChatGPT ERROR")
@@ -108,6 +323,7 @@ def GPT4_safe_generate_response(prompt,
       
       if func_validate(curr_gpt_response, prompt=prompt): 
         return func_clean_up(curr_gpt_response, prompt=prompt)
+      _cache_discard("gpt-4", prompt)
       
       if verbose: 
         print ("---- repeat count: \n", i, curr_gpt_response)
@@ -115,7 +331,7 @@ def GPT4_safe_generate_response(prompt,
         print ("~~~~")
 
     except: 
-      pass
+      _cache_discard("gpt-4", prompt)
 
   return False
 
@@ -153,6 +369,7 @@ def ChatGPT_safe_generate_response(prompt,
       
       if func_validate(curr_gpt_response, prompt=prompt): 
         return func_clean_up(curr_gpt_response, prompt=prompt)
+      _cache_discard("gpt-3.5-turbo", prompt)
       
       if verbose: 
         print ("---- repeat count: \n", i, curr_gpt_response)
@@ -160,7 +377,7 @@ def ChatGPT_safe_generate_response(prompt,
         print ("~~~~")
 
     except:
-      pass
+      _cache_discard("gpt-3.5-turbo", prompt)
 
   print("FAIL SAFE TRIGGERED")
   return fail_safe_response
@@ -181,13 +398,14 @@ def ChatGPT_safe_generate_response_OLD(prompt,
       curr_gpt_response = ChatGPT_request(prompt).strip()
       if func_validate(curr_gpt_response, prompt=prompt): 
         return func_clean_up(curr_gpt_response, prompt=prompt)
+      _cache_discard("gpt-3.5-turbo", prompt)
       if verbose: 
         print (f"---- repeat count: {i}")
         print (curr_gpt_response)
         print ("~~~~")
 
     except: 
-      pass
+      _cache_discard("gpt-3.5-turbo", prompt)
   print ("FAIL SAFE TRIGGERED") 
   return fail_safe_response
 
@@ -208,19 +426,9 @@ def GPT_request(prompt, gpt_parameter):
   RETURNS: 
     a str of GPT-3's response. 
   """
-  temp_sleep()
   try: 
-    response = openai.Completion.create(
-                model=gpt_parameter["engine"],
-                prompt=prompt,
-                temperature=gpt_parameter["temperature"],
-                max_tokens=gpt_parameter["max_tokens"],
-                top_p=gpt_parameter["top_p"],
-                frequency_penalty=gpt_parameter["frequency_penalty"],
-                presence_penalty=gpt_parameter["presence_penalty"],
-                stream=gpt_parameter["stream"],
-                stop=gpt_parameter["stop"],)
-    return response.choices[0].text
+    return _request(gpt_parameter["engine"], prompt, gpt_parameter, 
+                    get_llm_backend().complete, prompt, gpt_parameter)
   except: 
     print ("TOKEN LIMIT EXCEEDED")
     return "TOKEN LIMIT EXCEEDED"
@@ -244,14 +452,9 @@ def generate_prompt(curr_input, prompt_lib_file):
     curr_input = [curr_input]
   curr_input = [str(i) for i in curr_input]
 
-  f = open(prompt_lib_file, "r")
-  prompt = f.read()
-  f.close()
-  for count, i in enumerate(curr_input):   
-    prompt = prompt.replace(f"!<INPUT {count}>!", i)
-  if "<commentblockmarker>###</commentblockmarker>" in prompt: 
-    prompt = prompt.split("<commentblockmarker>###</commentblockmarker>")[1]
-  return prompt.strip()
+  # The template is read from the file once and kept split at the 
+  # placeholders (see prompt_registry.py). 
+  return prompt_registry.get(prompt_lib_file).render(curr_input)
 
 
 def safe_generate_response(prompt, 
@@ -268,6 +471,7 @@ def safe_generate_response(prompt,
     curr_gpt_response = GPT_request(prompt, gpt_parameter)
     if func_validate(curr_gpt_response, prompt=prompt): 
       return func_clean_up(curr_gpt_response, prompt=prompt)
+    _cache_discard(gpt_parameter["engine"], prompt, gpt_parameter)
     if verbose: 
       print ("---- repeat count: ", i, curr_gpt_response)
       print (curr_gpt_response)
@@ -276,11 +480,90 @@ def safe_generate_response(prompt,
 
 
 def get_embedding(text, model="text-embedding-ada-002"):
-  text = text.replace("\n", " ")
-  if not text: 
-    text = "this is blank"
-  return openai.Embedding.create(
-          input=[text], model=model)['data'][0]['embedding']
+  return get_embeddings([text], model)[0]
+
+
+def get_embeddings(texts, model="text-embedding-ada-002"):
+  """
+  Embeds a list of texts. Each distinct text is looked up in the embedding 
+  store first; if another thread is already requesting it, we wait for that
+  request; and all remaining texts are sent to the backend together, in 
+  batches of <embedding_batch_size>. 
+
+  INPUT
+    texts: A list of str. 
+    model: The string name of the embedding model. 
+  OUTPUT
+    A list of embedding vectors, in the order of <texts>. 
+  """
+  cleaned = []
+  for text in texts: 
+    text = text.replace("\n", " ")
+    if not text: 
+      text = "this is blank"
+    cleaned += [text]
+  unique = list(dict.fromkeys(cleaned))
+
+  backend = get_llm_backend()
+  use_store = embedding_store is not None and backend.cacheable
+  found = dict()
+  if use_store and unique: 
+    found = embedding_store.get_many(model, unique)
+
+  owned = []
+  waiting = []
+  for text in unique: 
+    if text in found: 
+      continue
+    owner, pending = embedding_requests.claim((model, text))
+    if owner: 
+      owned += [text]
+    else: 
+      waiting += [(text, pending)]
+
+  resolved = set()
+  try: 
+    if use_store and owned: 
+      # The threads that requested some of these texts before us may have 
+      # stored their embeddings and let go of them between our lookup and 
+      # our claims. 
+      late = embedding_store.get_many(model, owned, count=False)
+      for text in owned: 
+        if text in late: 
+          found[text] = late[text]
+          embedding_requests.resolve((model, text), result=found[text])
+          resolved.add(text)
+    missing = [text for text in owned if text not in resolved]
+    for i in range(0, len(missing), embedding_batch_size): 
+      batch = missing[i:i+embedding_batch_size]
+      start = time.perf_counter()
+      embeddings = dict(zip(batch, backend.embed(batch, model)))
+      step_profiler.record_embedding_call(time.perf_counter() - start)
+      if use_store: 
+        embedding_store.put_many(model, embeddings)
+      for text in batch: 
+        found[text] = embeddings[text]
+        embedding_requests.resolve((model, text), result=found[text])
+        resolved.add(text)
+  except Exception as e: 
+    for text in owned: 
+      if text not in resolved: 
+        embedding_requests.resolve((model, text), error=e)
+    raise
+
+  for text, pending in waiting: 
+    found[text] = pending.wait()
+  return [found[text] for text in cleaned]
+
+
+def get_embedding_stats(): 
+  """
+  Returns the hit/miss and size summary of the embedding store, or None if
+  the store is turned off. 
+  """
+  if embedding_store: 
+    return embedding_store.stats()
+  return None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,553 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: llm_backend.py
+Description: The backends that gpt_structure.py sends its chat, completion,
+and embedding requests to. OpenAIBackend talks to the live OpenAI service.
+OfflineBackend is a deterministic local stand-in that answers every prompt in
+run_gpt_prompt.py with a schema-valid response and returns hash-derived
+pseudo-embeddings, so that a simulation can run without network access (e.g.,
+for benchmarking the retrieval, pathfinding, perceive, and I/O code paths).
+"""
+import hashlib
+import json
+import math
+import re
+import threading
+
+from persona.prompt_template.llm_client import *
+
+
+class LLMBackend:
+  # <name> is the key the backend is registered under.
+  name = "base"
+  # <cacheable> indicates whether the responses of this backend should go
+  # through the persistent LLM response cache.
+  cacheable = True
+  # <usage.tokens> is the (prompt tokens, completion tokens) pair of the 
+  # last request that this thread sent, for the backends that report it.
+  usage = threading.local()
+
+  def chat(self, prompt, model):
+    """
+    Sends a single user message to a chat model.
+
+    INPUT
+      prompt: The str prompt.
+      model: The string name of the model (e.g., "gpt-3.5-turbo")
+    OUTPUT
+      The str content of the model's response.
+    """
+    raise NotImplementedError
+
+
+  def complete(self, prompt, gpt_parameter):
+    """
+    Sends a prompt to a completion model.
+
+    INPUT
+      prompt: The str prompt.
+      gpt_parameter: A dictionary of the engine and sampling parameters.
+    OUTPUT
+      The str completion.
+    """
+    raise NotImplementedError
+
+
+  def embed(self, texts, model):
+    """
+    Returns the embedding vectors of a list of texts.
+
+    INPUT
+      texts: A list of str.
+      model: The string name of the embedding model.
+    OUTPUT
+      A list of embedding vectors (lists of floats), in the order of <texts>.
+    """
+    raise NotImplementedError
+
+
+  def take_usage(self):
+    """
+    Returns the token usage of the last chat or completion request that this
+    thread sent, and clears it.
+
+    INPUT
+      None
+    OUTPUT
+      A (prompt tokens, completion tokens) pair, or None if the backend did
+      not report the usage.
+    """
+    tokens = getattr(self.usage, "tokens", None)
+    self.usage.tokens = None
+    return tokens
+
+
+  def set_usage(self, usage):
+    # Remembers the "usage" field of a response for take_usage.
+    self.usage.tokens = None
+    if usage:
+      self.usage.tokens = (usage.get("prompt_tokens", 0),
+                           usage.get("completion_tokens", 0))
+
+
+class OpenAIBackend(LLMBackend):
+  name = "openai"
+  # The number of tokens we expect a chat response to use, since chat 
+  # requests do not set max_tokens. The rate limiter corrects it once the
+  # response reports its usage.
+  chat_completion_tokens = 256
+
+  def __init__(self):
+    # We only import openai when this backend is selected, so that the
+    # offline backend can run on a machine that does not have it installed.
+    import openai
+    from utils import openai_api_key
+    openai.api_key = openai_api_key
+    self.openai = openai
+
+    # <session> is the HTTP session that all threads send their requests 
+    # through, so that the connections are reused across requests and 
+    # steps. <client> paces the requests to the service's rate limits and
+    # retries the ones that fail with a rate limit or transient error.
+    self.session = make_http_session()
+    openai.requestssession = self.session
+    self.client = LLMClient(self.is_retryable, self.is_rate_limit, 
+                            self.retry_after)
+
+
+  def is_rate_limit(self, error):
+    return isinstance(error, self.openai.error.RateLimitError)
+
+
+  def is_retryable(self, error):
+    errors = self.openai.error
+    if isinstance(error, (errors.RateLimitError, errors.Timeout,
+                          errors.APIConnectionError,
+                          errors.ServiceUnavailableError, errors.TryAgain)):
+      return True
+    # Other API errors are only transient if the service failed (5xx).
+    if isinstance(error, errors.APIError):
+      return (error.http_status or 500) >= 500
+    return False
+
+
+  def retry_after(self, error):
+    # The delay the service asked for in the Retry-After header, if any.
+    headers = getattr(error, "headers", None) or dict()
+    try:
+      return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+      return None
+
+
+  def _send(self, model, create, tokens, params):
+    # Sends a request through <client>. openai keeps a session per thread;
+    # we point the thread at the shared session before every request, for 
+    # the versions of openai that do not read openai.requestssession. 
+    def send():
+      context = getattr(self.openai.api_requestor, "_thread_context", None)
+      if context is not None:
+        context.session = self.session
+      return create(**params)
+    return self.client.request(model, send, tokens, self._count_tokens)
+
+
+  @staticmethod
+  def _count_tokens(response):
+    usage = response.get("usage")
+    if usage:
+      return usage.get("total_tokens")
+    return None
+
+
+  def chat(self, prompt, model):
+    tokens = estimate_tokens(prompt) + self.chat_completion_tokens
+    params = dict(model=model,
+                  messages=[{"role": "user", "content": prompt}])
+    completion = self._send(model, self.openai.ChatCompletion.create, 
+                            tokens, params)
+    self.set_usage(completion.get("usage"))
+    return completion["choices"][0]["message"]["content"]
+
+
+  def complete(self, prompt, gpt_parameter):
+    tokens = estimate_tokens(prompt) + gpt_parameter["max_tokens"]
+    params = dict(model=gpt_parameter["engine"],
+                  prompt=prompt,
+                  temperature=gpt_parameter["temperature"],
+                  max_tokens=gpt_parameter["max_tokens"],
+                  top_p=gpt_parameter["top_p"],
+                  frequency_penalty=gpt_parameter["frequency_penalty"],
+                  presence_penalty=gpt_parameter["presence_penalty"],
+                  stream=gpt_parameter["stream"],
+                  stop=gpt_parameter["stop"])
+    response = self._send(gpt_parameter["engine"], 
+                          self.openai.Completion.create, tokens, params)
+    self.set_usage(response.get("usage"))
+    return response.choices[0].text
+
+
+  def embed(self, texts, model):
+    tokens = sum(estimate_tokens(text) for text in texts)
+    response = self._send(model, self.openai.Embedding.create, tokens,
+                          dict(input=texts, model=model))
+    return [i["embedding"] for i in response["data"]]
+
+
+class OfflineBackend(LLMBackend):
+  name = "offline"
+  # The responses are cheap to recompute, so there is no point in filling up
+  # the response cache with them.
+  cacheable = False
+
+  # Activity for each hour of the day that we fill the hourly schedule with.
+  hourly_activities = (["sleeping"] * 6
+                       + ["waking up and completing the morning routine",
+                          "having breakfast"]
+                       + ["working on the day's main task"] * 4
+                       + ["having lunch"]
+                       + ["working on the day's main task"] * 4
+                       + ["taking a walk around the neighborhood",
+                          "having dinner",
+                          "relaxing at home",
+                          "reading a book",
+                          "getting ready for bed"]
+                       + ["sleeping"] * 2)
+
+  def __init__(self, embedding_dim=1536):
+    # <embedding_dim> matches text-embedding-ada-002 so that the stored
+    # embeddings have the same shape as the ones from the live service.
+    self.embedding_dim = embedding_dim
+
+    # Each rule is a pair of a marker string that identifies the prompt
+    # template and the function that answers it. The first match wins.
+    self.rules = [
+      ("In 5 min increments, list the subtasks", self._task_decomp),
+      ("The revised schedule:", self._new_decomp_schedule),
+      ("Area Options Available (Class label):", self._action_sector),
+      ("(MUST pick one of {", self._action_arena),
+      ("Objects available: {", self._action_game_object),
+      ("Turn the input into (subject, predicate, object)", self._event_triple),
+      ("Hourly schedule format:", self._hourly_schedule),
+      ("'s wake up hour:", self._wake_up_hour),
+      ("initiate a conversation with", self._decide_to_talk),
+      ("Option 2: Continue on to", self._decide_to_react),
+      ("rate the likely poignancy", self._poignancy),
+      ("rate the likely significance", self._poignancy),
+      ("high-level insights can you infer", self._insight_and_evidence),
+      ("Did the conversation end with", self._iterative_chat_utt),
+    ]
+
+
+  def chat(self, prompt, model):
+    # ChatGPT_safe_generate_response and GPT4_safe_generate_response wrap
+    # the template prompt in a json envelope that ends with
+    #   Example output json:
+    #   {"output": "<example output>"}
+    # We answer those in the same envelope.
+    if "Example output json:\n" in prompt:
+      body = prompt.split('"""\n', 1)[-1].rsplit('\n"""\n', 1)[0]
+      example = prompt.rsplit("Example output json:\n", 1)[-1]
+      example = example.split('{"output": "', 1)[-1].rsplit('"}', 1)[0]
+      return json.dumps({"output": self.respond(body, example)})
+    return self.respond_raw(prompt)
+
+
+  def complete(self, prompt, gpt_parameter):
+    return self.respond_raw(prompt)
+
+
+  def embed(self, texts, model):
+    return [self.pseudo_embedding(text) for text in texts]
+
+
+  def respond(self, body, example):
+    """
+    Returns the answer to a template prompt. Prompts that we do not have a
+    rule for are answered with the example output that the prompt itself
+    provides, which is schema-valid by construction.
+
+    INPUT
+      body: The filled-in prompt template.
+      example: The example output that came with the prompt.
+    OUTPUT
+      The value of the "output" field of the response.
+    """
+    for marker, func in self.rules:
+      if marker in body:
+        return func(body, example)
+    return example
+
+
+  def respond_raw(self, prompt):
+    # Free-form prompts (e.g., the ones in plan.py's revise_identity).
+    name = re.search(r"write (.+?)'s status for", prompt)
+    if name:
+      return f"Status: {name.group(1)} is going about the usual routine."
+    if "1. wake up and complete the morning routine at <time>" in prompt:
+      return ("1. wake up and complete the morning routine at 7:00 am, "
+              + "2. have breakfast at 8:00 am, "
+              + "3. work from 9:00 am to 12:00 pm, "
+              + "4. have lunch at 12:00 pm, "
+              + "5. work from 1:00 pm to 5:00 pm, "
+              + "6. go to bed at 11:00 pm")
+    return "Nothing out of the ordinary."
+
+
+  def pseudo_embedding(self, text):
+    """
+    Returns a deterministic, unit-length vector for <text>. Every word is
+    hashed onto a few signed dimensions (i.e., feature hashing), so texts
+    that share words have a positive cosine similarity, which keeps the
+    relevance scores of the retrieval meaningful.
+
+    INPUT
+      text: A str.
+    OUTPUT
+      A list of <embedding_dim> floats.
+    """
+    vec = [0.0] * self.embedding_dim
+    words = re.findall(r"\w+", text.lower()) or ["this", "is", "blank"]
+    for word in words:
+      digest = hashlib.sha1(word.encode("utf-8")).digest()
+      for i in range(0, 16, 4):
+        index = int.from_bytes(digest[i:i+3], "little") % self.embedding_dim
+        vec[index] += 1.0 if digest[i+3] & 1 else -1.0
+    norm = math.sqrt(sum(i * i for i in vec)) or 1.0
+    return [i / norm for i in vec]
+
+
+  # ==========================================================================
+  # Rules for the individual prompt templates.
+  # ==========================================================================
+
+  @staticmethod
+  def _hash_int(text, n):
+    # A deterministic integer in [0, n) derived from <text>.
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16) % n
+
+
+  @staticmethod
+  def _options(text):
+    return [i.strip() for i in text.split(",") if i.strip()]
+
+
+  @staticmethod
+  def _words(text):
+    stopwords = {"a", "an", "and", "at", "for", "in", "of", "on", "s", "the",
+                 "to", "with"}
+    return set(re.findall(r"\w+", text.lower())) - stopwords
+
+
+  def _pick_option(self, options, activity, default=None):
+    # Picks the option that shares the most words with the activity. Ties
+    # go to <default> if it is an option, and otherwise to the first option.
+    activity_words = self._words(activity)
+    best, best_score = None, 0
+    for option in options:
+      score = len(activity_words & self._words(option))
+      if score > best_score:
+        best, best_score = option, score
+    if best:
+      return best
+    if default in options:
+      return default
+    return options[0] if options else ""
+
+
+  def _task_decomp(self, body, example):
+    m = re.search(r"does when .+? is (.+) from .*\(total duration in minutes"
+                  + r" (\d+)\)", body)
+    task, duration = (m.group(1), int(m.group(2))) if m else ("working", 60)
+    task = task.replace("(", "").replace(")", "").replace(",", "")
+    first_name = body.rstrip().split("\n")[-1].split(" ")[1:2] or ["They"]
+    first_name = first_name[0]
+
+    if duration >= 15:
+      mid = duration - 10
+      subtasks = [[f"getting ready for {task}", 5],
+                  [task, mid],
+                  [f"wrapping up {task}", 5]]
+    else:
+      subtasks = [[task, duration]]
+
+    # The first line completes "1) <name> is", and the rest of the lines
+    # carry the "<n>) <name> is" prefix (see task_decomp_v3.txt).
+    ret = []
+    left = duration
+    for count, (subtask, dur) in enumerate(subtasks):
+      left -= dur
+      line = f"{subtask}. (duration in minutes: {dur}, minutes left: {left})"
+      if count != 0:
+        line = f"{count+1}) {first_name} is " + line
+      ret += [line]
+    return ret
+
+
+  def _new_decomp_schedule(self, body, example):
+    # The prompt lists the original schedule as "HH:MM ~ HH:MM -- <action>"
+    # lines, and ends with the revised schedule so far, whose last line is
+    # an open "HH:MM ~". We complete that line and fill the rest of the
+    # time, up to "it has to end by HH:MM", with what was originally
+    # planned for it.
+    def to_min(hhmm):
+      return int(hhmm[:2]) * 60 + int(hhmm[3:5])
+    def to_str(minutes):
+      return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+    original = body.split("\nBut ")[0]
+    original = re.findall(r"^(\d\d:\d\d) ~ (\d\d:\d\d) -- (.*)$", original,
+                          re.MULTILINE)
+    cursor = re.search(r"(\d\d:\d\d) ~$", body.rstrip())
+    end = re.search(r"it has to end by (\d\d:\d\d)", body)
+    if not original or not cursor or not end:
+      return example
+    cursor, end = to_min(cursor.group(1)), to_min(end.group(1))
+
+    ret = []
+    for start_str, end_str, action in original:
+      action_end = min(to_min(end_str), end)
+      if action_end > cursor:
+        ret += [[action, action_end]]
+        cursor = action_end
+    if not ret:
+      ret = [[original[-1][2], cursor]]
+    lines = [f"{to_str(ret[0][1])} -- {ret[0][0]}"]
+    for (_, prev_end), (action, action_end) in zip(ret, ret[1:]):
+      lines += [f"{to_str(prev_end)} ~ {to_str(action_end)} -- {action}"]
+    return "\n".join(lines)
+
+
+  def _action_sector(self, body, example):
+    options = body.split("Area Options Available (Class label): {")[-1]
+    options = self._options(options.split("}")[0])
+    # "Classification Task: <name> is <activity> as a part of <task>. Pick..."
+    activity = body.split("Classification Task:")[-1].split(". Pick")[0]
+    activity = activity.split(" is ", 1)[-1]
+    # Activities that obviously happen at home stay at home. Everything else
+    # that does not name one of the areas goes to a hash-derived public area
+    # (i.e., not somebody's living quarters, where most of the rooms are off
+    # limits), so that the personas actually move around the map.
+    public = [i for i in options if not self._words(i) & {"dorm", "house",
+                                                          "apartment"}]
+    public = public or options
+    default = public[self._hash_int(body, len(public))] if public else None
+    home = re.search(r"lives in \{(.*?)\}", body)
+    if home and self._words(activity) & {"sleeping", "sleep", "bed", "home",
+                                          "waking", "morning", "routine"}:
+      default = home.group(1)
+    return self._pick_option(options, activity, default)
+
+
+  def _action_arena(self, body, example):
+    options = body.split("(MUST pick one of {")[-1].split("}")[0]
+    options = self._options(options)
+    # "<name> is <activity>. For <task>, <name> should go to the following
+    # area in <sector> (MUST pick one of {...}):"
+    activity = body.split("(MUST pick one of {")[0].split("\n")[-1]
+    activity = activity.split(" is ", 1)[-1].split(" should go to ")[0]
+    return self._pick_option(options, activity)
+
+
+  def _action_game_object(self, body, example):
+    options = body.split("Objects available: {")[-1].split("}")[0]
+    activity = body.split("Current activity: ")[-1].split("\n")[0]
+    return self._pick_option(self._options(options), activity)
+
+
+  def _event_triple(self, body, example):
+    # The prompt ends with
+    #   Input: <subject> is <description>.
+    #   Output: (<subject>,
+    # and we complete it as "is, <description>)".
+    subject = body.split("Output: (")[-1].rstrip(",").strip()
+    line = body.split("Input: ")[-1].split("\n")[0].strip()
+    desc = line[len(subject):].strip()
+    if desc.startswith("is "):
+      desc = desc[3:]
+    desc = desc.rstrip(". ").replace(",", "").replace(")", "")
+    return f"is, {desc or 'idle'})"
+
+
+  def _hourly_schedule(self, body, example):
+    m = re.search(r"-- (\d\d):00 (AM|PM)\] Activity: [^\n]*$", body.rstrip())
+    if not m:
+      return example
+    hour = int(m.group(1)) % 12 + (12 if m.group(2) == "PM" else 0)
+    return self.hourly_activities[hour]
+
+
+  def _wake_up_hour(self, body, example):
+    return f"{6 + self._hash_int(body, 4)}am"
+
+
+  def _decide_to_talk(self, body, example):
+    return "yes" if self._hash_int(body, 3) == 0 else "no"
+
+
+  def _decide_to_react(self, body, example):
+    # "Continue on to <activity> now"
+    return "Answer: Option 2"
+
+
+  def _poignancy(self, body, example):
+    return str(1 + self._hash_int(body, 9))
+
+
+  def _insight_and_evidence(self, body, example):
+    statements = re.findall(r"^(\d+)\. (.*)$", body, re.MULTILINE)
+    if not statements:
+      return example
+    index, statement = statements[self._hash_int(body, len(statements))]
+    statement = statement.replace(". ", " ").replace("(", "").replace(")", "")
+    return f"{statement.rstrip('.')} (because of {index})"
+
+
+  def _iterative_chat_utt(self, body, example):
+    convo = body.split("Here is their conversation so far: ")[-1]
+    convo = convo.split("\n---\n")[0].strip()
+    turns = 0
+    if convo and "[The conversation has not started yet" not in convo:
+      turns = len([i for i in convo.split("\n") if i.strip()])
+    speaker = re.search(r"what should (.+?) say to (.+?) next", body)
+    listener = speaker.group(2) if speaker else "you"
+    if turns == 0:
+      utterance = f"Hi {listener}, how is your day going?"
+    else:
+      utterance = "That sounds good. Talk to you later!"
+    end = "True" if turns >= 3 else "False"
+    return json.dumps({"utterance": utterance, "end_conversation": end})
+
+
+# <llm_backends> maps the backend names that can be selected in utils.py or
+# in a simulation's reverie/meta.json to their classes.
+llm_backends = {OpenAIBackend.name: OpenAIBackend,
+                OfflineBackend.name: OfflineBackend}
+
+
+def register_llm_backend(backend_class):
+  """
+  Makes a backend class selectable by its name.
+
+  INPUT
+    backend_class: A subclass of LLMBackend.
+  OUTPUT
+    None
+  """
+  llm_backends[backend_class.name] = backend_class
+
+
+def create_llm_backend(name):
+  """
+  Instantiates the backend that is registered under <name>.
+
+  INPUT
+    name: The name of the backend (e.g., "openai", "offline")
+  OUTPUT
+    An LLMBackend instance.
+  """
+  if name not in llm_backends:
+    raise ValueError(f"Unknown LLM backend: {name} "
+                     + f"(available: {', '.join(llm_backends)})")
+  return llm_backends[name]()
@@ -0,0 +1,301 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: llm_cache.py
+Description: A persistent, content-addressed cache for LLM responses. Every
+request is keyed by a hash of the model, the full prompt, and the sampling
+parameters, and the responses are stored in a local SQLite file so that
+forked simulations can replay the answers their parent already received
+instead of going back to the network.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class LLMCache:
+  def __init__(self, f_db, max_bytes=512 * 1024 * 1024):
+    # <f_db> is the path to the SQLite file that backs the cache. It is
+    # shared across all simulations; simulations are separated by namespace.
+    self.f_db = f_db
+    # <max_bytes> is the upper bound on the total size of the stored
+    # responses. Once it is exceeded, we evict the least recently used
+    # entries until we are back under 90% of the bound.
+    self.max_bytes = max_bytes
+
+    # <namespace> is the simulation whose answers we are writing to, and
+    # <namespace_chain> is the list of namespaces we read from, in priority
+    # order. This is the current simulation followed by its fork ancestry.
+    # e.g., ["July1-step-3-21", "July1-step-3-20", "base_the_ville_n25"]
+    self.namespace = "default"
+    self.namespace_chain = ["default"]
+    # <discarded> holds the keys whose response failed validation in the
+    # current namespace. We no longer read those from the parent
+    # namespaces, so that a retry does not get the same bad answer back.
+    self.discarded = set()
+
+    # Counters for the current process.
+    self.hits = 0
+    self.misses = 0
+
+    folder = os.path.dirname(f_db)
+    if folder and not os.path.exists(folder):
+      os.makedirs(folder)
+
+    # The connection is shared by all threads, so every access goes through
+    # <self.lock>.
+    self.lock = threading.Lock()
+    self.conn = sqlite3.connect(f_db, check_same_thread=False)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                           namespace TEXT NOT NULL,
+                           key TEXT NOT NULL,
+                           response TEXT NOT NULL,
+                           size INTEGER NOT NULL,
+                           last_access REAL NOT NULL,
+                           PRIMARY KEY (namespace, key))""")
+    self.conn.execute("""CREATE INDEX IF NOT EXISTS responses_last_access
+                         ON responses (last_access)""")
+    self.conn.commit()
+    self.total_bytes = self.conn.execute(
+      "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+  @staticmethod
+  def make_key(model, prompt, gpt_parameter=None):
+    """
+    Returns the content address of a request.
+
+    INPUT
+      model: The string name of the model (e.g., "gpt-3.5-turbo")
+      prompt: The full str prompt.
+      gpt_parameter: A dictionary of sampling parameters, or None.
+    OUTPUT
+      A hex sha256 digest.
+    """
+    payload = json.dumps([model, prompt, gpt_parameter or {}],
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+  def set_namespace(self, namespace, parent_namespaces=None):
+    """
+    Sets the namespace we write to, and the chain of namespaces we read
+    from.
+
+    INPUT
+      namespace: The current simulation code.
+      parent_namespaces: The simulation codes that the current simulation was
+                         forked from, closest ancestor first.
+    OUTPUT
+      None
+    """
+    self.namespace = namespace
+    self.namespace_chain = [namespace]
+    self.discarded = set()
+    for i in parent_namespaces or []:
+      if i not in self.namespace_chain:
+        self.namespace_chain += [i]
+
+
+  def get(self, key, count=True):
+    """
+    Looks up a response by its key, walking the namespace chain.
+
+    INPUT
+      key: The content address from make_key.
+      count: If False, the lookup is not counted as a hit or a miss (e.g.,
+             when we look again for a key that we just missed).
+    OUTPUT
+      The cached str response, or None if there is a miss.
+    """
+    namespace_chain = self.namespace_chain
+    if key in self.discarded:
+      namespace_chain = [self.namespace]
+    placeholders = ", ".join(["?"] * len(namespace_chain))
+    with self.lock:
+      rows = self.conn.execute(
+        f"""SELECT namespace, response FROM responses
+            WHERE key = ? AND namespace IN ({placeholders})""",
+        [key] + namespace_chain).fetchall()
+      if not rows:
+        if count:
+          self.misses += 1
+        return None
+
+      found = dict(rows)
+      for namespace in namespace_chain:
+        if namespace in found:
+          self.conn.execute(
+            """UPDATE responses SET last_access = ?
+               WHERE namespace = ? AND key = ?""",
+            (time.time(), namespace, key))
+          self.conn.commit()
+          if count:
+            self.hits += 1
+          return found[namespace]
+
+
+  def put(self, key, response):
+    """
+    Stores a response under the current namespace and evicts old entries if
+    the cache grew beyond <max_bytes>.
+
+    INPUT
+      key: The content address from make_key.
+      response: The str response.
+    OUTPUT
+      None
+    """
+    size = len(response.encode("utf-8"))
+    with self.lock:
+      prev = self.conn.execute(
+        "SELECT size FROM responses WHERE namespace = ? AND key = ?",
+        (self.namespace, key)).fetchone()
+      if prev:
+        self.total_bytes -= prev[0]
+      self.conn.execute(
+        """INSERT OR REPLACE INTO responses
+           (namespace, key, response, size, last_access)
+           VALUES (?, ?, ?, ?, ?)""",
+        (self.namespace, key, response, size, time.time()))
+      self.total_bytes += size
+
+      if self.total_bytes > self.max_bytes:
+        self._evict(int(self.max_bytes * 0.9))
+      self.conn.commit()
+
+
+  def discard(self, key):
+    """
+    Removes a response from the current namespace, and stops reading it
+    from the parent namespaces. We call this when a cached response failed
+    validation so that the retry goes back to the model instead of
+    replaying the same bad answer.
+
+    INPUT
+      key: The content address from make_key.
+    OUTPUT
+      None
+    """
+    with self.lock:
+      self.discarded.add(key)
+      prev = self.conn.execute(
+        "SELECT size FROM responses WHERE namespace = ? AND key = ?",
+        (self.namespace, key)).fetchone()
+      if prev:
+        self.conn.execute(
+          "DELETE FROM responses WHERE namespace = ? AND key = ?",
+          (self.namespace, key))
+        self.conn.commit()
+        self.total_bytes -= prev[0]
+
+
+  def _evict(self, target_bytes):
+    # Drops the least recently used entries (across all namespaces) until
+    # the total size is at or below <target_bytes>. Expects <self.lock>.
+    rows = self.conn.execute(
+      """SELECT rowid, size FROM responses
+         ORDER BY last_access ASC""").fetchall()
+    evicted = []
+    for rowid, size in rows:
+      if self.total_bytes <= target_bytes:
+        break
+      evicted += [(rowid,)]
+      self.total_bytes -= size
+    self.conn.executemany("DELETE FROM responses WHERE rowid = ?", evicted)
+
+
+  def stats(self):
+    """
+    Returns a summary of the cache.
+
+    INPUT
+      None
+    OUTPUT
+      A dictionary with the hit/miss counters of this process, as well as the
+      number of entries and bytes that are stored on disk.
+    """
+    with self.lock:
+      entries = self.conn.execute(
+        "SELECT COUNT(*) FROM responses").fetchone()[0]
+    ret = dict()
+    ret["namespace"] = self.namespace
+    ret["hits"] = self.hits
+    ret["misses"] = self.misses
+    ret["entries"] = entries
+    ret["bytes"] = self.total_bytes
+    ret["max_bytes"] = self.max_bytes
+    return ret
+
+
+class InFlightRequests:
+  """
+  Tracks the requests that are currently on their way to the backend, so
+  that a thread that needs the same answer waits for the request that is
+  already being sent instead of sending a duplicate.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    # <pending> takes a request key and returns its PendingRequest.
+    self.pending = dict()
+    # <coalesced> counts the claims that waited for a request already in
+    # flight, in the current process.
+    self.coalesced = 0
+
+
+  def claim(self, key):
+    """
+    Registers interest in a request.
+
+    INPUT
+      key: A hashable key of the request.
+    OUTPUT
+      owner: True if the caller is the first to ask for <key>, and should
+             send the request and then call resolve. False if another thread
+             already is; the caller should wait on <pending>.
+      pending: The PendingRequest of <key>.
+    """
+    with self.lock:
+      if key in self.pending:
+        self.coalesced += 1
+        return False, self.pending[key]
+      pending = PendingRequest()
+      self.pending[key] = pending
+      return True, pending
+
+
+  def resolve(self, key, result=None, error=None):
+    """
+    Hands the result (or the exception) of a request to everyone waiting on
+    it.
+
+    INPUT
+      key: The key that was claimed.
+      result: The result of the request.
+      error: The exception the request raised, if any.
+    OUTPUT
+      None
+    """
+    with self.lock:
+      pending = self.pending.pop(key)
+    pending.result = result
+    pending.error = error
+    pending.done.set()
+
+
+class PendingRequest:
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+  def wait(self):
+    self.done.wait()
+    if self.error is not None:
+      raise self.error
+    return self.result
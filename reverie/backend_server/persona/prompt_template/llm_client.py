@@ -0,0 +1,266 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: llm_client.py
+Description: Paces and retries the requests that a backend sends to a rate
+limited LLM service.
+
+Every model gets a limiter that holds
+  1) a token bucket for the requests per minute, and one for the tokens per
+     minute (the prompt plus the tokens the response may use, as the
+     service counts them; the estimate is corrected once the response
+     reports its usage);
+  2) a semaphore that caps the number of requests in flight.
+A request that fails with a rate limit or a transient error is retried with
+exponential backoff and full jitter (or after the delay the service asked
+for). A rate limit error also pauses the other requests to the same model
+for that delay, so that concurrent personas back off together instead of
+all running into the limit again.
+"""
+import random
+import threading
+import time
+
+# The default limits of each model. <llm_rate_limits> can override them per
+# model, e.g., {"gpt-4": {"requests_per_minute": 200,
+#                         "tokens_per_minute": 40000,
+#                         "max_concurrency": 4}}
+# <llm_max_retries> is the number of times a request is retried, and the
+# delay before retry n is drawn from [0, min(<llm_backoff_max>,
+# <llm_backoff_base> * 2^n)] seconds. These can be overridden in utils.py.
+try:
+  from utils import llm_requests_per_minute
+except ImportError:
+  llm_requests_per_minute = 3500
+try:
+  from utils import llm_tokens_per_minute
+except ImportError:
+  llm_tokens_per_minute = 90000
+try:
+  from utils import llm_max_concurrency
+except ImportError:
+  llm_max_concurrency = 8
+try:
+  from utils import llm_rate_limits
+except ImportError:
+  llm_rate_limits = dict()
+try:
+  from utils import llm_max_retries
+except ImportError:
+  llm_max_retries = 6
+try:
+  from utils import llm_backoff_base
+except ImportError:
+  llm_backoff_base = 1.0
+try:
+  from utils import llm_backoff_max
+except ImportError:
+  llm_backoff_max = 60.0
+
+# <llm_http_pool_size> is the number of connections that the shared HTTP
+# session keeps open to the service. This can be overridden in utils.py.
+try:
+  from utils import llm_http_pool_size
+except ImportError:
+  llm_http_pool_size = 32
+
+
+class TokenBucket:
+  def __init__(self, per_minute):
+    # The bucket holds up to a minute's worth of <per_minute> and refills
+    # continuously. <level> can go below zero when a request turns out to
+    # have used more than was taken for it; later requests then wait longer.
+    self.rate = per_minute / 60.0
+    self.capacity = float(per_minute)
+    self.level = self.capacity
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+
+  def _refill(self):
+    now = time.monotonic()
+    self.level = min(self.capacity,
+                     self.level + (now - self.updated) * self.rate)
+    self.updated = now
+
+
+  def acquire(self, amount=1):
+    """
+    Takes <amount> out of the bucket, waiting until it holds that much. An
+    amount above the capacity is capped at the capacity, so that a single
+    large request does not wait forever.
+
+    INPUT
+      amount: The number of requests or tokens.
+    OUTPUT
+      None
+    """
+    amount = min(amount, self.capacity)
+    while True:
+      with self.lock:
+        self._refill()
+        if self.level >= amount:
+          self.level -= amount
+          return
+        wait = (amount - self.level) / self.rate
+      time.sleep(wait)
+
+
+  def adjust(self, amount):
+    """
+    Takes <amount> more out of the bucket (or gives it back if negative)
+    without waiting.
+    """
+    with self.lock:
+      self._refill()
+      self.level = min(self.capacity, self.level - amount)
+
+
+class ModelLimiter:
+  def __init__(self, requests_per_minute, tokens_per_minute,
+               max_concurrency):
+    self.requests = TokenBucket(requests_per_minute)
+    self.tokens = TokenBucket(tokens_per_minute)
+    self.slots = threading.BoundedSemaphore(max_concurrency)
+    # <paused_until> is the monotonic time before which no new request to
+    # this model is sent, after the service told us to slow down.
+    self.paused_until = 0.0
+    self.lock = threading.Lock()
+
+
+  def pause(self, seconds):
+    with self.lock:
+      self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+  def wait_until_resumed(self):
+    while True:
+      with self.lock:
+        wait = self.paused_until - time.monotonic()
+      if wait <= 0:
+        return
+      time.sleep(wait)
+
+
+class LLMClient:
+  def __init__(self, is_retryable, is_rate_limit=None, retry_after=None):
+    """
+    INPUT
+      is_retryable: A function that takes an exception and returns True if
+                    the request that raised it should be retried.
+      is_rate_limit: A function that takes an exception and returns True if
+                     it means that we hit a rate limit.
+      retry_after: A function that takes an exception and returns the
+                   seconds the service asked us to wait, or None.
+    """
+    self.is_retryable = is_retryable
+    self.is_rate_limit = is_rate_limit or (lambda error: False)
+    self.retry_after = retry_after or (lambda error: None)
+    self.max_retries = llm_max_retries
+    self.backoff_base = llm_backoff_base
+    self.backoff_max = llm_backoff_max
+    # The jitter has its own random number generator, so that retries do 
+    # not change the draws of the simulation.
+    self.rng = random.Random()
+
+    # <limiters> takes a model name and returns its ModelLimiter.
+    self.limiters = dict()
+    self.lock = threading.Lock()
+
+    # Counters of the current process.
+    self.retries = 0
+    self.rate_limited = 0
+
+
+  def get_limiter(self, model):
+    with self.lock:
+      if model not in self.limiters:
+        limits = llm_rate_limits.get(model, dict())
+        self.limiters[model] = ModelLimiter(
+          limits.get("requests_per_minute", llm_requests_per_minute),
+          limits.get("tokens_per_minute", llm_tokens_per_minute),
+          limits.get("max_concurrency", llm_max_concurrency))
+      return self.limiters[model]
+
+
+  def backoff_delay(self, attempt):
+    # Exponential backoff with full jitter.
+    return self.rng.uniform(0, min(self.backoff_max,
+                                     self.backoff_base * 2 ** attempt))
+
+
+  def request(self, model, send, tokens=0, count_tokens=None):
+    """
+    Sends a request within the limits of <model>, retrying it on rate limit
+    and transient errors.
+
+    INPUT
+      model: The string name of the model the request goes to.
+      send: A function that takes no arguments, sends the request, and
+            returns the response.
+      tokens: The estimated number of tokens the request uses.
+      count_tokens: A function that takes the response and returns the
+                    number of tokens it actually used, or None.
+    OUTPUT
+      The response of <send>. The error of the last attempt is raised if
+      every attempt failed, and other errors are raised right away.
+    """
+    limiter = self.get_limiter(model)
+    attempt = 0
+    while True:
+      limiter.wait_until_resumed()
+      limiter.requests.acquire(1)
+      limiter.tokens.acquire(tokens)
+      try:
+        with limiter.slots:
+          response = send()
+      except Exception as error:
+        if not self.is_retryable(error) or attempt >= self.max_retries:
+          raise
+        delay = self.retry_after(error)
+        if delay is None:
+          delay = self.backoff_delay(attempt)
+        if self.is_rate_limit(error):
+          self.rate_limited += 1
+          limiter.pause(delay)
+        self.retries += 1
+        attempt += 1
+        time.sleep(delay)
+        continue
+
+      if count_tokens:
+        used = count_tokens(response)
+        if used is not None:
+          limiter.tokens.adjust(used - tokens)
+      return response
+
+
+def estimate_tokens(text):
+  """
+  Returns a rough count of the tokens in <text> (about 4 characters per token
+  for English), for the requests whose usage we only learn afterwards.
+  """
+  return len(text) // 4 + 1
+
+
+def make_http_session(pool_size=None):
+  """
+  Returns a requests session that all threads can share, which keeps up to
+  <pool_size> (by default, <llm_http_pool_size>) connections alive between
+  requests. Without it, every worker thread opens its own connections.
+
+  INPUT
+    pool_size: The number of connections to keep.
+  OUTPUT
+    A requests.Session.
+  """
+  # We import requests here since only the live backends need it.
+  import requests
+  if pool_size is None:
+    pool_size = llm_http_pool_size
+  session = requests.Session()
+  adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                          pool_maxsize=pool_size)
+  session.mount("https://", adapter)
+  session.mount("http://", adapter)
+  return session
@@ -0,0 +1,123 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: prompt_registry.py
+Description: Keeps the prompt template files in memory, compiled for
+generate_prompt.
+
+A template file holds the raw prompt with !<INPUT 0>!, !<INPUT 1>!, ...
+where the inputs go, optionally preceded by a comment that ends with
+<commentblockmarker>###</commentblockmarker>. Rather than reading the file
+and replacing the placeholders one after another on every call, each file is
+read once and split into the literal text between the placeholders and the
+placeholders themselves, so that filling in a prompt is a single join.
+"""
+import os
+import re
+import threading
+
+comment_block_marker = "<commentblockmarker>###</commentblockmarker>"
+placeholder_pattern = re.compile(r"!<INPUT (\d+)>!")
+
+
+class PromptTemplate:
+  def __init__(self, text):
+    # Only the part after the comment block goes into the prompt.
+    if comment_block_marker in text:
+      text = text.split(comment_block_marker)[1]
+
+    # <segments> alternates between literal text (even positions) and the
+    # placeholder numbers (odd positions), e.g., for "Hi !<INPUT 0>!."
+    # ["Hi ", 0, "."]
+    self.segments = placeholder_pattern.split(text)
+    for i in range(1, len(self.segments), 2):
+      self.segments[i] = int(self.segments[i])
+
+
+  def render(self, curr_input):
+    """
+    Fills in the template.
+
+    INPUT
+      curr_input: The list of str inputs; input n goes where !<INPUT n>! is.
+                  Placeholders without an input are left as they are.
+    OUTPUT
+      The str prompt.
+    """
+    parts = list(self.segments)
+    n_inputs = len(curr_input)
+    for i in range(1, len(parts), 2):
+      if parts[i] < n_inputs:
+        parts[i] = curr_input[parts[i]]
+      else:
+        parts[i] = f"!<INPUT {parts[i]}>!"
+    return "".join(parts).strip()
+
+
+class PromptRegistry:
+  def __init__(self, reload=False):
+    # <reload> makes every lookup check whether the file changed since it
+    # was read, so that templates can be edited while a simulation runs.
+    self.reload = reload
+
+    # <templates> takes the absolute path of a template file and returns
+    # its (PromptTemplate, modification time) pair. <paths> takes a path as
+    # the callers spell it (e.g., "persona/prompt_template/v2/...") and
+    # returns its absolute path.
+    self.templates = dict()
+    self.paths = dict()
+    self.lock = threading.Lock()
+
+
+  def load(self, path):
+    """
+    Reads and compiles a template file.
+
+    INPUT
+      path: The absolute path of the file.
+    OUTPUT
+      The PromptTemplate.
+    """
+    mtime = os.path.getmtime(path)
+    with open(path, "r") as f:
+      template = PromptTemplate(f.read())
+    with self.lock:
+      self.templates[path] = (template, mtime)
+    return template
+
+
+  def preload(self, folder):
+    """
+    Reads and compiles every .txt template file under <folder>.
+
+    INPUT
+      folder: The folder to search.
+    OUTPUT
+      None
+    """
+    for root, dirs, files in os.walk(folder):
+      for file_name in files:
+        if file_name.endswith(".txt"):
+          self.load(os.path.abspath(os.path.join(root, file_name)))
+
+
+  def get(self, prompt_lib_file):
+    """
+    Returns the compiled template of a file, reading it first if it was not
+    read yet (or, with <reload>, if it changed since).
+
+    INPUT
+      prompt_lib_file: The path to the template file.
+    OUTPUT
+      The PromptTemplate.
+    """
+    path = self.paths.get(prompt_lib_file)
+    if path is None:
+      path = os.path.abspath(prompt_lib_file)
+      self.paths[prompt_lib_file] = path
+    entry = self.templates.get(path)
+    if entry is None:
+      return self.load(path)
+    if self.reload and os.path.getmtime(path) != entry[1]:
+      return self.load(path)
+    return entry[0]
@@ -30,8 +30,8 @@ def get_random_alphanumeric(i=6, j=6):
   OUTPUT:
     an alpha numeric str with the length of somewhere between i and j.
   """
-  k = random.randint(i, j)
-  x = ''.join(random.choices(string.ascii_letters + string.digits, k=k))
+  k = get_rng().randint(i, j)
+  x = ''.join(get_rng().choices(string.ascii_letters + string.digits, k=k))
   return x
 
 ##############################################################################
@@ -797,7 +797,7 @@ def run_gpt_prompt_action_game_object(action_description, persona, maze, temp_ad
 
   x = [i.strip() for i in persona.s_mem.get_str_accessible_arena_game_objects(temp_address).split(",")]
   if output not in x:
-    output = random.choice(x)
+    output = get_rng().choice(x)
 
   if verbose:
     print_run_prompts(prompt_template, persona, gpt_param,
@@ -1126,8 +1126,15 @@ def run_gpt_prompt_new_decomp_schedule(persona, main_act_dur, truncated_act_dur,
                     end_hour_str, end_hour_str, new_plan_init]
     return prompt_input
 
+  def __unwrap_prompt(prompt):
+    # ChatGPT_safe_generate_response passes us the prompt wrapped in its
+    # json instructions; the schedule is in the template prompt inside.
+    return prompt.split('"""\n', 1)[-1].rsplit('\n"""\n', 1)[0]
+
   def __chat_func_clean_up(gpt_response, prompt=""):
-    new_schedule = prompt + " " + gpt_response.strip()
+    # The prompt ends with the revised schedule so far, whose last line is
+    # an open "HH:MM ~" that the response completes.
+    new_schedule = __unwrap_prompt(prompt) + " " + gpt_response.strip()
     new_schedule = new_schedule.split("The revised schedule:")[-1].strip()
     new_schedule = new_schedule.split("\n")
 
@@ -1157,7 +1164,7 @@ def run_gpt_prompt_new_decomp_schedule(persona, main_act_dur, truncated_act_dur,
           return False
         if str(type(dur)) != "<class 'int'>":
           return False
-      x = prompt.split("\n")[0].split("originally planned schedule from")[-1].strip()[:-1]
+      x = __unwrap_prompt(prompt).split("\n")[0].split("originally planned schedule from")[-1].strip()[:-1]
       x = [datetime.datetime.strptime(i.strip(), "%H:%M %p") for i in x.split(" to ")]
       delta_min = int((x[1] - x[0]).total_seconds()/60)
 
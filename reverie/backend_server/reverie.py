@@ -25,9 +25,12 @@ import pickle
 import time
 import math
 import os
+import random
 import shutil
+import sys
 import traceback
 
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 
 from global_methods import *
@@ -35,6 +38,20 @@ from utils import *
 from maze import *
 from persona.persona import *
 
+# <persona_workers> is the default number of threads that step the personas
+# (see ReverieServer.move_personas). This can be overridden in utils.py. 
+try: 
+  from utils import persona_workers
+except ImportError: 
+  persona_workers = 1
+
+# <autosave_steps> is the default number of steps between automatic saves 
+# (0 turns them off). This can be overridden in utils.py. 
+try: 
+  from utils import autosave_steps
+except ImportError: 
+  autosave_steps = 0
+
 ##############################################################################
 #                                  REVERIE                                   #
 ##############################################################################
@@ -42,7 +59,8 @@ from persona.persona import *
 class ReverieServer: 
   def __init__(self, 
                fork_sim_code,
-               sim_code):
+               sim_code,
+               llm_backend=None):
     # FORKING FROM A PRIOR SIMULATION:
     # <fork_sim_code> indicates the simulation we are forking from. 
     # Interestingly, all simulations must be forked from some initial 
@@ -62,6 +80,10 @@ class ReverieServer:
 
     with open(f"{sim_folder}/reverie/meta.json", "w") as outfile: 
       reverie_meta["fork_sim_code"] = fork_sim_code
+      # <llm_backend>, if given, pins the backend of the new simulation 
+      # rather than inheriting the one of the simulation we fork from. 
+      if llm_backend: 
+        reverie_meta["llm_backend"] = llm_backend
       outfile.write(json.dumps(reverie_meta, indent=2))
 
     # LOADING REVERIE'S GLOBAL VARIABLES
@@ -82,6 +104,18 @@ class ReverieServer:
     # <sec_per_step> denotes the number of seconds in game time that each 
     # step moves foward. 
     self.sec_per_step = reverie_meta['sec_per_step']
+
+    # LLM RESPONSE CACHE
+    # LLM responses are cached per simulation. We write to the namespace of
+    # the current simulation, but read from every simulation in its fork
+    # ancestry as well, so that a fork can replay its parent's answers. 
+    set_llm_cache_namespace(self.sim_code, self.get_fork_ancestry())
+
+    # <llm_backend> is the name of the LLM backend this simulation runs on. 
+    # A simulation can pin its backend in reverie/meta.json (e.g., 
+    # "llm_backend": "offline"); otherwise we use the default from utils.py. 
+    self.llm_backend = reverie_meta.get("llm_backend", llm_backend_name)
+    set_llm_backend(self.llm_backend)
     
     # <maze> is the main Maze instance. Note that we pass in the maze_name
     # (e.g., "double_studio") to instantiate Maze. 
@@ -118,24 +152,39 @@ class ReverieServer:
     # # e.g., dict[("Adam Abraham", "Zane Xu")] = "Adam: baba \n Zane:..."
     # self.persona_convo = dict()
 
-    # Loading in all personas. 
+    # Loading in all personas. With <persona_workers> above 1, the personas
+    # are loaded on that many threads; they are still added in the order of
+    # meta.json. 
     init_env_file = f"{sim_folder}/environment/{str(self.step)}.json"
     init_env = json.load(open(init_env_file))
-    for persona_name in reverie_meta['persona_names']: 
-      persona_folder = f"{sim_folder}/personas/{persona_name}"
+    persona_names = reverie_meta['persona_names']
+    persona_folders = [f"{sim_folder}/personas/{persona_name}" 
+                       for persona_name in persona_names]
+    with ThreadPoolExecutor(max_workers=max(1, persona_workers)) as pool: 
+      loaded_personas = list(pool.map(Persona, persona_names, 
+                                      persona_folders))
+    for persona_name, curr_persona in zip(persona_names, loaded_personas): 
       p_x = init_env[persona_name]["x"]
       p_y = init_env[persona_name]["y"]
-      curr_persona = Persona(persona_name, persona_folder)
 
       self.personas[persona_name] = curr_persona
       self.personas_tile[persona_name] = (p_x, p_y)
-      self.maze.tiles[p_y][p_x]["events"].add(curr_persona.scratch
-                                              .get_curr_event_and_desc())
+      self.maze.add_event_from_tile(curr_persona.scratch
+                                    .get_curr_event_and_desc(), (p_x, p_y))
 
     # REVERIE SETTINGS PARAMETERS:  
     # <server_sleep> denotes the amount of time that our while loop rests each
     # cycle; this is to not kill our machine. 
     self.server_sleep = 0.1
+    # <persona_workers> denotes the number of threads that step the personas.
+    # With 1, the personas move one after another. With more, the parts of 
+    # each persona's cognitive sequence that only touch its own state (most 
+    # of the LLM calls) run concurrently. See move_personas. 
+    self.persona_workers = persona_workers
+    # <autosave_steps> denotes the number of steps between automatic saves.
+    # With 0, we only save when asked to. Saves are cheap since they only 
+    # append to each persona's journal (see Persona.save). 
+    self.autosave_steps = autosave_steps
 
     # SIGNALING THE FRONTEND SERVER: 
     # curr_sim_code.json contains the current simulation code, and
@@ -154,13 +203,40 @@ class ReverieServer:
       outfile.write(json.dumps(curr_step, indent=2))
 
 
-  def save(self): 
+  def get_fork_ancestry(self): 
+    """
+    Follows the fork_sim_code pointers in the reverie/meta.json files to 
+    collect the simulations that the current simulation descends from. 
+
+    INPUT
+      None
+    OUTPUT 
+      A list of simulation codes, closest ancestor first. 
+      e.g., ["July1_the_ville_isabella_maria_klaus-step-3-20", 
+             "July1_the_ville_isabella_maria_klaus-step-3-19", ...]
+    """
+    ancestry = []
+    curr_sim_code = self.fork_sim_code
+    while (curr_sim_code 
+           and curr_sim_code != self.sim_code
+           and curr_sim_code not in ancestry): 
+      ancestry += [curr_sim_code]
+      meta_file = f"{fs_storage}/{curr_sim_code}/reverie/meta.json"
+      if not check_if_file_exists(meta_file): 
+        break
+      with open(meta_file) as json_file: 
+        curr_sim_code = json.load(json_file).get("fork_sim_code")
+    return ancestry
+
+
+  def save(self, compact=False): 
     """
     Save all Reverie progress -- this includes Reverie's global state as well
     as all the personas.  
 
     INPUT
-      None
+      compact: If True, the personas' memory files are rewritten in full 
+               instead of appending to their journals. 
     OUTPUT 
       None
       * Saves all relevant data to the designated memory directory
@@ -177,6 +253,7 @@ class ReverieServer:
     reverie_meta["maze_name"] = self.maze.maze_name
     reverie_meta["persona_names"] = list(self.personas.keys())
     reverie_meta["step"] = self.step
+    reverie_meta["llm_backend"] = self.llm_backend
     reverie_meta_f = f"{sim_folder}/reverie/meta.json"
     with open(reverie_meta_f, "w") as outfile: 
       outfile.write(json.dumps(reverie_meta, indent=2))
@@ -184,7 +261,7 @@ class ReverieServer:
     # Save the personas.
     for persona_name, persona in self.personas.items(): 
       save_folder = f"{sim_folder}/personas/{persona_name}/bootstrap_memory"
-      persona.save(save_folder)
+      persona.save(save_folder, compact)
 
 
   def start_path_tester_server(self): 
@@ -325,93 +402,270 @@ class ReverieServer:
           pass
       
         if env_retrieved: 
-          # This is where we go through <game_obj_cleanup> to clean up all 
-          # object actions that were used in this cylce. 
-          for key, val in game_obj_cleanup.items(): 
-            # We turn all object actions to their blank form (with None). 
-            self.maze.turn_event_from_tile_idle(key, val)
-          # Then we initialize game_obj_cleanup for this cycle. 
-          game_obj_cleanup = dict()
-
-          # We first move our personas in the backend environment to match 
-          # the frontend environment. 
-          for persona_name, persona in self.personas.items(): 
-            # <curr_tile> is the tile that the persona was at previously. 
-            curr_tile = self.personas_tile[persona_name]
-            # <new_tile> is the tile that the persona will move to right now,
-            # during this cycle. 
-            new_tile = (new_env[persona_name]["x"], 
-                        new_env[persona_name]["y"])
-
-            # We actually move the persona on the backend tile map here. 
-            self.personas_tile[persona_name] = new_tile
-            self.maze.remove_subject_events_from_tile(persona.name, curr_tile)
-            self.maze.add_event_from_tile(persona.scratch
-                                         .get_curr_event_and_desc(), new_tile)
-
-            # Now, the persona will travel to get to their destination. *Once*
-            # the persona gets there, we activate the object action.
-            if not persona.scratch.planned_path: 
-              # We add that new object action event to the backend tile map. 
-              # At its creation, it is stored in the persona's backend. 
-              game_obj_cleanup[persona.scratch
-                               .get_curr_obj_event_and_desc()] = new_tile
-              self.maze.add_event_from_tile(persona.scratch
-                                     .get_curr_obj_event_and_desc(), new_tile)
-              # We also need to remove the temporary blank action for the 
-              # object that is currently taking the action. 
-              blank = (persona.scratch.get_curr_obj_event_and_desc()[0], 
-                       None, None, None)
-              self.maze.remove_event_from_tile(blank, new_tile)
-
-          # Then we need to actually have each of the personas perceive and
-          # move. The movement for each of the personas comes in the form of
-          # x y coordinates where the persona will move towards. e.g., (50, 34)
-          # This is where the core brains of the personas are invoked. 
-          movements = {"persona": dict(), 
-                       "meta": dict()}
-          for persona_name, persona in self.personas.items(): 
-            # <next_tile> is a x,y coordinate. e.g., (58, 9)
-            # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
-            # <description> is a string description of the movement. e.g., 
-            #   writing her next novel (editing her novel) 
-            #   @ double studio:double studio:common room:sofa
-            next_tile, pronunciatio, description = persona.move(
-              self.maze, self.personas, self.personas_tile[persona_name], 
-              self.curr_time)
-            movements["persona"][persona_name] = {}
-            movements["persona"][persona_name]["movement"] = next_tile
-            movements["persona"][persona_name]["pronunciatio"] = pronunciatio
-            movements["persona"][persona_name]["description"] = description
-            movements["persona"][persona_name]["chat"] = (persona
-                                                          .scratch.chat)
-
-          # Include the meta information about the current stage in the 
-          # movements dictionary. 
-          movements["meta"]["curr_time"] = (self.curr_time 
-                                             .strftime("%B %d, %Y, %H:%M:%S"))
-
-          # We then write the personas' movements to a file that will be sent 
-          # to the frontend server. 
-          # Example json output: 
-          # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
-          #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
-          #  "meta": {curr_time: <datetime>}}
-          curr_move_file = f"{sim_folder}/movement/{self.step}.json"
-          with open(curr_move_file, "w") as outfile: 
-            outfile.write(json.dumps(movements, indent=2))
-
-          # After this cycle, the world takes one step forward, and the 
-          # current time moves by <sec_per_step> amount. 
-          self.step += 1
-          self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
-
+          movements, game_obj_cleanup = self.step_world(new_env, 
+                                                        game_obj_cleanup)
           int_counter -= 1
           
       # Sleep so we don't burn our machines. 
       time.sleep(self.server_sleep)
 
 
+  def step_world(self, new_env, game_obj_cleanup, write_movements=True): 
+    """
+    Takes one step of the simulation: moves the personas to the tiles of 
+    <new_env>, runs their cognitive sequences, and moves the world one step 
+    forward. 
+
+    INPUT
+      new_env: A dictionary that takes a persona's name and returns its tile
+               at the current step, in the form of the environment files the
+               frontend outputs. 
+               e.g., {"Maria Lopez": {"maze": "the_ville", "x": 58, "y": 9}}
+      game_obj_cleanup: The object events that were added in the previous 
+                        step, which we turn back to idle here. 
+      write_movements: If True, the movements are written to the movement 
+                       folder for the frontend. 
+    OUTPUT 
+      movements: The movements of the personas (see below). 
+      game_obj_cleanup: The object events that were added in this step. 
+    """
+    # <sim_folder> points to the current simulation folder.
+    sim_folder = f"{fs_storage}/{self.sim_code}"
+
+    # If profiling is on, the time this step takes is broken down by persona
+    # and phase, and appended to the profile file (see step_profiler.py). 
+    step_profiler.begin_step(self.sim_code, self.step)
+
+    # This is where we go through <game_obj_cleanup> to clean up all 
+    # object actions that were used in this cylce. 
+    for key, val in game_obj_cleanup.items(): 
+      # We turn all object actions to their blank form (with None). 
+      self.maze.turn_event_from_tile_idle(key, val)
+    # Then we initialize game_obj_cleanup for this cycle. 
+    game_obj_cleanup = dict()
+
+    # We first move our personas in the backend environment to match 
+    # the frontend environment. 
+    for persona_name, persona in self.personas.items(): 
+      # <curr_tile> is the tile that the persona was at previously. 
+      curr_tile = self.personas_tile[persona_name]
+      # <new_tile> is the tile that the persona will move to right now,
+      # during this cycle. 
+      new_tile = (new_env[persona_name]["x"], 
+                  new_env[persona_name]["y"])
+
+      # We actually move the persona on the backend tile map here. 
+      self.personas_tile[persona_name] = new_tile
+      self.maze.remove_subject_events_from_tile(persona.name, curr_tile)
+      self.maze.add_event_from_tile(persona.scratch
+                                   .get_curr_event_and_desc(), new_tile)
+
+      # Now, the persona will travel to get to their destination. *Once*
+      # the persona gets there, we activate the object action.
+      if not persona.scratch.planned_path: 
+        # We add that new object action event to the backend tile map. 
+        # At its creation, it is stored in the persona's backend. 
+        game_obj_cleanup[persona.scratch
+                         .get_curr_obj_event_and_desc()] = new_tile
+        self.maze.add_event_from_tile(persona.scratch
+                               .get_curr_obj_event_and_desc(), new_tile)
+        # We also need to remove the temporary blank action for the 
+        # object that is currently taking the action. 
+        blank = (persona.scratch.get_curr_obj_event_and_desc()[0], 
+                 None, None, None)
+        self.maze.remove_event_from_tile(blank, new_tile)
+
+    # Then we need to actually have each of the personas perceive and
+    # move. The movement for each of the personas comes in the form of
+    # x y coordinates where the persona will move towards. e.g., (50, 34)
+    # This is where the core brains of the personas are invoked. 
+    movements = {"persona": dict(), 
+                 "meta": dict()}
+    executions = self.move_personas()
+    for persona_name, persona in self.personas.items(): 
+      # <next_tile> is a x,y coordinate. e.g., (58, 9)
+      # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
+      # <description> is a string description of the movement. e.g., 
+      #   writing her next novel (editing her novel) 
+      #   @ double studio:double studio:common room:sofa
+      next_tile, pronunciatio, description = executions[persona_name]
+      movements["persona"][persona_name] = {}
+      movements["persona"][persona_name]["movement"] = next_tile
+      movements["persona"][persona_name]["pronunciatio"] = pronunciatio
+      movements["persona"][persona_name]["description"] = description
+      movements["persona"][persona_name]["chat"] = (persona
+                                                    .scratch.chat)
+
+    # Include the meta information about the current stage in the 
+    # movements dictionary. 
+    movements["meta"]["curr_time"] = (self.curr_time 
+                                       .strftime("%B %d, %Y, %H:%M:%S"))
+
+    # We then write the personas' movements to a file that will be sent 
+    # to the frontend server. 
+    # Example json output: 
+    # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
+    #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
+    #  "meta": {curr_time: <datetime>}}
+    if write_movements: 
+      curr_move_file = f"{sim_folder}/movement/{self.step}.json"
+      with open(curr_move_file, "w") as outfile: 
+        outfile.write(json.dumps(movements, indent=2))
+
+    step_profiler.end_step(f"{sim_folder}/reverie/profile.jsonl")
+
+    # After this cycle, the world takes one step forward, and the 
+    # current time moves by <sec_per_step> amount. 
+    self.step += 1
+    self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
+
+    if self.autosave_steps and self.step % self.autosave_steps == 0: 
+      self.save()
+
+    return movements, game_obj_cleanup
+
+
+  def run_headless(self, int_counter, write_movements=True): 
+    """
+    Runs the simulation without the frontend. Rather than waiting for the 
+    frontend to write the environment file of each step, we move each 
+    persona straight to the next tile it returned, so there is no polling 
+    and no sleeping between steps. 
+
+    INPUT
+      int_counter: Integer value for the number of steps to take. 
+      write_movements: If True, the movements are still written to the 
+                       movement folder so the run can be replayed later. 
+    OUTPUT 
+      None
+      * Writes the environment file of the step we stop at, so that the 
+        simulation can be continued with start_server. 
+    """
+    # <sim_folder> points to the current simulation folder.
+    sim_folder = f"{fs_storage}/{self.sim_code}"
+
+    # We start from the environment file of the current step if there is 
+    # one; otherwise from the movements of the previous step, or the tiles 
+    # we already have. 
+    curr_env_file = f"{sim_folder}/environment/{self.step}.json"
+    prev_move_file = f"{sim_folder}/movement/{self.step - 1}.json"
+    if check_if_file_exists(curr_env_file): 
+      with open(curr_env_file) as json_file: 
+        new_env = json.load(json_file)
+    elif check_if_file_exists(prev_move_file): 
+      with open(prev_move_file) as json_file: 
+        prev_movements = json.load(json_file)["persona"]
+      new_env = {persona_name: {"maze": self.maze.maze_name, 
+                                "x": val["movement"][0], 
+                                "y": val["movement"][1]}
+                 for persona_name, val in prev_movements.items()}
+    else: 
+      new_env = {persona_name: {"maze": self.maze.maze_name, 
+                                "x": tile[0], 
+                                "y": tile[1]}
+                 for persona_name, tile in self.personas_tile.items()}
+
+    if write_movements: 
+      create_folder_if_not_there(f"{sim_folder}/movement/")
+    game_obj_cleanup = dict()
+    for count in range(int_counter): 
+      movements, game_obj_cleanup = self.step_world(new_env, 
+                                                    game_obj_cleanup, 
+                                                    write_movements)
+      # The next tile of each persona is its tile in the next step. 
+      new_env = {persona_name: {"maze": self.maze.maze_name, 
+                                "x": val["movement"][0], 
+                                "y": val["movement"][1]}
+                 for persona_name, val in movements["persona"].items()}
+
+    with open(f"{sim_folder}/environment/{self.step}.json", "w") as outfile: 
+      outfile.write(json.dumps(new_env, indent=2))
+
+
+  def move_personas(self): 
+    """
+    Runs the cognitive sequence of every persona for the current step. 
+
+    With <persona_workers> set to 1, this simply calls persona.move for each
+    persona in turn. Otherwise, the step is split into phases with a merge 
+    point between them: 
+      1) perceive, retrieve, and plan the persona's own schedule -- 
+         concurrently, since these only touch the persona's own state and 
+         read the maze; 
+      2) react to the perceived events (e.g., start a conversation) -- one 
+         persona after another in the order of <self.personas>, since this
+         reads and changes the other personas; 
+      3) reflect -- concurrently; 
+      4) execute -- one persona after another, since it picks the target 
+         tiles based on where the other personas are. 
+    No persona touches the maze events until all of these are done, so 
+    given the same LLM outputs, the result does not depend on how the 
+    threads happened to be scheduled. 
+
+    INPUT 
+      None
+    OUTPUT 
+      A dictionary that takes the persona names as keys, and the execution 
+      triples (next_tile, pronunciatio, description) as values. 
+    """
+    executions = dict()
+    if self.persona_workers <= 1: 
+      for persona_name, persona in self.personas.items(): 
+        executions[persona_name] = persona.move(
+          self.maze, self.personas, self.personas_tile[persona_name], 
+          self.curr_time)
+      return executions
+
+    # In phase 1, each persona draws from its own random number generator 
+    # (e.g., for the IDs in the hourly schedule prompt) rather than the 
+    # shared one, since the order of the draws would otherwise depend on how
+    # the threads happened to run. The generators are seeded from the shared
+    # one in persona order. 
+    seeds = dict()
+    for persona_name in self.personas: 
+      seeds[persona_name] = random.getrandbits(64)
+
+    with ThreadPoolExecutor(max_workers=self.persona_workers) as pool: 
+      # Phase 1. We collect the results in persona order; result() re-raises
+      # the exception of a failed persona here. 
+      futures = dict()
+      for persona_name, persona in self.personas.items(): 
+        futures[persona_name] = pool.submit(
+          self._prepare_move, persona, seeds[persona_name])
+      retrieved = dict()
+      for persona_name, future in futures.items(): 
+        retrieved[persona_name] = future.result()
+
+      # Phase 2. 
+      plans = dict()
+      for persona_name, persona in self.personas.items(): 
+        plans[persona_name] = persona.react(self.maze, self.personas, 
+                                            retrieved[persona_name])
+
+      # Phase 3. 
+      futures = [pool.submit(persona.reflect) 
+                 for persona in self.personas.values()]
+      for future in futures: 
+        future.result()
+
+    # Phase 4. 
+    for persona_name, persona in self.personas.items(): 
+      executions[persona_name] = persona.execute(self.maze, self.personas, 
+                                                 plans[persona_name])
+    return executions
+
+
+  def _prepare_move(self, persona, seed): 
+    # Runs phase 1 of move_personas for <persona> on a worker thread, with 
+    # the thread's random number generator seeded by <seed>. 
+    set_thread_rng(random.Random(seed))
+    try: 
+      return persona.prepare_move(self.maze, self.personas_tile[persona.name],
+                                  self.curr_time)
+    finally: 
+      set_thread_rng(None)
+
+
   def open_server(self): 
     """
     Open up an interactive terminal prompt that lets you run the simulation 
@@ -438,8 +692,10 @@ class ReverieServer:
       try: 
         if sim_command.lower() in ["f", "fin", "finish", "save and finish"]: 
           # Finishes the simulation environment and saves the progress. 
+          # The memory files are written in full so that the frontend's 
+          # replay pages see the final state. 
           # Example: fin
-          self.save()
+          self.save(compact=True)
           break
 
         elif sim_command.lower() == "start path tester mode": 
@@ -461,6 +717,19 @@ class ReverieServer:
           # Example: save
           self.save()
 
+        elif "set persona workers" in sim_command[:19].lower(): 
+          # Sets the number of threads that step the personas; 1 moves the
+          # personas one after another. 
+          # Example: set persona workers 8
+          self.persona_workers = max(1, int(sim_command.split()[-1]))
+
+        elif sim_command[:12].lower() == "run headless": 
+          # Runs the number of steps specified in the prompt without the 
+          # frontend. 
+          # Example: run headless 1000
+          int_count = int(sim_command.split()[-1])
+          self.run_headless(int_count)
+
         elif sim_command[:3].lower() == "run": 
           # Runs the number of steps specified in the prompt.
           # Example: run 1000
@@ -550,6 +819,54 @@ class ReverieServer:
           ret_str += f'{self.curr_time.strftime("%B %d, %Y, %H:%M:%S")}\n'
           ret_str += f'steps: {self.step}'
 
+        elif ("print llm cache stats" 
+              in sim_command.lower()): 
+          # Print the hit/miss counters and size of the LLM response cache.
+          # Ex: print llm cache stats
+          stats = get_llm_cache_stats()
+          if stats: 
+            for key, val in stats.items(): 
+              ret_str += f"{key}: {val}\n"
+          else: 
+            ret_str += "LLM response cache is turned off.\n"
+          stats = get_embedding_stats()
+          if stats: 
+            for key, val in stats.items(): 
+              ret_str += f"embedding store {key}: {val}\n"
+          else: 
+            ret_str += "Embedding store is turned off.\n"
+          for key, val in get_llm_coalescing_stats().items(): 
+            ret_str += f"coalesced {key}: {val}\n"
+
+        elif sim_command.lower() in ["profile on", "profile off"]: 
+          # Turns the step profiler on or off. The steps that are run while
+          # it is on are recorded in reverie/profile.jsonl. 
+          # Ex: profile on
+          step_profiler.enabled = sim_command.lower() == "profile on"
+
+        elif sim_command.lower() == "profile summary": 
+          # Print the wall time, LLM requests, tokens, cache hits, embedding
+          # requests, and path searches of the profiled steps by phase. 
+          # Ex: profile summary
+          f_profile = f"{sim_folder}/reverie/profile.jsonl"
+          if check_if_file_exists(f_profile): 
+            ret_str += summarize_profile(iter_profile(f_profile, 
+                                                      self.sim_code))
+          else: 
+            ret_str += "No profiled steps."
+
+        elif sim_command.lower() == "profile export": 
+          # Writes the profiled steps of this simulation to 
+          # reverie/profile.csv, one row per persona and phase of each step.
+          # Ex: profile export
+          f_profile = f"{sim_folder}/reverie/profile.jsonl"
+          if check_if_file_exists(f_profile): 
+            export_profile_csv(iter_profile(f_profile, self.sim_code), 
+                               f"{sim_folder}/reverie/profile.csv")
+            ret_str += f"Wrote {sim_folder}/reverie/profile.csv"
+          else: 
+            ret_str += "No profiled steps."
+
         elif ("print tile event" 
               in sim_command[:16].lower()): 
           # Print the tile events in the tile specified in the prompt 
@@ -605,11 +922,18 @@ if __name__ == '__main__':
   #                    "July1_the_ville_isabella_maria_klaus-step-3-21")
   # rs.open_server()
 
-  origin = input("Enter the name of the forked simulation: ").strip()
-  target = input("Enter the name of the new simulation: ").strip()
-
-  rs = ReverieServer(origin, target)
-  rs.open_server()
+  if len(sys.argv) == 4: 
+    # Runs a simulation headless from the command line, then saves it. 
+    # e.g., python reverie.py base_the_ville_isabella_maria_klaus test-1 8640
+    rs = ReverieServer(sys.argv[1], sys.argv[2])
+    rs.run_headless(int(sys.argv[3]))
+    rs.save(compact=True)
+  else: 
+    origin = input("Enter the name of the forked simulation: ").strip()
+    target = input("Enter the name of the new simulation: ").strip()
+
+    rs = ReverieServer(origin, target)
+    rs.open_server()
 
 
 
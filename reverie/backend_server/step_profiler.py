@@ -0,0 +1,358 @@
+"""
+Author: Joon Sung Park (joonspk@stanford.edu)
+
+File: step_profiler.py
+Description: Records where the time of each simulation step goes.
+
+When profiling is on, every step is broken down into one row per persona and
+cognitive phase (perceive, retrieve, plan, react, reflect, execute), plus a
+"step" row for the step as a whole. A row holds the wall time of the phase,
+the number and latency of the LLM requests sent from it, the LLM responses
+that came from the cache or from an identical request that was already in
+flight, the tokens the backend reported, the embedding requests, and the time
+spent searching for paths. The rows are appended to reverie/profile.jsonl in
+the simulation folder, one JSON object per line.
+
+The counters of a row are only updated by the thread that runs the phase, so
+the profiler works the same when the personas are stepped in parallel.
+"""
+import csv
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+
+# <profile_steps> turns the step profiler on when the server starts. It can
+# also be turned on and off with the "profile on" / "profile off" commands.
+# This can be overridden in utils.py.
+try:
+  from utils import profile_steps
+except ImportError:
+  profile_steps = False
+
+
+class StepProfiler:
+  # The phases a step is broken down into, in the order they run.
+  phases = ["perceive", "retrieve", "plan", "react", "reflect", "execute"]
+  # The counters every row holds, in the column order of the exports.
+  counters = ["wall_seconds", "llm_calls", "llm_seconds", "llm_cache_hits",
+              "llm_coalesced", "prompt_tokens", "completion_tokens",
+              "embedding_calls", "embedding_seconds", "path_searches",
+              "path_seconds"]
+  columns = ["sim_code", "step", "persona", "phase"] + counters
+
+  def __init__(self, enabled=False):
+    self.enabled = enabled
+
+    # <sim_code> and <step> identify the step that is being profiled, and
+    # <step> is None in between steps. <rows> takes a (persona name, phase)
+    # pair and returns the row of the current step; the step row is under
+    # (None, "step").
+    self.sim_code = None
+    self.step = None
+    self.step_start = None
+    self.rows = dict()
+    self.lock = threading.Lock()
+
+    # <local.row> is the row of the phase that this thread is running.
+    self.local = threading.local()
+
+    # <write_seconds> is the time spent appending rows to profile files, so
+    # that timings of whole runs can leave the profiler's own I/O out.
+    self.write_seconds = 0.0
+
+
+  def begin_step(self, sim_code, step):
+    """
+    Starts profiling a step. Nothing is recorded if profiling is off.
+
+    INPUT
+      sim_code: The current simulation code.
+      step: The step number.
+    OUTPUT
+      None
+    """
+    if not self.enabled:
+      return
+    self.sim_code = sim_code
+    self.step = step
+    self.rows = {(None, "step"): self._new_row(None, "step")}
+    self.step_start = time.perf_counter()
+
+
+  def end_step(self, f_profile=None):
+    """
+    Finishes the step that begin_step started. The step row gets the wall
+    time of the whole step, and the sum of the counters of the phase rows
+    plus whatever was recorded outside of a phase.
+
+    INPUT
+      f_profile: The JSON lines file the rows are appended to, or None.
+    OUTPUT
+      The list of rows of the step (empty if profiling was off).
+    """
+    if self.step is None:
+      return []
+    step_row = self.rows[(None, "step")]
+    for key, row in self.rows.items():
+      if key == (None, "step"):
+        continue
+      for counter in self.counters[1:]:
+        step_row[counter] += row[counter]
+    step_row["wall_seconds"] = time.perf_counter() - self.step_start
+
+    rows = [row for key, row in self.rows.items() if key != (None, "step")]
+    rows += [step_row]
+    if f_profile:
+      start = time.perf_counter()
+      with open(f_profile, "a") as f:
+        for row in rows:
+          f.write(json.dumps(row) + "\n")
+      self.write_seconds += time.perf_counter() - start
+    self.step = None
+    self.rows = dict()
+    return rows
+
+
+  def _new_row(self, persona_name, phase):
+    row = {"sim_code": self.sim_code, "step": self.step,
+           "persona": persona_name, "phase": phase}
+    for counter in self.counters:
+      row[counter] = 0
+    return row
+
+
+  @contextmanager
+  def phase(self, persona_name, phase):
+    """
+    Attributes the wall time of the enclosed block, and everything recorded
+    on this thread in the meantime, to a persona's phase. Phases do not
+    nest; an inner phase is counted as part of the outer one.
+
+    INPUT
+      persona_name: The name of the persona.
+      phase: One of <phases>.
+    OUTPUT
+      None
+    """
+    if self.step is None or getattr(self.local, "row", None) is not None:
+      yield
+      return
+    with self.lock:
+      key = (persona_name, phase)
+      if key not in self.rows:
+        self.rows[key] = self._new_row(persona_name, phase)
+      row = self.rows[key]
+    self.local.row = row
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      row["wall_seconds"] += time.perf_counter() - start
+      self.local.row = None
+
+
+  def _current_row(self):
+    # The row that the counters of this thread go to, or None if we are not
+    # profiling a step.
+    if self.step is None:
+      return None
+    row = getattr(self.local, "row", None)
+    if row is None:
+      row = self.rows.get((None, "step"))
+    return row
+
+
+  def _add(self, row, counter, value):
+    if row is self.rows.get((None, "step")):
+      # Threads outside of a phase all share the step row.
+      with self.lock:
+        row[counter] += value
+    else:
+      row[counter] += value
+
+
+  def record_llm_call(self, seconds, usage=None):
+    """
+    Records an LLM request that was sent to the backend.
+
+    INPUT
+      seconds: The latency of the request.
+      usage: The (prompt tokens, completion tokens) pair that the backend
+             reported, or None.
+    OUTPUT
+      None
+    """
+    row = self._current_row()
+    if row is None:
+      return
+    self._add(row, "llm_calls", 1)
+    self._add(row, "llm_seconds", seconds)
+    if usage:
+      self._add(row, "prompt_tokens", usage[0])
+      self._add(row, "completion_tokens", usage[1])
+
+
+  def record_llm_cache_hit(self):
+    """
+    Records an LLM request that was answered from the response cache.
+    """
+    row = self._current_row()
+    if row is not None:
+      self._add(row, "llm_cache_hits", 1)
+
+
+  def record_llm_coalesced(self):
+    """
+    Records an LLM request that waited for an identical request that was
+    already in flight instead of being sent.
+    """
+    row = self._current_row()
+    if row is not None:
+      self._add(row, "llm_coalesced", 1)
+
+
+  def record_embedding_call(self, seconds):
+    """
+    Records a batch of texts that was sent to the backend to be embedded.
+
+    INPUT
+      seconds: The latency of the request.
+    OUTPUT
+      None
+    """
+    row = self._current_row()
+    if row is not None:
+      self._add(row, "embedding_calls", 1)
+      self._add(row, "embedding_seconds", seconds)
+
+
+  @contextmanager
+  def path_search(self):
+    """
+    Records the time of the path search in the enclosed block.
+    """
+    row = self._current_row()
+    if row is None:
+      yield
+      return
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self._add(row, "path_searches", 1)
+      self._add(row, "path_seconds", time.perf_counter() - start)
+
+
+def iter_profile(f_profile, sim_code=None):
+  """
+  Reads the rows of a profile file one at a time, so that a long profile can
+  be summed up without holding all of its rows in memory.
+
+  INPUT
+    f_profile: The JSON lines file that StepProfiler.end_step wrote.
+    sim_code: If given, only the rows of this simulation are returned (a
+              forked simulation starts with a copy of its parent's file).
+  OUTPUT
+    An iterator of row dictionaries.
+  """
+  with open(f_profile) as f:
+    for line in f:
+      if not line.strip():
+        continue
+      row = json.loads(line)
+      if sim_code is None or row["sim_code"] == sim_code:
+        yield row
+
+
+def read_profile(f_profile, sim_code=None):
+  """
+  Reads the rows of a profile file (see iter_profile).
+
+  OUTPUT
+    A list of row dictionaries.
+  """
+  return list(iter_profile(f_profile, sim_code))
+
+
+def total_profile(rows):
+  """
+  Sums up the rows of a profile by phase in a single pass over <rows>.
+
+  INPUT
+    rows: An iterable of row dictionaries (see iter_profile).
+  OUTPUT
+    A dictionary that takes a phase and returns its summed counters, and the
+    list of the wall times of the steps (i.e., of the "step" rows).
+  """
+  totals = dict()
+  step_seconds = []
+  for row in rows:
+    if row["phase"] not in totals:
+      totals[row["phase"]] = dict.fromkeys(StepProfiler.counters, 0)
+    for counter in StepProfiler.counters:
+      # Profiles written before a counter was added do not have it.
+      totals[row["phase"]][counter] += row.get(counter, 0)
+    if row["phase"] == "step":
+      step_seconds += [row["wall_seconds"]]
+  return totals, step_seconds
+
+
+def summarize_profile(rows):
+  """
+  Sums up the rows of a profile by phase.
+
+  INPUT
+    rows: An iterable of row dictionaries (see iter_profile).
+  OUTPUT
+    A str table with one line per phase, and the share of the total step
+    wall time that went to each.
+  """
+  totals, step_seconds = total_profile(rows)
+  if not totals:
+    return "No profiled steps."
+
+  step_wall = totals.get("step", dict()).get("wall_seconds", 0)
+  ret_str = f"profiled steps: {len(step_seconds)}\n"
+  ret_str += (f"{'phase':<10}{'wall s':>10}{'share':>8}{'llm':>8}"
+              + f"{'llm s':>10}{'cached':>8}{'shared':>8}{'tokens':>10}"
+              + f"{'embed':>8}"
+              + f"{'embed s':>10}{'path':>8}{'path s':>10}\n")
+  order = [i for i in StepProfiler.phases if i in totals]
+  order += sorted(i for i in totals if i not in order and i != "step")
+  if "step" in totals:
+    order += ["step"]
+  for phase in order:
+    t = totals[phase]
+    share = t["wall_seconds"] / step_wall if step_wall else 0
+    tokens = t["prompt_tokens"] + t["completion_tokens"]
+    ret_str += (f"{phase:<10}{t['wall_seconds']:>10.3f}{share:>8.1%}"
+                + f"{t['llm_calls']:>8}{t['llm_seconds']:>10.3f}"
+                + f"{t['llm_cache_hits']:>8}{t['llm_coalesced']:>8}"
+                + f"{tokens:>10}"
+                + f"{t['embedding_calls']:>8}"
+                + f"{t['embedding_seconds']:>10.3f}"
+                + f"{t['path_searches']:>8}{t['path_seconds']:>10.3f}\n")
+  return ret_str.rstrip("\n")
+
+
+def export_profile_csv(rows, f_csv):
+  """
+  Writes the rows of a profile to a CSV file.
+
+  INPUT
+    rows: An iterable of row dictionaries (see iter_profile).
+    f_csv: The CSV file to write.
+  OUTPUT
+    None
+  """
+  with open(f_csv, "w", newline="") as f:
+    writer = csv.DictWriter(f, fieldnames=StepProfiler.columns)
+    writer.writeheader()
+    for row in rows:
+      writer.writerow(row)
+
+
+# <step_profiler> is the profiler that the whole backend records to.
+step_profiler = StepProfiler(profile_steps)